@@ -0,0 +1,90 @@
+"""
+Partida a frio de um worker: cada rodada é um processo Python novo que
+importa o server.py e responde à primeira requisição (GET /metrics, que não
+toca no banco), como um worker do gunicorn recém-criado.
+
+Mede, por rodada:
+- import_ms:       tempo do `import server`
+- primeira_req_ms: tempo da primeira requisição
+- sql_no_import:   comandos SQL executados durante o import
+
+O banco (SQLite temporário, ou --database-url) é preparado uma vez antes
+com `flask init-db`, se o comando existir, como num deploy.
+
+Exemplos:
+    python bench/bench_inicio.py
+    python bench/bench_inicio.py --rodadas 15 --database-url postgresql://...
+    python bench/bench_inicio.py --raiz /caminho/de/outra/versao   # comparar versões
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+
+RODADA = r"""
+import sys, time, json
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+sql = [0]
+event.listen(Engine, "before_cursor_execute", lambda *a, **k: sql.__setitem__(0, sql[0] + 1))
+
+sys.path.insert(0, sys.argv[1])
+t0 = time.perf_counter()
+import server
+t1 = time.perf_counter()
+sql_import = sql[0]
+resp = server.app.test_client().get("/metrics")
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "primeira_req_ms": (t2 - t1) * 1000,
+    "sql_no_import": sql_import,
+    "status": resp.status_code,
+}))
+"""
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rodadas", type=int, default=9)
+    ap.add_argument("--database-url", help="padrão: SQLite temporário")
+    ap.add_argument("--raiz", default=RAIZ, help="pasta com o server.py a medir")
+    args = ap.parse_args()
+
+    url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_inicio_'), 'bench.db')}"
+    env = dict(os.environ, DATABASE_URL=url, ASAAS_API_KEY=os.environ.get("ASAAS_API_KEY", "bench"))
+
+    # preparação do banco, fora da medição (sem o comando, o próprio import cria tudo)
+    subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "server", "init-db"],
+        cwd=args.raiz, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    rodadas = []
+    for _ in range(args.rodadas):
+        saida = subprocess.run(
+            [sys.executable, "-c", RODADA, args.raiz], env=env, check=True, stdout=subprocess.PIPE, text=True
+        ).stdout
+        rodadas.append(json.loads(saida.strip().splitlines()[-1]))
+
+    resultado = {
+        "rodadas": len(rodadas),
+        "banco": url.split(":", 1)[0],
+        "import_ms_p50": round(statistics.median(r["import_ms"] for r in rodadas), 1),
+        "import_ms_max": round(max(r["import_ms"] for r in rodadas), 1),
+        "primeira_req_ms_p50": round(statistics.median(r["primeira_req_ms"] for r in rodadas), 1),
+        "sql_no_import": max(r["sql_no_import"] for r in rodadas),
+    }
+    print(json.dumps(resultado))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Micro-benchmark do laço dos relatórios (sem rede): montar os registros a
+partir das faturas, ordenar e serializar em JSON.
+
+Compara a forma anterior (um dict por fatura, datetime.strptime por registro,
+sort com lambda e jsonify da lista) com a atual do server.py (registros com
+__slots__, datas comparadas como texto ISO, chave de ordenação pré-calculada
+e JSON escrito direto dos atributos).
+
+As faturas vêm de bench/fake_asaas.py (DadosSinteticos), já em memória.
+
+Exemplos:
+    python bench/bench_registros.py
+    python bench/bench_registros.py --clientes 2000 --faturas 24 --repeticoes 7
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+
+
+# ---- forma anterior (cópia do que o server.py fazia) ----
+def historico_antes(cli, lista, p):
+    status_filtro = p["status"]
+    dt_ini = datetime.strptime(p["data_inicial"], "%Y-%m-%d").date() if p["data_inicial"] else None
+    dt_fim = datetime.strptime(p["data_final"], "%Y-%m-%d").date() if p["data_final"] else None
+    for fat in lista:
+        st = (fat.get("status") or "").upper()
+        if status_filtro and st != status_filtro:
+            continue
+        pay_date_str = fat.get("paymentDate")
+        if dt_ini or dt_fim:
+            if not pay_date_str:
+                continue
+            try:
+                pay_date = datetime.strptime(pay_date_str, "%Y-%m-%d").date()
+            except ValueError:
+                continue
+            if dt_ini and pay_date < dt_ini:
+                continue
+            if dt_fim and pay_date > dt_fim:
+                continue
+        yield {
+            "nome": cli.get("name"),
+            "cpf": cli.get("cpfCnpj"),
+            "polo": cli.get("complement"),
+            "fatura_id": fat.get("id"),
+            "descricao": fat.get("description"),
+            "valor": fat.get("value"),
+            "valor_liquido": fat.get("netValue"),
+            "vencimento": fat.get("dueDate"),
+            "status": st,
+            "data_pagamento": pay_date_str,
+            "link_pagamento": fat.get("invoiceUrl"),
+        }
+
+
+def ordenar_antes(registros):
+    registros.sort(key=lambda x: (x.get("nome") or "", x.get("vencimento") or ""))
+    return registros
+
+
+def _medir(fn, repeticoes):
+    melhor = None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        resultado = fn()
+        dt = time.perf_counter() - t0
+        melhor = dt if melhor is None else min(melhor, dt)
+    return melhor, resultado
+
+
+def _memoria(fn):
+    tracemalloc.start()
+    resultado = fn()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del resultado
+    return pico
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--clientes", type=int, default=500)
+    ap.add_argument("--faturas", type=int, default=24, help="faturas por cliente")
+    ap.add_argument("--repeticoes", type=int, default=5, help="melhor tempo de N execuções")
+    ap.add_argument("--data-inicial", default="2023-01-01")
+    ap.add_argument("--data-final", default="2024-12-31")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_registros_")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+    os.environ.setdefault("ASAAS_API_KEY", "bench")
+    sys.path.insert(0, RAIZ)
+    sys.path.insert(0, AQUI)
+    import server
+    from fake_asaas import DadosSinteticos
+
+    dados = DadosSinteticos(args.clientes, args.faturas, polos=1)
+    entrada = [
+        (dados.cliente(i), [dados.fatura(i, j) for j in range(args.faturas)])
+        for i in range(args.clientes)
+    ]
+    p = {"status": "RECEIVED", "data_inicial": args.data_inicial, "data_final": args.data_final}
+
+    def montar_antes():
+        return [reg for cli, lista in entrada for reg in historico_antes(cli, lista, p)]
+
+    def montar_depois():
+        return [reg for cli, lista in entrada for reg in server.registros_historico_cliente(cli, lista, p)]
+
+    with server.app.app_context():
+        t_m_antes, regs_antes = _medir(montar_antes, args.repeticoes)
+        t_m_depois, regs_depois = _medir(montar_depois, args.repeticoes)
+        t_o_antes, regs_antes = _medir(lambda: ordenar_antes(list(regs_antes)), args.repeticoes)
+        t_o_depois, regs_depois = _medir(lambda: server.ordenar_historico(list(regs_depois)), args.repeticoes)
+        t_s_antes, json_antes = _medir(
+            lambda: server.app.json.dumps(regs_antes, separators=(",", ":")), args.repeticoes
+        )
+        t_s_depois, json_depois = _medir(lambda: server.serializar(regs_depois), args.repeticoes)
+        mem_antes = _memoria(montar_antes)
+        mem_depois = _memoria(montar_depois)
+
+    if json.loads(json_antes) != json.loads(json_depois):
+        raise SystemExit("os dois caminhos produziram JSON diferente")
+
+    linhas = [
+        ("montar+filtrar", t_m_antes, t_m_depois),
+        ("ordenar", t_o_antes, t_o_depois),
+        ("serializar", t_s_antes, t_s_depois),
+        ("total", t_m_antes + t_o_antes + t_s_antes, t_m_depois + t_o_depois + t_s_depois),
+    ]
+    resultado = {
+        "registros": len(regs_depois),
+        "faturas_lidas": args.clientes * args.faturas,
+        **{f"{nome}_antes_ms": round(a * 1000, 1) for nome, a, _ in linhas},
+        **{f"{nome}_depois_ms": round(d * 1000, 1) for nome, _, d in linhas},
+        "memoria_registros_antes_mb": round(mem_antes / 2**20, 1),
+        "memoria_registros_depois_mb": round(mem_depois / 2**20, 1),
+    }
+    print(json.dumps(resultado))
+
+    print(f"{len(regs_depois)} registros de {args.clientes * args.faturas} faturas", file=sys.stderr)
+    print(f"{'etapa':<16}{'antes (ms)':>12}{'depois (ms)':>13}{'ganho':>8}", file=sys.stderr)
+    for nome, a, d in linhas:
+        print(f"{nome:<16}{a * 1000:>12.1f}{d * 1000:>13.1f}{a / d:>7.1f}x", file=sys.stderr)
+    print(
+        f"{'memória (MB)':<16}{mem_antes / 2**20:>12.1f}{mem_depois / 2**20:>13.1f}{mem_antes / mem_depois:>7.1f}x",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
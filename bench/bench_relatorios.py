@@ -0,0 +1,224 @@
+"""
+Benchmark dos relatórios contra o Asaas falso (bench/fake_asaas.py).
+
+Para cada tamanho de base sobe um fake_asaas em outro processo, aponta o
+servidor para ele (ASAAS_BASE_URL, banco SQLite temporário) e mede, via
+test_client do Flask:
+
+- clientes_frio:  get_customers_by_polo com o espelho vazio (carga inicial)
+- clientes:       get_customers_by_polo com o espelho já carregado
+- historico:      POST /api/relatorio_polo_historico (sem cache)
+- pagamentos:     POST /api/relatorio_polo_pagamentos (sem cache, 1 mês)
+
+Para cada cenário: p50/p95/máx de latência, chamadas ao Asaas (customers,
+payments, 429/5xx devolvidos) e o pico de RSS do processo até ali.
+
+Exemplos:
+    python bench/bench_relatorios.py --clientes 1000 --faturas 10
+    python bench/bench_relatorios.py --clientes 1000,10000,50000 --faturas 10,200 \\
+        --latencia 0.05 --saida bench_output.jsonl
+
+Cada resultado também sai como uma linha JSON no stdout (e em --saida),
+para comparar uma execução com outra.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from _util import percentil, porta_livre
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+
+
+def _pico_rss_mb() -> float:
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def subir_fake(args, clientes, faturas):
+    porta = porta_livre()
+    cmd = [
+        sys.executable, os.path.join(AQUI, "fake_asaas.py"),
+        "--porta", str(porta),
+        "--clientes", str(clientes),
+        "--faturas", str(faturas),
+        "--polos", str(args.polos),
+        "--latencia", str(args.latencia),
+        "--page-size", str(args.page_size),
+        "--taxa-erro", str(args.taxa_erro),
+        "--taxa-429", str(args.taxa_429),
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{porta}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/__stats", timeout=1)
+            return proc, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("fake_asaas não subiu")
+
+
+def rodar_um(args, clientes: int, faturas: int) -> list:
+    """Roda todos os cenários para um tamanho (chamado num processo novo)."""
+    proc, url = subir_fake(args, clientes, faturas)
+    tmp = tempfile.mkdtemp(prefix="bench_relatorios_")
+    os.environ.update(
+        {
+            "ASAAS_BASE_URL": url,
+            "ASAAS_API_KEY": "bench",
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "ASAAS_RPS": str(args.rps),
+            "ASAAS_BACKOFF_BASE": "0.05",
+        }
+    )
+    sys.path.insert(0, RAIZ)
+    try:
+        import server
+
+        with server.app.app_context():
+            server.bootstrap_db()
+
+        http = server.app.test_client()
+        polo = "Polo 0"
+        # um mês fechado qualquer dentro do período das faturas sintéticas
+        pagamentos_body = {
+            "polo": polo,
+            "data_inicial": "2023-03-01",
+            "data_final": "2023-03-31",
+            "sem_cache": True,
+            "max_clientes": args.max_clientes,
+        }
+        historico_body = {"polo": polo, "sem_cache": True, "max_clientes": args.max_clientes}
+
+        def clientes_polo():
+            with server.app.app_context():
+                return len(server.get_customers_by_polo(polo, max_customers=args.max_clientes))
+
+        def relatorio(path, body, campo):
+            def _f():
+                j = http.post(path, json=body).get_json()
+                if j.get("status") != "ok":
+                    raise RuntimeError(j.get("mensagem"))
+                return len(j[campo])
+            return _f
+
+        cenarios = [
+            ("clientes_frio", clientes_polo, 1),
+            ("clientes", clientes_polo, args.repeticoes),
+            ("historico", relatorio("/api/relatorio_polo_historico", historico_body, "faturas"), args.repeticoes),
+            ("pagamentos", relatorio("/api/relatorio_polo_pagamentos", pagamentos_body, "pagamentos"), args.repeticoes),
+        ]
+
+        resultados = []
+        for nome, fn, repeticoes in cenarios:
+            requests.post(f"{url}/__reset", timeout=5)
+            tempos, registros = [], None
+            for _ in range(repeticoes):
+                t0 = time.perf_counter()
+                registros = fn()
+                tempos.append(time.perf_counter() - t0)
+            stats = requests.get(f"{url}/__stats", timeout=5).json()
+
+            resultados.append(
+                {
+                    "cenario": nome,
+                    "clientes": clientes,
+                    "faturas_por_cliente": faturas,
+                    "latencia_asaas_s": args.latencia,
+                    "repeticoes": repeticoes,
+                    "registros": registros,
+                    "p50_ms": round(percentil(tempos, 50) * 1000, 1),
+                    "p95_ms": round(percentil(tempos, 95) * 1000, 1),
+                    "max_ms": round(max(tempos) * 1000, 1),
+                    "chamadas_customers": stats["customers"] / repeticoes,
+                    "chamadas_payments": stats["payments"] / repeticoes,
+                    "respostas_429": stats["respostas_429"],
+                    "erros_5xx": stats["erros_5xx"],
+                    "pico_rss_mb": _pico_rss_mb(),
+                }
+            )
+        return resultados
+    finally:
+        proc.kill()
+
+
+def imprimir(resultados):
+    colunas = [
+        "cenario", "clientes", "faturas_por_cliente", "registros", "p50_ms", "p95_ms",
+        "chamadas_customers", "chamadas_payments", "respostas_429", "erros_5xx", "pico_rss_mb",
+    ]
+    larguras = [max(len(c), *(len(str(r[c])) for r in resultados)) for c in colunas]
+    print("  ".join(c.ljust(w) for c, w in zip(colunas, larguras)), file=sys.stderr)
+    for r in resultados:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(colunas, larguras)), file=sys.stderr)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--clientes", default="1000", help="tamanhos separados por vírgula (ex.: 1000,10000,50000)")
+    ap.add_argument("--faturas", default="10", help="faturas por cliente, separadas por vírgula (ex.: 10,200)")
+    ap.add_argument("--polos", type=int, default=20)
+    ap.add_argument("--latencia", type=float, default=0.0, help="latência do Asaas falso por chamada (s)")
+    ap.add_argument("--page-size", type=int, default=100)
+    ap.add_argument("--taxa-erro", type=float, default=0.0)
+    ap.add_argument("--taxa-429", type=float, default=0.0)
+    ap.add_argument("--rps", type=float, default=0, help="ASAAS_RPS do servidor (0 = sem limite)")
+    ap.add_argument("--max-clientes", type=int, default=250)
+    ap.add_argument("--repeticoes", type=int, default=5)
+    ap.add_argument("--saida", help="acrescenta as linhas JSON neste arquivo")
+    ap.add_argument("--um", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.um:
+        for r in rodar_um(args, int(args.clientes), int(args.faturas)):
+            print(json.dumps(r))
+        return
+
+    # cada tamanho num processo novo: pico de RSS e caches não se misturam
+    resultados = []
+    tamanhos = itertools.product(
+        [int(x) for x in args.clientes.split(",")],
+        [int(x) for x in args.faturas.split(",")],
+    )
+    for clientes, faturas in tamanhos:
+        cmd = [
+            sys.executable, os.path.abspath(__file__), "--um",
+            "--clientes", str(clientes),
+            "--faturas", str(faturas),
+            "--polos", str(args.polos),
+            "--latencia", str(args.latencia),
+            "--page-size", str(args.page_size),
+            "--taxa-erro", str(args.taxa_erro),
+            "--taxa-429", str(args.taxa_429),
+            "--rps", str(args.rps),
+            "--max-clientes", str(args.max_clientes),
+            "--repeticoes", str(args.repeticoes),
+        ]
+        saida = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+        for linha in saida.splitlines():
+            if linha.startswith("{"):
+                resultados.append(json.loads(linha))
+                print(linha)
+
+    if args.saida:
+        with open(args.saida, "a", encoding="utf-8") as f:
+            for r in resultados:
+                f.write(json.dumps(r) + "\n")
+    imprimir(resultados)
+
+
+if __name__ == "__main__":
+    main()
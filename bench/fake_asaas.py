@@ -0,0 +1,218 @@
+"""
+Servidor local que imita as listagens /customers e /payments do Asaas com
+dados sintéticos, para medir o servidor sem usar a conta real.
+
+Os dados são gerados sob demanda a partir do índice do cliente/fatura
+(nada de 10 milhões de dicts em memória):
+
+- cliente i: id cus_{i}, polo "Polo {i % polos}", listados do mais novo (i=0) ao mais antigo;
+- fatura j do cliente i: vencimento mensal a partir de 2023-01-05, status
+  RECEIVED / PENDING / OVERDUE sorteado de forma determinística.
+
+Uso:
+    python bench/fake_asaas.py --porta 18080 --clientes 10000 --faturas 50 --latencia 0.05
+
+Aponte o servidor para ele com ASAAS_BASE_URL=http://127.0.0.1:18080.
+GET /__stats devolve as contagens de chamadas; POST /__reset zera.
+"""
+
+import argparse
+import logging
+import random
+import threading
+import time
+from array import array
+from datetime import date
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+STATUS = ("RECEIVED", "RECEIVED", "RECEIVED", "PENDING", "OVERDUE")
+
+
+class DadosSinteticos:
+    def __init__(self, clientes: int, faturas: int, polos: int, semente: int = 42):
+        self.clientes = clientes
+        self.faturas = faturas
+        self.polos = max(1, polos)
+        self.semente = semente
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def cliente(self, i: int) -> dict:
+        criado = date.fromordinal(date(2025, 12, 31).toordinal() - i // 10)
+        return {
+            "object": "customer",
+            "id": f"cus_{i:08d}",
+            "dateCreated": criado.isoformat(),
+            "name": f"Aluno {i}",
+            "cpfCnpj": f"{i:011d}",
+            "complement": f"Polo {i % self.polos}",
+            "deleted": False,
+        }
+
+    def fatura(self, i: int, j: int) -> dict:
+        h = (i * 1_000_003 + j * 7919 + self.semente) % 1_000_000_007
+        status = STATUS[h % len(STATUS)]
+        ano, mes = 2023 + j // 12, j % 12 + 1
+        venc = f"{ano:04d}-{mes:02d}-05"
+        pago = f"{ano:04d}-{mes:02d}-{1 + h % 28:02d}" if status == "RECEIVED" else None
+        return {
+            "object": "payment",
+            "id": f"pay_{i:08d}_{j:04d}",
+            "customer": f"cus_{i:08d}",
+            "value": 100.0 + (h % 50),
+            "netValue": 97.5 + (h % 50),
+            "status": status,
+            "dueDate": venc,
+            "paymentDate": pago,
+            "description": f"Mensalidade {mes:02d}/{ano}",
+            "invoiceUrl": f"https://example.invalid/i/{i}/{j}",
+            "deleted": False,
+        }
+
+    @staticmethod
+    def _passa(fat: dict, status, ge, le, venc_ge=None, venc_le=None) -> bool:
+        if status and fat["status"] != status:
+            return False
+        if ge or le:
+            pd = fat["paymentDate"]
+            if not pd or (ge and pd < ge) or (le and pd > le):
+                return False
+        if (venc_ge and fat["dueDate"] < venc_ge) or (venc_le and fat["dueDate"] > venc_le):
+            return False
+        return True
+
+    def faturas_do_cliente(self, i: int, *filtro) -> list:
+        return [
+            f for f in (self.fatura(i, j) for j in range(self.faturas))
+            if self._passa(f, *filtro)
+        ]
+
+    def indice_conta(self, *filtro) -> array:
+        """Posições (i * faturas + j) das faturas que passam no filtro, montado uma vez por filtro."""
+        chave = filtro
+        with self._lock:
+            idx = self._indices.get(chave)
+            if idx is None:
+                idx = array("Q")
+                for i in range(self.clientes):
+                    for j in range(self.faturas):
+                        if self._passa(self.fatura(i, j), *filtro):
+                            idx.append(i * self.faturas + j)
+                self._indices[chave] = idx
+            return idx
+
+
+def criar_app(dados: DadosSinteticos, *, latencia=0.0, page_size=100, taxa_erro=0.0, taxa_429=0.0):
+    app = Flask("fake_asaas")
+    stats = {"customers": 0, "payments": 0, "erros_5xx": 0, "respostas_429": 0}
+    lock = threading.Lock()
+    rnd = random.Random(7)
+
+    def contar(nome):
+        with lock:
+            stats[nome] += 1
+
+    def falha():
+        if latencia:
+            time.sleep(latencia)
+        sorteio = rnd.random()
+        if sorteio < taxa_429:
+            contar("respostas_429")
+            return jsonify({"errors": [{"code": "rate_limit"}]}), 429, {"Retry-After": "1"}
+        if sorteio < taxa_429 + taxa_erro:
+            contar("erros_5xx")
+            return jsonify({"errors": [{"code": "internal"}]}), 503
+        return None
+
+    def pagina(total, obter):
+        offset = int(request.args.get("offset", 0))
+        limit = min(int(request.args.get("limit", 10)), page_size)
+        fim = min(offset + limit, total)
+        return jsonify(
+            {
+                "object": "list",
+                "hasMore": fim < total,
+                "totalCount": total,
+                "limit": limit,
+                "offset": offset,
+                "data": [obter(k) for k in range(offset, fim)],
+            }
+        )
+
+    @app.get("/customers")
+    def customers():
+        contar("customers")
+        erro = falha()
+        if erro:
+            return erro
+        return pagina(dados.clientes, dados.cliente)
+
+    @app.get("/payments")
+    def payments():
+        contar("payments")
+        erro = falha()
+        if erro:
+            return erro
+        a = request.args
+        filtro = (
+            a.get("status"),
+            a.get("paymentDate[ge]"),
+            a.get("paymentDate[le]"),
+            a.get("dueDate[ge]"),
+            a.get("dueDate[le]"),
+        )
+
+        cliente = a.get("customer")
+        if cliente:
+            i = int(cliente.split("_")[1])
+            lista = dados.faturas_do_cliente(i, *filtro) if i < dados.clientes else []
+            return pagina(len(lista), lista.__getitem__)
+
+        idx = dados.indice_conta(*filtro)
+        return pagina(len(idx), lambda k: dados.fatura(*divmod(idx[k], dados.faturas)))
+
+    @app.get("/__stats")
+    def ver_stats():
+        with lock:
+            return jsonify(dict(stats))
+
+    @app.post("/__reset")
+    def reset():
+        with lock:
+            for k in stats:
+                stats[k] = 0
+        return jsonify({"ok": True})
+
+    return app
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--porta", type=int, default=18080)
+    ap.add_argument("--clientes", type=int, default=1000)
+    ap.add_argument("--faturas", type=int, default=10, help="faturas por cliente")
+    ap.add_argument("--polos", type=int, default=20)
+    ap.add_argument("--latencia", type=float, default=0.0, help="segundos por chamada")
+    ap.add_argument("--page-size", type=int, default=100, help="limite máximo por página")
+    ap.add_argument("--taxa-erro", type=float, default=0.0, help="fração de respostas 503")
+    ap.add_argument("--taxa-429", type=float, default=0.0, help="fração de respostas 429")
+    args = ap.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    dados = DadosSinteticos(args.clientes, args.faturas, args.polos)
+    app = criar_app(
+        dados,
+        latencia=args.latencia,
+        page_size=args.page_size,
+        taxa_erro=args.taxa_erro,
+        taxa_429=args.taxa_429,
+    )
+    srv = make_server("127.0.0.1", args.porta, app, threaded=True)
+    print(f"fake Asaas em http://127.0.0.1:{args.porta}", flush=True)
+    srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
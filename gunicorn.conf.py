@@ -0,0 +1,11 @@
+# Configuração lida automaticamente pelo gunicorn (gunicorn server:app).
+
+
+def on_starting(arbiter):
+    """Prepara o banco uma vez, no processo mestre, antes de criar os workers."""
+    from server import app, bootstrap_db, db
+
+    with app.app_context():
+        bootstrap_db()
+        # os workers nascem por fork: não herdam conexões abertas aqui
+        db.engine.dispose()
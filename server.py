@@ -1,16 +1,78 @@
-vsdvss
-dfrom flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_request_context, request, jsonify, stream_with_context
 import os
 import secrets
-from datetime import datetime, date
+import sqlite3
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import datetime, date, timedelta
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter, itemgetter
+from urllib.parse import urlencode
+import base64
+import bisect
+import contextvars
+import csv
+import gzip
+import hashlib
+import io
+import zlib
+import click
+from contextlib import contextmanager
 import requests
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+
+try:
+    import brotli  # opcional: sem ele as respostas saem só em gzip/deflate
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
 # ========= CONFIG BANCO DE DADOS (PARCEIROS) =========
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///partners.db")
+
+# Pool de conexões de cada worker (ver bench/bench_login_admin.py). Com threads no
+# gunicorn, DB_POOL_SIZE + DB_MAX_OVERFLOW deve cobrir as threads do worker.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# testa a conexão antes de usar (o Postgres hospedado derruba conexões ociosas)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# recicla conexões mais velhas que isso (s); -1 desliga
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# SQLite em modo WAL: leituras não esperam escritas de outros workers
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+
+
+def _opcoes_engine(url: str) -> dict:
+    opcoes = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    # SQLite em memória usa um pool próprio, sem tamanho
+    if not (url.startswith("sqlite") and (url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url)):
+        opcoes.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return opcoes
+
+
+@event.listens_for(Engine, "connect")
+def _configurar_sqlite(conexao, _registro):
+    if not SQLITE_WAL or not isinstance(conexao, sqlite3.Connection):
+        return
+    cur = conexao.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.close()
+
+
 app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = _opcoes_engine(DATABASE_URL)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 db = SQLAlchemy(app)
 
@@ -21,24 +83,100 @@ FIXED_KEYS = {
     "LUCIANO.POLO": {"nome": "Luciano", "polo": "Polo Luciano", "expira_em": None},
 }
 
+# Cache de parceiros do /login (por worker): de quanto em quanto tempo (s) cada
+# worker confere no banco se o /admin alterou alguma chave.
+PARCEIROS_CACHE_TTL = int(os.getenv("PARCEIROS_CACHE_TTL", "30"))
+PARCEIROS_CACHE_MAX = int(os.getenv("PARCEIROS_CACHE_MAX", "10000"))
+
+# Relatórios em segundo plano: threads por worker e por quanto tempo (h) o
+# resultado fica guardado no banco.
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "2"))
+JOB_RETENCAO_HORAS = int(os.getenv("JOB_RETENCAO_HORAS", "24"))
+# job "executando" sem sinal de vida por esse tempo (s) é considerado perdido
+JOB_SEM_PROGRESSO = int(os.getenv("JOB_SEM_PROGRESSO", "600"))
+
+ADMIN_POR_PAGINA = int(os.getenv("ADMIN_POR_PAGINA", "50"))
+# máximo de linhas por importação de parceiros (CSV/JSON)
+PARCEIROS_IMPORTACAO_MAX = int(os.getenv("PARCEIROS_IMPORTACAO_MAX", "5000"))
+
 # ========= CONFIG ASAAS =========
 ASAAS_API_KEY = os.getenv("ASAAS_API_KEY", "SUA_CHAVE_API_AQUI")
 ASAAS_BASE_URL = os.getenv("ASAAS_BASE_URL", "https://www.asaas.com/api/v3")
+# Token configurado no webhook do Asaas (enviado no header asaas-access-token).
+# Sem ele o /webhook/asaas recusa todos os eventos.
+ASAAS_WEBHOOK_TOKEN = os.getenv("ASAAS_WEBHOOK_TOKEN", "")
+# O livro local de pagamentos só responde relatórios com o webhook configurado e
+# se a última carga/conciliação (sincronizar-pagamentos) tiver no máximo estas
+# horas; depois disso volta a consulta ao vivo. 0 desliga o corte.
+LIVRO_VALIDADE_HORAS = float(os.getenv("LIVRO_VALIDADE_HORAS", "26"))
 
 DEFAULT_TIMEOUT = int(os.getenv("DEFAULT_TIMEOUT", "30"))
 
+# Cliente HTTP compartilhado: conexões mantidas por worker, tentativas em 429/5xx
+# (backoff exponencial com jitter) e limite de requisições por segundo (token bucket).
+ASAAS_POOL_SIZE = int(os.getenv("ASAAS_POOL_SIZE", "20"))
+ASAAS_MAX_TENTATIVAS = int(os.getenv("ASAAS_MAX_TENTATIVAS", "4"))
+ASAAS_BACKOFF_BASE = float(os.getenv("ASAAS_BACKOFF_BASE", "0.5"))
+ASAAS_BACKOFF_MAX = float(os.getenv("ASAAS_BACKOFF_MAX", "10"))
+ASAAS_RPS = float(os.getenv("ASAAS_RPS", "10"))
+ASAAS_BURST = int(os.getenv("ASAAS_BURST", "20"))
+# Disjuntor: depois de tantas falhas seguidas (5xx, timeout, erro de rede) as chamadas
+# falham na hora durante ASAAS_CIRCUITO_ESPERA segundos (0 desliga).
+ASAAS_CIRCUITO_FALHAS = int(os.getenv("ASAAS_CIRCUITO_FALHAS", "5"))
+ASAAS_CIRCUITO_ESPERA = float(os.getenv("ASAAS_CIRCUITO_ESPERA", "30"))
+
+# Prazo (s) de cada relatório: os timeouts das chamadas saem do que resta dele e,
+# quando acaba, a resposta sai com o que já foi lido ("parcial": true). 0 desliga.
+# O pedido pode mandar "prazo", limitado a RELATORIO_PRAZO_MAX.
+RELATORIO_PRAZO = float(os.getenv("RELATORIO_PRAZO", "25"))
+RELATORIO_PRAZO_MAX = float(os.getenv("RELATORIO_PRAZO_MAX", "120"))
+
 DEFAULT_MAX_CLIENTES = int(os.getenv("DEFAULT_MAX_CLIENTES", "250"))
 DEFAULT_MAX_FATURAS_CLIENTE = int(os.getenv("DEFAULT_MAX_FATURAS_CLIENTE", "60"))
 DEFAULT_MAX_REGISTROS = int(os.getenv("DEFAULT_MAX_REGISTROS", "5000"))
 
+# Cache dos relatórios: validade (s), janela extra em que a resposta velha ainda é
+# servida enquanto atualiza em segundo plano (s, 0 desliga) e limite de memória.
+RELATORIO_CACHE_TTL = int(os.getenv("RELATORIO_CACHE_TTL", "300"))
+RELATORIO_CACHE_STALE = int(os.getenv("RELATORIO_CACHE_STALE", "900"))
+RELATORIO_CACHE_MAX_ITENS = int(os.getenv("RELATORIO_CACHE_MAX_ITENS", "200"))
+RELATORIO_CACHE_MAX_REGISTROS = int(os.getenv("RELATORIO_CACHE_MAX_REGISTROS", "100000"))
 
-# ========= HEADERS =========
-def asaas_headers():
-    return {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "access_token": ASAAS_API_KEY,
-    }
+# Visão geral de todos os polos (/api/visao_geral): validade (s) do resultado e
+# janela extra em que ele ainda é servido enquanto recalcula em segundo plano.
+VISAO_GERAL_CACHE_TTL = int(os.getenv("VISAO_GERAL_CACHE_TTL", "600"))
+VISAO_GERAL_CACHE_STALE = int(os.getenv("VISAO_GERAL_CACHE_STALE", "1800"))
+
+# Paginação dos relatórios: por quanto tempo (s) o snapshot do resultado fica no
+# banco para servir as páginas seguintes e o maior tamanho de página aceito.
+RELATORIO_SNAPSHOT_TTL = int(os.getenv("RELATORIO_SNAPSHOT_TTL", "600"))
+RELATORIO_PAGINA_MAX = int(os.getenv("RELATORIO_PAGINA_MAX", "1000"))
+
+# Partições mensais de pagamentos (banco): validade (s) da partição do mês em aberto
+# e quantos dias depois do fim do mês ela passa a ser considerada fechada (congelada).
+PAGAMENTOS_MES_TTL = int(os.getenv("PAGAMENTOS_MES_TTL", "300"))
+PAGAMENTOS_MES_CARENCIA = int(os.getenv("PAGAMENTOS_MES_CARENCIA", "3"))
+
+# Compressão das respostas JSON: só acima deste tamanho (bytes) e neste nível.
+RESPOSTA_COMPRESSAO_MIN = int(os.getenv("RESPOSTA_COMPRESSAO_MIN", "1024"))
+RESPOSTA_COMPRESSAO_NIVEL = int(os.getenv("RESPOSTA_COMPRESSAO_NIVEL", "6"))
+
+# Tamanho máximo de página aceito pelo Asaas nas listagens.
+ASAAS_MAX_PAGE_SIZE = 100
+
+# Quantas chamadas GET /payments podem estar em andamento ao mesmo tempo por relatório.
+ASAAS_MAX_CONCORRENCIA = int(os.getenv("ASAAS_MAX_CONCORRENCIA", "8"))
+
+# Espelho local de clientes: intervalo mínimo entre sincronizações incrementais
+# (segundos) e intervalo entre varreduras completas (horas).
+CLIENTES_SYNC_INTERVALO = int(os.getenv("CLIENTES_SYNC_INTERVALO", "300"))
+CLIENTES_SYNC_COMPLETA_HORAS = int(os.getenv("CLIENTES_SYNC_COMPLETA_HORAS", "24"))
+# Só um worker sincroniza por vez (trava no banco com essa validade, em segundos).
+# A varredura completa nunca roda dentro de uma requisição: vem do cron
+# (flask sincronizar-clientes --completa) ou de uma thread em segundo plano do worker;
+# com o espelho ainda vazio, o relatório espera a carga até CLIENTES_SYNC_ESPERA segundos.
+CLIENTES_SYNC_TRAVA = int(os.getenv("CLIENTES_SYNC_TRAVA", "600"))
+CLIENTES_SYNC_ESPERA = int(os.getenv("CLIENTES_SYNC_ESPERA", "20"))
 
 
 def _norm(s: str) -> str:
@@ -59,6 +197,440 @@ def ensure_asaas_configured():
     return True, None
 
 
+# ========= MÉTRICAS =========
+class Metricas:
+    """
+    Contadores e histogramas em memória, exportados no formato texto do Prometheus.
+    Cada worker do gunicorn tem os seus; o label 'pid' separa as séries.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tipos = {}  # nome -> (tipo, ajuda)
+        self._contadores = {}  # (nome, labels) -> valor
+        self._histogramas = {}  # (nome, labels) -> [contagens por bucket, soma, total]
+
+    def declarar(self, nome: str, tipo: str, ajuda: str):
+        self._tipos[nome] = (tipo, ajuda)
+
+    @staticmethod
+    def _labels(labels: dict) -> tuple:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, nome: str, valor: float = 1, **labels):
+        chave = (nome, self._labels(labels))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, nome: str, segundos: float, **labels):
+        chave = (nome, self._labels(labels))
+        with self._lock:
+            h = self._histogramas.get(chave)
+            if h is None:
+                h = self._histogramas[chave] = [[0] * len(self.BUCKETS), 0.0, 0]
+            i = bisect.bisect_left(self.BUCKETS, segundos)
+            if i < len(self.BUCKETS):
+                h[0][i] += 1
+            h[1] += segundos
+            h[2] += 1
+
+    def texto(self) -> str:
+        pid = str(os.getpid())
+
+        def fmt(nome, labels, valor, extra=()):
+            todos = list(labels) + list(extra) + [("pid", pid)]
+            corpo = ",".join(f'{k}="{v}"' for k, v in todos)
+            return f"{nome}{{{corpo}}} {valor}"
+
+        linhas = []
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {k: (list(v[0]), v[1], v[2]) for k, v in self._histogramas.items()}
+
+        for nome, (tipo, ajuda) in sorted(self._tipos.items()):
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            if tipo == "counter":
+                for (n, labels), valor in sorted(contadores.items()):
+                    if n == nome:
+                        linhas.append(fmt(nome, labels, valor))
+            else:
+                for (n, labels), (buckets, soma, total) in sorted(histogramas.items()):
+                    if n != nome:
+                        continue
+                    acumulado = 0
+                    for limite, qtd in zip(self.BUCKETS, buckets):
+                        acumulado += qtd
+                        linhas.append(fmt(f"{nome}_bucket", labels, acumulado, [("le", limite)]))
+                    linhas.append(fmt(f"{nome}_bucket", labels, total, [("le", "+Inf")]))
+                    linhas.append(fmt(f"{nome}_sum", labels, round(soma, 6)))
+                    linhas.append(fmt(f"{nome}_count", labels, total))
+        return "\n".join(linhas) + "\n"
+
+
+metricas = Metricas()
+metricas.declarar("asaas_requisicoes_total", "counter", "Chamadas HTTP ao Asaas (cada tentativa), por rota e resultado.")
+metricas.declarar("asaas_latencia_segundos", "histogram", "Latência de cada chamada HTTP ao Asaas.")
+metricas.declarar("asaas_retentativas_total", "counter", "Chamadas ao Asaas repetidas após 429/5xx/erro de rede.")
+metricas.declarar("asaas_espera_limitador_segundos_total", "counter", "Tempo parado no limitador de taxa (ASAAS_RPS) antes das chamadas.")
+metricas.declarar("asaas_falhas_total", "counter", "Chamadas ao Asaas que falharam depois de todas as tentativas.")
+metricas.declarar("asaas_interrompidas_total", "counter", "Chamadas ao Asaas não feitas (ou não repetidas) por prazo esgotado ou circuito aberto.")
+metricas.declarar("asaas_circuito_aberturas_total", "counter", "Vezes em que o disjuntor do Asaas abriu.")
+metricas.declarar("relatorio_requisicoes_total", "counter", "Relatórios pedidos, por tipo e resultado do cache.")
+metricas.declarar("relatorio_fase_segundos", "histogram", "Tempo de cada fase da geração dos relatórios.")
+metricas.declarar("relatorio_faturas_lidas_total", "counter", "Faturas lidas (Asaas ou livro local) para montar relatórios.")
+metricas.declarar("relatorio_registros_devolvidos_total", "counter", "Registros devolvidos nos relatórios.")
+metricas.declarar("relatorio_particoes_total", "counter", "Partições (polo, mês) de pagamentos lidas do banco ou buscadas no Asaas.")
+metricas.declarar("relatorio_clientes_com_falha_total", "counter", "Clientes cujas faturas não puderam ser lidas.")
+metricas.declarar("relatorio_clientes_pulados_total", "counter", "Clientes deixados de fora porque o prazo do relatório acabou.")
+
+
+def _relatorio_atual() -> str:
+    return getattr(g, "relatorio", "outro") if has_request_context() else "segundo_plano"
+
+
+def registrar_fase(fase: str, segundos: float):
+    """Histograma da fase + acumulado da requisição atual (vai no header Server-Timing)."""
+    metricas.observar("relatorio_fase_segundos", segundos, relatorio=_relatorio_atual(), fase=fase)
+    if has_request_context():
+        fases = g.setdefault("fases", {})
+        fases[fase] = fases.get(fase, 0.0) + segundos
+
+
+@contextmanager
+def fase(nome: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_fase(nome, time.perf_counter() - inicio)
+
+
+def cronometrar_faturas(fonte):
+    """
+    Repassa (cliente, faturas) de fonte separando o tempo esperando as faturas
+    (fase 'busca_faturas') do tempo gasto por quem consome (fase 'filtro').
+    """
+    espera = processamento = 0.0
+    lidas = 0
+    it = iter(fonte)
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                cli, lista = next(it)
+            except StopIteration:
+                espera += time.perf_counter() - t0
+                return
+            t1 = time.perf_counter()
+            espera += t1 - t0
+            lidas += len(lista)
+            yield cli, lista
+            processamento += time.perf_counter() - t1
+    finally:
+        registrar_fase("busca_faturas", espera)
+        registrar_fase("filtro", processamento)
+        metricas.inc("relatorio_faturas_lidas_total", lidas, relatorio=_relatorio_atual())
+
+
+# ========= CLIENTE ASAAS =========
+class AsaasError(Exception):
+    def __init__(self, mensagem: str, status=None):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class PrazoEsgotado(AsaasError):
+    """O prazo do relatório acabou antes (ou no meio) da chamada."""
+
+
+class CircuitoAberto(AsaasError):
+    """O disjuntor está aberto: o Asaas vem falhando e a chamada nem é feita."""
+
+
+class Prazo:
+    """
+    Prazo de um relatório (segundos=None: sem limite) e o que ficou de fora dele:
+    clientes pulados porque o tempo acabou, clientes cujas faturas falharam e
+    páginas da consulta da conta inteira que não chegaram a ser lidas.
+    """
+
+    def __init__(self, segundos=None):
+        self.fim = None if segundos is None else time.monotonic() + segundos
+        self.clientes_pulados = 0
+        self.clientes_com_falha = 0
+        self.paginas_puladas = 0
+
+    def restante(self):
+        return None if self.fim is None else self.fim - time.monotonic()
+
+    def timeout(self, maximo: float) -> float:
+        """Timeout da próxima chamada: o menor entre maximo e o que resta do prazo."""
+        restante = self.restante()
+        if restante is None:
+            return maximo
+        if restante <= 0.05:
+            raise PrazoEsgotado("prazo do relatório esgotado")
+        return min(maximo, restante)
+
+    @property
+    def parcial(self) -> bool:
+        return bool(self.clientes_pulados or self.clientes_com_falha or self.paginas_puladas)
+
+    def to_dict(self) -> dict:
+        return {
+            "parcial": self.parcial,
+            "clientes_pulados": self.clientes_pulados,
+            "clientes_com_falha": self.clientes_com_falha,
+            "paginas_puladas": self.paginas_puladas,
+        }
+
+
+# prazo do relatório em andamento; buscar_em_paralelo leva o contexto para as threads
+_prazo = contextvars.ContextVar("prazo", default=None)
+
+
+def prazo_atual():
+    return _prazo.get()
+
+
+@contextmanager
+def com_prazo(segundos=None):
+    pz = Prazo(segundos)
+    token = _prazo.set(pz)
+    try:
+        yield pz
+    finally:
+        _prazo.reset(token)
+
+
+@contextmanager
+def sem_prazo():
+    """Trabalho que não pertence ao relatório (ex.: sincronizar o espelho) não herda o prazo dele."""
+    token = _prazo.set(None)
+    try:
+        yield
+    finally:
+        _prazo.reset(token)
+
+
+def relatorio_parcial() -> bool:
+    pz = prazo_atual()
+    return pz is not None and pz.parcial
+
+
+class Circuito:
+    """
+    Disjuntor do cliente do Asaas (por worker). Depois de 'limite' falhas seguidas
+    as chamadas falham na hora (CircuitoAberto) por 'espera' segundos; passado esse
+    tempo uma única chamada de teste decide se fecha de novo ou volta a abrir.
+    """
+
+    def __init__(self, limite: int, espera: float):
+        self.limite = limite
+        self.espera = espera
+        self._falhas = 0
+        self._aberto_ate = 0.0
+        self._testando_ate = 0.0  # chamada de teste em andamento até (monotonic)
+        self._lock = threading.Lock()
+
+    def permitir(self, timeout: float = DEFAULT_TIMEOUT):
+        if self.limite <= 0:
+            return
+        with self._lock:
+            if self._falhas < self.limite:
+                return
+            agora = time.monotonic()
+            # teste que nunca registrou resultado (thread morta etc.) vence junto com o timeout dele
+            if agora < self._aberto_ate or agora < self._testando_ate:
+                raise CircuitoAberto("Asaas indisponível no momento (circuito aberto)")
+            self._testando_ate = agora + timeout + 1
+
+    def registrar(self, ok):
+        """ok=True: Asaas respondeu; False: 5xx/timeout/erro de rede; None: inconclusivo."""
+        if self.limite <= 0:
+            return
+        with self._lock:
+            self._testando_ate = 0.0
+            if ok is None:
+                return
+            if ok:
+                self._falhas = 0
+                return
+            self._falhas += 1
+            if self._falhas >= self.limite:
+                if time.monotonic() >= self._aberto_ate:
+                    metricas.inc("asaas_circuito_aberturas_total")
+                self._aberto_ate = time.monotonic() + self.espera
+
+
+class TokenBucket:
+    """Limita a taxa de chamadas: 'taxa' fichas por segundo, até 'capacidade' acumuladas."""
+
+    def __init__(self, taxa: float, capacidade: int):
+        self.taxa = float(taxa)
+        self.capacidade = max(1, int(capacidade))
+        self._fichas = float(self.capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        if self.taxa <= 0:
+            return
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._fichas = min(self.capacidade, self._fichas + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) / self.taxa
+            time.sleep(espera)
+
+
+class AsaasClient:
+    """
+    Sessão HTTP única por worker para a API do Asaas.
+    Reaproveita conexões (keep-alive), repete 429/5xx/erros de rede com
+    backoff exponencial + jitter (respeitando Retry-After) e passa toda
+    chamada pelo token bucket e pelo disjuntor. Qualquer falha do requests
+    sai como AsaasError. Dentro de um relatório com
+    prazo, o timeout de cada tentativa é o que resta do prazo (no máximo o normal).
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        *,
+        pool_size: int = ASAAS_POOL_SIZE,
+        max_tentativas: int = ASAAS_MAX_TENTATIVAS,
+        rps: float = ASAAS_RPS,
+        burst: int = ASAAS_BURST,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_tentativas = max(1, max_tentativas)
+        self.limitador = TokenBucket(rps, burst)
+        self.circuito = Circuito(ASAAS_CIRCUITO_FALHAS, ASAAS_CIRCUITO_ESPERA)
+
+        self.session = requests.Session()
+        self.session.headers.update(
+            {
+                "accept": "application/json",
+                "content-type": "application/json",
+                "access_token": api_key,
+            }
+        )
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(1, pool_size), pool_block=True
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _espera(self, tentativa: int, resp=None) -> float:
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), ASAAS_BACKOFF_MAX)
+            except ValueError:
+                pass
+        return random.uniform(0, min(ASAAS_BACKOFF_MAX, ASAAS_BACKOFF_BASE * (2 ** tentativa)))
+
+    def get(self, path: str, params=None, *, timeout=None) -> dict:
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        rota = "/" + path.strip("/").split("/")[0]
+        normal = timeout or DEFAULT_TIMEOUT
+        pz = prazo_atual()
+        ultimo_erro = None
+
+        try:
+            for tentativa in range(self.max_tentativas):
+                if tentativa:
+                    metricas.inc("asaas_retentativas_total", rota=rota)
+                if pz is not None:
+                    pz.timeout(normal)
+                inicio = time.perf_counter()
+                self.limitador.adquirir()
+                metricas.inc("asaas_espera_limitador_segundos_total", time.perf_counter() - inicio, rota=rota)
+                limite = pz.timeout(normal) if pz is not None else normal
+                self.circuito.permitir(limite)
+
+                resp = None
+                inicio = time.perf_counter()
+                try:
+                    resp = self.session.get(url, params=params, timeout=limite)
+                except requests.RequestException as e:
+                    # inclui corpo truncado (ChunkedEncodingError), erro de descompressão etc.
+                    ultimo_erro = AsaasError(f"GET {path}: {e}")
+                    if isinstance(e, requests.Timeout):
+                        resultado = "timeout"
+                    elif isinstance(e, requests.ConnectionError):
+                        resultado = "erro_rede"
+                    else:
+                        resultado = "erro_http"
+                    # timeout encurtado pelo prazo do relatório não diz nada sobre o Asaas
+                    encurtado = isinstance(e, requests.Timeout) and limite < normal
+                    self.circuito.registrar(None if encurtado else False)
+                except BaseException:
+                    # nada de chamada de teste presa: o circuito não pode ficar meio-aberto para sempre
+                    self.circuito.registrar(None)
+                    raise
+                else:
+                    resultado = str(resp.status_code)
+                    # 429 é o limite de taxa, não indisponibilidade
+                    self.circuito.registrar(None if resp.status_code == 429 else resp.status_code < 500)
+                metricas.observar("asaas_latencia_segundos", time.perf_counter() - inicio, rota=rota)
+                metricas.inc("asaas_requisicoes_total", rota=rota, resultado=resultado)
+
+                if resp is not None:
+                    if resp.status_code < 400:
+                        try:
+                            return resp.json()
+                        except ValueError as e:
+                            metricas.inc("asaas_falhas_total", rota=rota)
+                            raise AsaasError(f"GET {path}: resposta inválida ({e})", resp.status_code)
+                    ultimo_erro = AsaasError(f"GET {path}: HTTP {resp.status_code}", resp.status_code)
+                    if resp.status_code not in self.RETRY_STATUS:
+                        metricas.inc("asaas_falhas_total", rota=rota)
+                        raise ultimo_erro
+
+                if tentativa + 1 < self.max_tentativas:
+                    espera = self._espera(tentativa, resp)
+                    restante = pz.restante() if pz is not None else None
+                    if restante is not None and espera >= restante:
+                        raise PrazoEsgotado(f"GET {path}: prazo do relatório esgotado ({ultimo_erro})")
+                    time.sleep(espera)
+        except (PrazoEsgotado, CircuitoAberto) as e:
+            motivo = "prazo" if isinstance(e, PrazoEsgotado) else "circuito"
+            metricas.inc("asaas_interrompidas_total", rota=rota, motivo=motivo)
+            raise
+
+        metricas.inc("asaas_falhas_total", rota=rota)
+        raise ultimo_erro
+
+
+_asaas_client = None
+_asaas_client_pid = None
+_asaas_client_lock = threading.Lock()
+
+
+def get_asaas() -> AsaasClient:
+    """Cliente compartilhado do worker atual (recriado após fork do gunicorn)."""
+    global _asaas_client, _asaas_client_pid
+    pid = os.getpid()
+    if _asaas_client is None or _asaas_client_pid != pid:
+        with _asaas_client_lock:
+            if _asaas_client is None or _asaas_client_pid != pid:
+                _asaas_client = AsaasClient(ASAAS_BASE_URL, ASAAS_API_KEY)
+                _asaas_client_pid = pid
+    return _asaas_client
+
+
 # ========= MODELO BANCO =========
 class Partner(db.Model):
     __tablename__ = "partners"
@@ -66,141 +638,1706 @@ class Partner(db.Model):
     chave = db.Column(db.String(32), primary_key=True)
     nome = db.Column(db.String(200), nullable=False)
     polo = db.Column(db.String(200))
-    expira_em = db.Column(db.String(10))  # YYYY-MM-DD
+    expira_em = db.Column(db.Date)  # None = não expira
+
+    __table_args__ = (
+        db.Index("ix_partners_nome", "nome", "chave"),
+        db.Index("ix_partners_polo", "polo"),
+        db.Index("ix_partners_polo_lower", func.lower(polo)),
+        db.Index("ix_partners_expira_em", "expira_em"),
+    )
 
     def to_dict(self):
         return {
             "chave": self.chave,
             "nome": self.nome,
             "polo": self.polo,
-            "expira_em": self.expira_em,
+            "expira_em": self.expira_em.isoformat() if self.expira_em else None,
+        }
+
+
+class AsaasCustomer(db.Model):
+    """Espelho local dos clientes do Asaas, indexado pelo polo (complement)."""
+
+    __tablename__ = "asaas_customers"
+
+    id = db.Column(db.String(64), primary_key=True)
+    nome = db.Column(db.String(255))
+    cpf_cnpj = db.Column(db.String(32))
+    complement = db.Column(db.String(255))
+    complement_norm = db.Column(db.String(255), index=True)  # _norm(complement)
+    criado_em = db.Column(db.String(10))  # dateCreated do Asaas (YYYY-MM-DD)
+    removido = db.Column(db.Boolean, nullable=False, default=False)
+    sincronizado_em = db.Column(db.Float, nullable=False, default=0.0)
+    # preenchido quando todas as faturas do cliente estão no livro local (AsaasPayment)
+    pagamentos_sync_em = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index("ix_asaas_customers_polo", "complement_norm", "removido"),
+    )
+
+    def to_asaas(self):
+        """Mesmo formato devolvido por GET /customers (campos usados nos relatórios)."""
+        return {
+            "id": self.id,
+            "name": self.nome,
+            "cpfCnpj": self.cpf_cnpj,
+            "complement": self.complement,
         }
 
 
+class AsaasPayment(db.Model):
+    """Livro local de faturas do Asaas, alimentado pelo webhook e pela carga inicial."""
+
+    __tablename__ = "asaas_payments"
+
+    id = db.Column(db.String(64), primary_key=True)
+    customer_id = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(32))
+    valor = db.Column(db.Float)
+    valor_liquido = db.Column(db.Float)
+    vencimento = db.Column(db.String(10))  # YYYY-MM-DD
+    data_pagamento = db.Column(db.String(10))  # YYYY-MM-DD
+    descricao = db.Column(db.Text)
+    link_pagamento = db.Column(db.String(500))
+    removido = db.Column(db.Boolean, nullable=False, default=False)
+    atualizado_em = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index("ix_asaas_payments_cliente", "customer_id", "status", "data_pagamento"),
+        db.Index("ix_asaas_payments_status_data", "status", "data_pagamento"),
+    )
+
+    def to_asaas(self):
+        """Mesmo formato devolvido por GET /payments (campos usados nos relatórios)."""
+        return {
+            "id": self.id,
+            "customer": self.customer_id,
+            "status": self.status,
+            "value": self.valor,
+            "netValue": self.valor_liquido,
+            "dueDate": self.vencimento,
+            "paymentDate": self.data_pagamento,
+            "description": self.descricao,
+            "invoiceUrl": self.link_pagamento,
+        }
+
+
+class PoloPagamentoDiario(db.Model):
+    """Totais de faturas RECEIVED por polo e dia de pagamento, mantidos junto com o livro."""
+
+    __tablename__ = "polo_pagamentos_diarios"
+
+    polo_norm = db.Column(db.String(255), primary_key=True)
+    dia = db.Column(db.String(10), primary_key=True)  # paymentDate YYYY-MM-DD
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    valor = db.Column(db.Float, nullable=False, default=0.0)
+    valor_liquido = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class WebhookEvento(db.Model):
+    """Ids de eventos já processados (o Asaas pode reenviar o mesmo evento)."""
+
+    __tablename__ = "webhook_eventos"
+
+    id = db.Column(db.String(64), primary_key=True)
+    evento = db.Column(db.String(64))
+    recebido_em = db.Column(db.Float, nullable=False)
+
+
+class RelatorioJob(db.Model):
+    """Relatório gerado em segundo plano (ver /api/relatorios/jobs)."""
+
+    __tablename__ = "relatorio_jobs"
+
+    id = db.Column(db.String(32), primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)  # historico | pagamentos
+    parametros = db.Column(db.Text, nullable=False)  # JSON
+    status = db.Column(db.String(20), nullable=False, default="pendente")
+    clientes_total = db.Column(db.Integer)
+    clientes_processados = db.Column(db.Integer, nullable=False, default=0)
+    registros = db.Column(db.Integer, nullable=False, default=0)
+    mensagem = db.Column(db.Text)
+    resultado = db.Column(db.Text)  # JSON da lista de registros
+    criado_em = db.Column(db.Float, nullable=False)
+    atualizado_em = db.Column(db.Float, nullable=False)
+    finalizado_em = db.Column(db.Float, index=True)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "tipo": self.tipo,
+            "situacao": self.status,
+            "clientes_total": self.clientes_total,
+            "clientes_processados": self.clientes_processados,
+            "registros": self.registros,
+            "mensagem": self.mensagem,
+            "criado_em": datetime.fromtimestamp(self.criado_em).isoformat(timespec="seconds"),
+            "finalizado_em": (
+                datetime.fromtimestamp(self.finalizado_em).isoformat(timespec="seconds")
+                if self.finalizado_em else None
+            ),
+        }
+
+
+class ParticaoPagamentos(db.Model):
+    """Partição (polo, mês) do cache de pagamentos RECEIVED. Fechada = mês encerrado, não expira."""
+
+    __tablename__ = "pagamentos_particoes"
+
+    polo_norm = db.Column(db.String(255), primary_key=True)
+    mes = db.Column(db.String(7), primary_key=True)  # YYYY-MM (paymentDate)
+    gerada_em = db.Column(db.Float, nullable=False, default=0.0)
+    fechada = db.Column(db.Boolean, nullable=False, default=False)
+    registros = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PagamentoParticao(db.Model):
+    """Pagamento RECEIVED guardado numa partição (dados do cliente vêm do espelho na leitura)."""
+
+    __tablename__ = "pagamentos_particoes_linhas"
+
+    polo_norm = db.Column(db.String(255), primary_key=True)
+    mes = db.Column(db.String(7), primary_key=True)
+    fatura_id = db.Column(db.String(64), primary_key=True)
+    customer_id = db.Column(db.String(64), nullable=False)
+    ordem = db.Column(db.Integer, nullable=False, default=0)  # posição na lista do cliente
+    descricao = db.Column(db.Text)
+    valor_liquido = db.Column(db.Float)
+    data_pagamento = db.Column(db.String(10), nullable=False)
+    vencimento = db.Column(db.String(10))
+    link_pagamento = db.Column(db.String(500))
+
+    __table_args__ = (db.Index("ix_pagamentos_particoes_linhas_fatura", "fatura_id"),)
+
+
+class RelatorioSnapshot(db.Model):
+    """Resultado de um relatório guardado por pouco tempo para ser lido em páginas (cursor)."""
+
+    __tablename__ = "relatorios_snapshots"
+
+    id = db.Column(db.String(32), primary_key=True)
+    assinatura = db.Column(db.String(32), nullable=False, index=True)  # hash de envelope + lista
+    campo = db.Column(db.String(20), nullable=False)  # faturas | pagamentos
+    envelope = db.Column(db.Text, nullable=False)  # JSON (status, mensagem, polo...)
+    total = db.Column(db.Integer, nullable=False)
+    criado_em = db.Column(db.Float, nullable=False)
+    expira_em = db.Column(db.Float, nullable=False, index=True)
+
+
+class RelatorioSnapshotBloco(db.Model):
+    """Bloco de SNAPSHOT_BLOCO registros de um snapshot: um JSON por linha."""
+
+    __tablename__ = "relatorios_snapshots_blocos"
+
+    snapshot_id = db.Column(db.String(32), primary_key=True)
+    bloco = db.Column(db.Integer, primary_key=True)
+    linhas = db.Column(db.Text, nullable=False)
+
+
+class SyncState(db.Model):
+    __tablename__ = "sync_state"
+
+    chave = db.Column(db.String(64), primary_key=True)
+    valor = db.Column(db.String(255))
+
+
+def _get_state(chave: str, default=None):
+    st = db.session.get(SyncState, chave)
+    return st.valor if st and st.valor is not None else default
+
+
+def _set_state(chave: str, valor):
+    st = db.session.get(SyncState, chave)
+    if st:
+        st.valor = str(valor)
+    else:
+        db.session.add(SyncState(chave=chave, valor=str(valor)))
+
+
 # ========= FIXAS =========
 def ensure_fixed_keys():
-    for chave, info in FIXED_KEYS.items():
-        if not Partner.query.get(chave):
-            db.session.add(
-                Partner(
-                    chave=chave,
-                    nome=info["nome"],
-                    polo=info["polo"],
-                    expira_em=info["expira_em"],
-                )
-            )
+    """Grava as chaves fixas que faltam num só INSERT (as que já existem ficam como estão)."""
+    linhas = [{"chave": chave, **info} for chave, info in FIXED_KEYS.items()]
+    dialeto = db.engine.dialect.name
+    if dialeto in ("postgresql", "sqlite"):
+        insert = (postgresql if dialeto == "postgresql" else sqlite).insert
+        db.session.execute(insert(Partner).on_conflict_do_nothing(index_elements=["chave"]), linhas)
+    else:
+        existentes = {
+            chave for (chave,) in db.session.query(Partner.chave).filter(Partner.chave.in_(FIXED_KEYS))
+        }
+        faltando = [linha for linha in linhas if linha["chave"] not in existentes]
+        if faltando:
+            db.session.execute(db.insert(Partner), faltando)
     db.session.commit()
 
 
 # ========= UTIL =========
+def _nova_chave() -> str:
+    raw = secrets.token_urlsafe(8)
+    return "".join(ch for ch in raw if ch.isalnum()).upper()[:12]
+
+
+def gerar_chaves(quantidade: int, evitar=()) -> list:
+    """
+    quantidade chaves novas, diferentes entre si, de evitar e das já cadastradas:
+    os candidatos são conferidos no banco em lote (uma consulta por rodada).
+    """
+    chaves = set()
+    while len(chaves) < quantidade:
+        candidatos = set()
+        while len(candidatos) < quantidade - len(chaves):
+            chave = _nova_chave()
+            if chave not in chaves and chave not in FIXED_KEYS and chave not in evitar:
+                candidatos.add(chave)
+        usadas = {
+            chave
+            for (chave,) in db.session.query(Partner.chave).filter(Partner.chave.in_(candidatos))
+        }
+        chaves.update(candidatos - usadas)
+    return list(chaves)
+
+
 def generate_access_key():
-    while True:
-        raw = secrets.token_urlsafe(8)
-        key = "".join(ch for ch in raw if ch.isalnum()).upper()[:12]
-        if not Partner.query.get(key):
-            return key
+    return gerar_chaves(1)[0]
 
 
-def is_expired(expira_em_str: str) -> bool:
-    if not expira_em_str:
-        return False
-    try:
-        d = datetime.strptime(expira_em_str, "%Y-%m-%d").date()
-    except ValueError:
-        return False
-    return date.today() > d
+def parse_expira_em(valor):
+    """date de expiração (aceita AAAA-MM-DD ou DD/MM/AAAA); None se vazia. ValueError se inválida."""
+    if isinstance(valor, date):
+        return valor
+    valor = (valor or "").strip()
+    if not valor:
+        return None
+    for formato in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(valor, formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f"data de expiração inválida: {valor} (use AAAA-MM-DD)")
 
 
-# ========= ASAAS HELPERS =========
-def get_customers_by_polo(
-    polo: str,
-    *,
-    max_loops: int = 60,
-    limit: int = 100,
-    max_customers: int = 250,
-):
+def is_expired(expira_em) -> bool:
+    return expira_em is not None and date.today() > expira_em
+
+
+# ========= CACHE DE PARCEIROS =========
+class CacheParceiros:
     """
-    Busca clientes cujo 'complement' == polo.
-    IMPORTANTE: para cedo quando atingir max_customers (evita timeout).
+    Parceiros por chave, com a data de expiração já convertida.
+
+    As chaves fixas vêm de FIXED_KEYS, sem ir ao banco. As demais ficam em
+    memória (inclusive as inexistentes) até o /admin mudar algo: o worker que
+    alterou limpa o próprio cache e grava um novo carimbo de versão no banco;
+    os outros conferem esse carimbo a cada PARCEIROS_CACHE_TTL segundos.
     """
-    polo_norm = _norm(polo)
-    clientes = []
-    offset = 0
-    url = f"{ASAAS_BASE_URL}/customers"
 
-    session = requests.Session()
+    def __init__(self, ttl: int, max_itens: int):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._dados = {}
+        self._versao = None
+        self._verificado_em = 0.0
+        self._lock = threading.Lock()
+        self._fixos = {
+            chave: {
+                "chave": chave,
+                "nome": info["nome"],
+                "polo": info["polo"],
+                "expira": parse_expira_em(info["expira_em"]),
+            }
+            for chave, info in FIXED_KEYS.items()
+        }
 
-    for _ in range(max_loops):
-        if len(clientes) >= max_customers:
-            break
+    def _conferir_versao(self):
+        agora = time.time()
+        if agora - self._verificado_em < self.ttl:
+            return
+        versao = _get_state("parceiros_versao")
+        with self._lock:
+            if versao != self._versao:
+                self._dados.clear()
+                self._versao = versao
+            self._verificado_em = agora
 
-        try:
-            r = session.get(
-                url,
-                headers=asaas_headers(),
-                params={"limit": limit, "offset": offset},
-                timeout=DEFAULT_TIMEOUT,
-            )
-            r.raise_for_status()
-            data = r.json()
-        except Exception:
-            break
+    def obter(self, chave: str):
+        fixo = self._fixos.get(chave)
+        if fixo is not None:
+            return fixo
 
-        lista = data.get("data", [])
-        if not lista:
-            break
+        self._conferir_versao()
+        with self._lock:
+            if chave in self._dados:
+                return self._dados[chave]
 
-        for c in lista:
-            if _norm(c.get("complement")) == polo_norm:
-                clientes.append(c)
-                if len(clientes) >= max_customers:
-                    break
+        parceiro = db.session.get(Partner, chave)
+        dados = None
+        if parceiro is not None:
+            dados = {
+                "chave": parceiro.chave,
+                "nome": parceiro.nome,
+                "polo": parceiro.polo,
+                "expira": parceiro.expira_em,
+            }
 
-        if len(lista) < limit:
-            break
+        with self._lock:
+            if len(self._dados) >= self.max_itens:
+                self._dados.clear()
+            self._dados[chave] = dados
+        return dados
 
-        offset += limit
+    def invalidar(self):
+        with self._lock:
+            self._dados.clear()
+            self._verificado_em = 0.0
 
-    return clientes
 
+parceiros_cache = CacheParceiros(PARCEIROS_CACHE_TTL, PARCEIROS_CACHE_MAX)
 
-# ========= TESTE =========
-@app.route("/teste", methods=["GET"])
-def teste():
-    return jsonify({"mensagem": "Servidor funcionando com sucesso!"})
 
+def parceiros_alterados():
+    """Chamar antes do commit de qualquer mudança em Partner."""
+    _set_state("parceiros_versao", secrets.token_hex(8))
+    parceiros_cache.invalidar()
 
-# ========= ADMIN =========
-@app.route("/admin", methods=["GET", "POST"])
-def admin():
-    mensagem = ""
 
-    if request.method == "POST":
-        delete_key = (request.form.get("delete_key") or "").strip()
+# ========= REQUISIÇÕES EM VOO =========
+class VooUnico:
+    """
+    Junta chamadas iguais e simultâneas (single-flight): enquanto a primeira
+    busca de uma chave está em andamento, as demais esperam e recebem o mesmo
+    resultado (ou a mesma exceção) em vez de repetir a chamada ao Asaas.
+    """
 
-        if delete_key:
-            if delete_key in FIXED_KEYS:
-                mensagem = f"A chave {delete_key} é fixa e não pode ser removida."
-            else:
-                parceiro = Partner.query.get(delete_key)
-                if parceiro:
-                    db.session.delete(parceiro)
-                    db.session.commit()
-                    mensagem = f"Chave {delete_key} removida."
-                else:
-                    mensagem = f"Chave {delete_key} não encontrada."
+    def __init__(self):
+        self._em_voo = {}
+        self._lock = threading.Lock()
+
+    def executar(self, chave, fn):
+        while True:
+            with self._lock:
+                fut = self._em_voo.get(chave)
+                lider = fut is None
+                if lider:
+                    fut = self._em_voo[chave] = Future()
+            if lider:
+                break
+
+            # quem espera respeita o próprio prazo, não o de quem está buscando
+            pz = prazo_atual()
+            restante = pz.restante() if pz is not None else None
+            try:
+                return fut.result(timeout=None if restante is None else max(restante, 0))
+            except FuturesTimeout:
+                raise PrazoEsgotado("prazo do relatório esgotado esperando outra busca")
+            except PrazoEsgotado:
+                # acabou o prazo de quem buscava (ex.: pediu "prazo": 0.1), não o deste pedido:
+                # busca de novo (ou espera a próxima busca) com o próprio prazo
+                continue
+
+        try:
+            resultado = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
         else:
-            nome = (request.form.get("nome") or "").strip()
-            polo = (request.form.get("polo") or "").strip()
-            expira_em = (request.form.get("expira_em") or "").strip()
-            chave_manual = (request.form.get("chave") or "").strip().upper()
+            fut.set_result(resultado)
+            return resultado
+        finally:
+            with self._lock:
+                self._em_voo.pop(chave, None)
 
-            if not nome:
-                mensagem = "Preencha pelo menos o nome do parceiro."
-            else:
-                if chave_manual:
-                    if chave_manual in FIXED_KEYS:
-                        mensagem = "Você não pode sobrescrever uma chave fixa."
+
+voo_unico = VooUnico()
+
+
+def adquirir_trava(nome: str, validade: int) -> bool:
+    """
+    Trava simples entre workers usando sync_state (compare-and-swap na validade).
+    Vence quem gravar primeiro; uma trava vencida pode ser tomada por outro.
+    """
+    agora = time.time()
+    nova = f"{agora + validade:.3f}"
+    atual = db.session.get(SyncState, nome)
+    if atual is None:
+        db.session.add(SyncState(chave=nome, valor=nova))
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+    antiga = atual.valor
+    try:
+        if antiga and float(antiga) > agora:
+            return False
+    except ValueError:
+        pass
+    n = SyncState.query.filter(SyncState.chave == nome, SyncState.valor == antiga).update(
+        {"valor": nova}, synchronize_session=False
+    )
+    db.session.commit()
+    return n == 1
+
+
+def liberar_trava(nome: str):
+    SyncState.query.filter(SyncState.chave == nome).update({"valor": "0"}, synchronize_session=False)
+    db.session.commit()
+
+
+# ========= ASAAS HELPERS =========
+def _upsert_customers(lista, agora: float) -> int:
+    """
+    Grava uma página de /customers no espelho local.
+    Retorna quantos clientes eram novos ou mudaram de dados.
+    """
+    ids = [c.get("id") for c in lista if c.get("id")]
+    existentes = {
+        c.id: c for c in AsaasCustomer.query.filter(AsaasCustomer.id.in_(ids)).all()
+    } if ids else {}
+
+    backfill = _get_state("pagamentos_backfill")
+    backfill_dia = date.fromtimestamp(float(backfill)).isoformat() if backfill else None
+
+    alterados = 0
+    mudancas_polo = {}
+    for c in lista:
+        cid = c.get("id")
+        if not cid:
+            continue
+
+        campos = {
+            "nome": c.get("name"),
+            "cpf_cnpj": c.get("cpfCnpj"),
+            "complement": c.get("complement"),
+            "complement_norm": _norm(c.get("complement")),
+            "criado_em": c.get("dateCreated"),
+            "removido": bool(c.get("deleted")),
+        }
+
+        atual = existentes.get(cid)
+        antigo_polo = atual.complement_norm if atual is not None else None
+        if antigo_polo != campos["complement_norm"]:
+            mudancas_polo[cid] = (antigo_polo, campos["complement_norm"])
+
+        if atual is None:
+            novo = AsaasCustomer(id=cid, sincronizado_em=agora, **campos)
+            # cliente criado depois da carga do livro: as faturas dele chegam pelo webhook
+            if ASAAS_WEBHOOK_TOKEN and backfill_dia and (novo.criado_em or "") > backfill_dia:
+                novo.pagamentos_sync_em = agora
+            db.session.add(novo)
+            alterados += 1
+            continue
+
+        if any(getattr(atual, k) != v for k, v in campos.items()):
+            for k, v in campos.items():
+                setattr(atual, k, v)
+            alterados += 1
+        atual.sincronizado_em = agora
+
+    if mudancas_polo:
+        mover_resumos_de_clientes(mudancas_polo)
+        # cliente que trocou de polo leva os pagamentos junto: as partições dos dois polos refazem
+        for antigo, novo in {m for m in mudancas_polo.values() if m[0] is not None}:
+            invalidar_particoes(antigo)
+            invalidar_particoes(novo)
+    return alterados
+
+
+def sincronizar_clientes(*, completa: bool = False, limit: int = 100) -> int:
+    """
+    Atualiza o espelho local de clientes a partir de GET /customers.
+
+    O Asaas lista os clientes do mais novo para o mais antigo, então a
+    sincronização incremental para na primeira página sem novidades.
+    A completa percorre tudo e marca como removidos os clientes que sumiram.
+    Dentro de um relatório roda no que resta do prazo dele: se acabar, para
+    na página em que estava (o que já foi lido fica gravado).
+    Retorna quantos clientes foram inseridos/alterados.
+    """
+    inicio = time.time()
+    asaas = get_asaas()
+    offset = 0
+    total_alterados = 0
+    chegou_ao_fim = False
+
+    while True:
+        try:
+            data = asaas.get("/customers", {"limit": limit, "offset": offset})
+        except AsaasError as e:
+            db.session.commit()
+            app.logger.warning("Falha ao sincronizar clientes (offset %s): %s", offset, e)
+            return total_alterados
+
+        lista = data.get("data", [])
+        alterados = _upsert_customers(lista, inicio)
+        db.session.commit()
+        total_alterados += alterados
+
+        if len(lista) < limit or not data.get("hasMore", True):
+            chegou_ao_fim = True
+            break
+        if not completa and alterados == 0:
+            break
+
+        offset += limit
+
+    if completa and chegou_ao_fim:
+        AsaasCustomer.query.filter(
+            AsaasCustomer.sincronizado_em < inicio,
+            AsaasCustomer.removido.is_(False),
+        ).update({"removido": True}, synchronize_session=False)
+        _set_state("clientes_sync_completa", inicio)
+
+    _set_state("clientes_sync", inicio)
+    db.session.commit()
+    return total_alterados
+
+
+def _sincronizar_clientes_se_preciso(forcar: bool = False, *, permitir_completa: bool = True):
+    agora = time.time()
+    ultima_completa = float(_get_state("clientes_sync_completa", 0))
+    completa = permitir_completa and agora - ultima_completa > CLIENTES_SYNC_COMPLETA_HORAS * 3600
+    if not forcar and not completa and agora - float(_get_state("clientes_sync", 0)) <= CLIENTES_SYNC_INTERVALO:
+        return
+    if not ultima_completa and not permitir_completa:
+        # espelho nunca carregado: a incremental percorreria todos os clientes
+        return
+    # travas separadas: a incremental da requisição não fica de fora durante a completa
+    trava = "clientes_sync_completa_trava" if completa else "clientes_sync_trava"
+    if not adquirir_trava(trava, CLIENTES_SYNC_TRAVA):
+        return  # outro worker está sincronizando
+
+    try:
+        sincronizar_clientes(completa=completa)
+    finally:
+        liberar_trava(trava)
+
+
+_sync_completa_thread = None
+_sync_completa_lock = threading.Lock()
+
+
+def _sincronizacao_completa_em_segundo_plano():
+    with app.app_context(), sem_prazo():
+        try:
+            _sincronizar_clientes_se_preciso()
+        except Exception:
+            app.logger.exception("Falha na sincronização completa de clientes")
+        finally:
+            db.session.remove()
+
+
+def disparar_sincronizacao_completa():
+    """Varredura completa numa thread do worker (com app context próprio); no máximo uma por worker."""
+    global _sync_completa_thread
+    with _sync_completa_lock:
+        if _sync_completa_thread is not None and _sync_completa_thread.is_alive():
+            return
+        _sync_completa_thread = threading.Thread(
+            target=_sincronizacao_completa_em_segundo_plano, name="clientes-sync-completa", daemon=True
+        )
+        _sync_completa_thread.start()
+
+
+def garantir_clientes_sincronizados():
+    """
+    Deixa o espelho em dia para um relatório. Na requisição só roda a
+    sincronização incremental, dentro do prazo do relatório (chamadas
+    simultâneas no mesmo worker esperam a mesma); a varredura completa,
+    quando vencida, vai para segundo plano.
+    Se o espelho nunca foi carregado, espera a carga inicial dentro do prazo
+    do relatório e, se ela não terminar, falha com AsaasError.
+    """
+    ultima_completa = float(_get_state("clientes_sync_completa", 0))
+    if time.time() - ultima_completa > CLIENTES_SYNC_COMPLETA_HORAS * 3600:
+        disparar_sincronizacao_completa()
+
+    if ultima_completa:
+        # no prazo do relatório: se ele acabar, o espelho é servido como está
+        try:
+            voo_unico.executar(
+                ("clientes_sync",), lambda: _sincronizar_clientes_se_preciso(permitir_completa=False)
+            )
+        except PrazoEsgotado:
+            app.logger.info("Sincronização incremental de clientes pulada: prazo do relatório esgotado")
+        return
+
+    pz = prazo_atual()
+    restante = pz.restante() if pz is not None else None
+    limite = time.time() + (CLIENTES_SYNC_ESPERA if restante is None else min(CLIENTES_SYNC_ESPERA, restante))
+    while time.time() < limite:
+        time.sleep(0.5)
+        db.session.rollback()
+        if float(_get_state("clientes_sync_completa", 0)):
+            return
+    raise AsaasError("Carga inicial dos clientes do Asaas em andamento; tente novamente em instantes.")
+
+
+def get_customers_by_polo(polo: str, *, max_customers: int = 250):
+    """
+    Busca clientes cujo 'complement' == polo no espelho local (consulta indexada).
+    IMPORTANTE: para cedo quando atingir max_customers (evita timeout).
+    """
+    garantir_clientes_sincronizados()
+
+    q = (
+        AsaasCustomer.query.filter(
+            AsaasCustomer.complement_norm == _norm(polo),
+            AsaasCustomer.removido.is_(False),
+        )
+        .order_by(AsaasCustomer.criado_em.desc(), AsaasCustomer.id)
+    )
+    if max_customers:
+        q = q.limit(max_customers)
+
+    return [c.to_asaas() for c in q.all()]
+
+
+def clientes_por_polo(polos, *, max_customers: int = 250) -> dict:
+    """
+    Clientes de vários polos numa só consulta ao espelho: {polo normalizado: [clientes]}.
+    Cada lista tem a mesma ordem e o mesmo corte de get_customers_by_polo.
+    """
+    garantir_clientes_sincronizados()
+
+    grupos = {_norm(polo): [] for polo in polos}
+    q = (
+        AsaasCustomer.query.filter(
+            AsaasCustomer.complement_norm.in_(list(grupos)),
+            AsaasCustomer.removido.is_(False),
+        )
+        .order_by(AsaasCustomer.criado_em.desc(), AsaasCustomer.id)
+    )
+    for c in q.all():
+        lista = grupos[c.complement_norm]
+        if not max_customers or len(lista) < max_customers:
+            lista.append(c.to_asaas())
+    return grupos
+
+
+def buscar_em_paralelo(itens, fn, max_em_voo: int = ASAAS_MAX_CONCORRENCIA):
+    """
+    Executa fn(item) em threads, com no máximo max_em_voo chamadas simultâneas.
+    Gera (item, resultado, erro) NA ORDEM de itens, então quem consome pode
+    parar cedo (break) com o mesmo resultado da versão sequencial; as chamadas
+    ainda não iniciadas são canceladas quando o gerador é fechado.
+    Cada chamada roda numa cópia do contexto atual (leva o prazo do relatório).
+    """
+    max_em_voo = max(1, int(max_em_voo or 1))
+    it = iter(itens)
+    pendentes = deque()
+    executor = ThreadPoolExecutor(max_workers=max_em_voo)
+
+    def _submeter():
+        for item in it:
+            pendentes.append((item, executor.submit(contextvars.copy_context().run, fn, item)))
+            return True
+        return False
+
+    try:
+        for _ in range(max_em_voo):
+            if not _submeter():
+                break
+
+        while pendentes:
+            item, fut = pendentes.popleft()
+            try:
+                resultado, erro = fut.result(), None
+            except Exception as e:
+                resultado, erro = None, e
+            _submeter()
+            yield item, resultado, erro
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ========= CONSULTA DE PAGAMENTOS =========
+def payments_params(
+    *, customer=None, status=None, pago_de=None, pago_ate=None, vencimento_de=None, vencimento_ate=None
+) -> dict:
+    """Filtros de GET /payments aplicados no próprio Asaas."""
+    params = {}
+    if customer:
+        params["customer"] = customer
+    if status:
+        params["status"] = status
+    if pago_de:
+        params["paymentDate[ge]"] = pago_de
+    if pago_ate:
+        params["paymentDate[le]"] = pago_ate
+    if vencimento_de:
+        params["dueDate[ge]"] = vencimento_de
+    if vencimento_ate:
+        params["dueDate[le]"] = vencimento_ate
+    return params
+
+
+def fetch_payments_pagina(params: dict, offset: int, limit: int = ASAAS_MAX_PAGE_SIZE) -> dict:
+    consulta = {**params, "limit": limit, "offset": offset}
+    return voo_unico.executar(
+        ("payments", tuple(sorted(consulta.items()))),
+        lambda: get_asaas().get("/payments", consulta),
+    )
+
+
+def _fetch_payments_todas(params: dict, limit: int) -> list:
+    faturas = []
+    offset = 0
+    while True:
+        data = fetch_payments_pagina(params, offset, limit)
+        lista = data.get("data", [])
+        faturas.extend(lista)
+        if not lista or not data.get("hasMore"):
+            return faturas
+        offset += len(lista)
+
+
+def fetch_payments_todas(params: dict, limit: int = ASAAS_MAX_PAGE_SIZE) -> list:
+    """
+    Segue a paginação por offset até o fim (sem truncar clientes com muitas faturas).
+    A lista devolvida pode ser compartilhada com outras requisições: não alterar.
+    """
+    return voo_unico.executar(
+        ("payments_todas", tuple(sorted(params.items())), limit),
+        lambda: _fetch_payments_todas(params, limit),
+    )
+
+
+def _faturas_da_conta(primeira: dict, params: dict, ids: set, limit: int, max_em_voo: int):
+    """
+    Busca as páginas restantes de uma consulta da conta inteira em paralelo e
+    devolve ({customer_id: [faturas]} só com os clientes em ids, páginas não lidas).
+    Se o prazo do relatório acaba no meio, devolve o que já foi lido e quantas
+    páginas faltaram; outros erros sobem.
+    """
+    por_cliente = {}
+
+    def _juntar(lista):
+        for fat in lista:
+            cid = fat.get("customer")
+            if cid in ids:
+                por_cliente.setdefault(cid, []).append(fat)
+
+    _juntar(primeira.get("data", []))
+    total = int(primeira.get("totalCount") or 0)
+    offsets = range(limit, total, limit) if primeira.get("hasMore") else range(0)
+
+    paginas = buscar_em_paralelo(
+        offsets,
+        lambda off: fetch_payments_pagina(params, off, limit),
+        max_em_voo,
+    )
+    lidas = 0
+    for _, data, erro in paginas:
+        if isinstance(erro, PrazoEsgotado):
+            paginas.close()  # cancela as que ainda não começaram
+            return por_cliente, len(offsets) - lidas
+        if erro is not None:
+            raise erro
+        _juntar(data.get("data", []))
+        lidas += 1
+
+    return por_cliente, 0
+
+
+def faturas_por_cliente(
+    clientes: list,
+    filtros: dict,
+    *,
+    estrategia: str = "auto",
+    page_size: int = ASAAS_MAX_PAGE_SIZE,
+    max_em_voo: int = ASAAS_MAX_CONCORRENCIA,
+):
+    """
+    Gera (cliente, faturas, erro) na ordem de clientes, com os filtros de
+    status/paymentDate aplicados no Asaas.
+
+    estrategia:
+      - "cliente": uma consulta paginada por cliente (em paralelo);
+      - "conta": uma única consulta da conta inteira, cruzada com os ids do polo;
+      - "auto": usa "conta" quando ela precisa de menos chamadas que "cliente".
+    """
+    page_size = max(1, min(int(page_size or ASAAS_MAX_PAGE_SIZE), ASAAS_MAX_PAGE_SIZE))
+
+    # clientes com o livro local completo são respondidos por consulta indexada
+    ids_livro = clientes_no_livro([cli.get("id") for cli in clientes])
+    if ids_livro:
+        locais = faturas_do_livro(ids_livro, filtros)
+        remotos = [cli for cli in clientes if cli.get("id") not in ids_livro]
+        ao_vivo = faturas_por_cliente(
+            remotos,
+            filtros,
+            estrategia=estrategia,
+            page_size=page_size,
+            max_em_voo=max_em_voo,
+        ) if remotos else iter(())
+        for cli in clientes:
+            if cli.get("id") in ids_livro:
+                yield cli, locais.get(cli.get("id"), []), None
+            else:
+                yield next(ao_vivo)
+        return
+
+    por_cliente = None
+    faltaram = 0  # páginas da consulta da conta não lidas porque o prazo acabou
+    if estrategia != "cliente" and (filtros or estrategia == "conta"):
+        try:
+            primeira = fetch_payments_pagina(filtros, 0, ASAAS_MAX_PAGE_SIZE)
+            paginas = math.ceil(int(primeira.get("totalCount") or 0) / ASAAS_MAX_PAGE_SIZE)
+            if estrategia == "conta" or paginas <= len(clientes):
+                ids = {cli.get("id") for cli in clientes}
+                por_cliente, faltaram = _faturas_da_conta(
+                    primeira, filtros, ids, ASAAS_MAX_PAGE_SIZE, max_em_voo
+                )
+        except PrazoEsgotado:
+            # sem tempo nem para a primeira página: buscar por cliente também não daria
+            por_cliente, faltaram = {}, 1
+        except AsaasError as e:
+            app.logger.warning("Consulta de pagamentos da conta falhou, usando por cliente: %s", e)
+
+    if por_cliente is not None:
+        esgotado = None
+        if faltaram:
+            pz = prazo_atual()
+            if pz is not None:
+                pz.paginas_puladas += faltaram
+            esgotado = PrazoEsgotado(f"prazo do relatório esgotado com {faltaram} páginas da conta por ler")
+        for cli in clientes:
+            lista = por_cliente.get(cli.get("id"))
+            if lista is None and esgotado is not None:
+                # nenhuma fatura do cliente nas páginas lidas: conta como pulado
+                yield cli, None, esgotado
+            else:
+                yield cli, lista or [], None
+        return
+
+    yield from buscar_em_paralelo(
+        clientes,
+        lambda cli: fetch_payments_todas(
+            {**filtros, "customer": cli.get("id")}, page_size
+        ),
+        max_em_voo,
+    )
+
+
+# ========= REGISTROS DOS RELATÓRIOS =========
+def _json(valor) -> str:
+    """Um valor JSON no mesmo formato do jsonify (texto ASCII, números, null)."""
+    if valor.__class__ is str:
+        return encode_basestring_ascii(valor)
+    if valor is None:
+        return "null"
+    if valor.__class__ is float and math.isfinite(valor):
+        return float.__repr__(valor)
+    if valor.__class__ is int:
+        return int.__repr__(valor)
+    return app.json.dumps(valor)
+
+
+class Registro:
+    """
+    Base das linhas de relatório: __slots__ em vez de um dict por fatura.
+    CAMPOS é a ordem do construtor e do to_dict(); json() escreve o objeto
+    direto dos atributos, com as chaves em ordem alfabética como o jsonify.
+    """
+
+    __slots__ = ()
+    CAMPOS = ()
+
+    def to_dict(self) -> dict:
+        return {campo: getattr(self, campo) for campo in self.CAMPOS}
+
+    def __eq__(self, outro):
+        return type(self) is type(outro) and all(getattr(self, c) == getattr(outro, c) for c in self.CAMPOS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class RegistroHistorico(Registro):
+    CAMPOS = (
+        "nome", "cpf", "polo", "fatura_id", "descricao", "valor", "valor_liquido",
+        "vencimento", "status", "data_pagamento", "link_pagamento",
+    )
+    __slots__ = CAMPOS + ("chave",)
+
+    def __init__(self, nome, cpf, polo, fatura_id, descricao, valor, valor_liquido,
+                 vencimento, status, data_pagamento, link_pagamento):
+        self.nome = nome
+        self.cpf = cpf
+        self.polo = polo
+        self.fatura_id = fatura_id
+        self.descricao = descricao
+        self.valor = valor
+        self.valor_liquido = valor_liquido
+        self.vencimento = vencimento
+        self.status = status
+        self.data_pagamento = data_pagamento
+        self.link_pagamento = link_pagamento
+        self.chave = (nome or "", vencimento or "")  # ordenação do relatório
+
+    def json(self) -> str:
+        return (
+            f'{{"cpf":{_json(self.cpf)},"data_pagamento":{_json(self.data_pagamento)},'
+            f'"descricao":{_json(self.descricao)},"fatura_id":{_json(self.fatura_id)},'
+            f'"link_pagamento":{_json(self.link_pagamento)},"nome":{_json(self.nome)},'
+            f'"polo":{_json(self.polo)},"status":{_json(self.status)},"valor":{_json(self.valor)},'
+            f'"valor_liquido":{_json(self.valor_liquido)},"vencimento":{_json(self.vencimento)}}}'
+        )
+
+
+class RegistroPagamento(Registro):
+    CAMPOS = (
+        "nome", "cpf", "polo", "fatura_id", "descricao", "valor_liquido",
+        "data_pagamento", "vencimento", "status", "link_pagamento",
+    )
+    __slots__ = CAMPOS
+
+    def __init__(self, nome, cpf, polo, fatura_id, descricao, valor_liquido,
+                 data_pagamento, vencimento, status, link_pagamento):
+        self.nome = nome
+        self.cpf = cpf
+        self.polo = polo
+        self.fatura_id = fatura_id
+        self.descricao = descricao
+        self.valor_liquido = valor_liquido
+        self.data_pagamento = data_pagamento
+        self.vencimento = vencimento
+        self.status = status
+        self.link_pagamento = link_pagamento
+
+    def json(self) -> str:
+        return (
+            f'{{"cpf":{_json(self.cpf)},"data_pagamento":{_json(self.data_pagamento)},'
+            f'"descricao":{_json(self.descricao)},"fatura_id":{_json(self.fatura_id)},'
+            f'"link_pagamento":{_json(self.link_pagamento)},"nome":{_json(self.nome)},'
+            f'"polo":{_json(self.polo)},"status":{_json(self.status)},'
+            f'"valor_liquido":{_json(self.valor_liquido)},"vencimento":{_json(self.vencimento)}}}'
+        )
+
+
+def serializar(valor) -> str:
+    """JSON de uma lista de registros (direto dos atributos) ou de qualquer outro valor."""
+    if isinstance(valor, list) and valor and isinstance(valor[0], Registro):
+        return "[" + ",".join([reg.json() for reg in valor]) + "]"
+    return app.json.dumps(valor)
+
+
+def emendar_json(envelope: dict, campo: str, corpo: str) -> str:
+    """Objeto JSON de envelope com campo = corpo (JSON já pronto) no fim."""
+    inicio = app.json.dumps(envelope)[:-1]
+    return f'{inicio}{"," if envelope else ""}{_json(campo)}:{corpo}}}'
+
+
+def resposta_json(envelope: dict, campo: str, corpo: str) -> Response:
+    return Response(emendar_json(envelope, campo, corpo) + "\n", mimetype="application/json")
+
+
+# ========= CACHE DE RELATÓRIOS =========
+def etag_de(texto: str) -> str:
+    """Hash do JSON já serializado."""
+    return hashlib.blake2b(texto.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class CacheRelatorios:
+    """
+    Cache TTL + LRU dos resultados de relatório, por worker.
+
+    O limite de memória é contado em registros (cada entrada pesa 1 + len(lista)).
+    Passado o TTL, a entrada ainda é servida por mais 'stale' segundos enquanto
+    uma thread recalcula o valor (stale-while-revalidate).
+    Valores None (polo sem clientes) não são guardados. Cada entrada guarda
+    também o JSON já serializado e a ETag dele, para o hit não serializar de novo.
+    """
+
+    def __init__(self, ttl: int, stale: int, max_itens: int, max_registros: int):
+        self.ttl = ttl
+        self.stale = stale
+        self.max_itens = max_itens
+        self.max_registros = max_registros
+        self._dados = OrderedDict()  # chave -> (criado_em, valor, peso, json, etag)
+        self._peso_total = 0
+        self._atualizando = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _peso(valor) -> int:
+        return 1 + (len(valor) if isinstance(valor, (list, dict)) else 0)
+
+    def _remover(self, chave):
+        _, _, peso, _, _ = self._dados.pop(chave)
+        self._peso_total -= peso
+
+    def guardar(self, chave, valor):
+        if valor is None or self.ttl <= 0:
+            return
+        peso = self._peso(valor)
+        with fase("serializacao"):
+            corpo = serializar(valor)
+        etag = etag_de(corpo)
+        with self._lock:
+            if chave in self._dados:
+                self._remover(chave)
+            self._dados[chave] = (time.time(), valor, peso, corpo, etag)
+            self._peso_total += peso
+            while self._dados and (
+                len(self._dados) > self.max_itens or self._peso_total > self.max_registros
+            ):
+                self._remover(next(iter(self._dados)))
+
+    def invalidar(self, filtro=None):
+        with self._lock:
+            for chave in [c for c in self._dados if filtro is None or filtro(c)]:
+                self._remover(chave)
+
+    def _atualizar(self, chave, calcular):
+        try:
+            with app.app_context(), com_prazo(None) as pz:
+                valor = calcular()
+                if not pz.parcial:
+                    self.guardar(chave, valor)
+        except Exception as e:
+            app.logger.warning("Falha ao atualizar cache do relatório %s: %s", chave, e)
+        finally:
+            with self._lock:
+                self._atualizando.discard(chave)
+
+    def serializado(self, chave, valor):
+        """(JSON, ETag) de valor: os guardados com a entrada, se for ela, senão calculados."""
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is not None and item[1] is valor:
+                return item[3], item[4]
+        with fase("serializacao"):
+            corpo = serializar(valor)
+        return corpo, etag_de(corpo)
+
+    def consultar(self, chave):
+        """Valor ainda dentro do TTL, ou None (não dispara atualização)."""
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None or time.time() - item[0] > self.ttl:
+                return None
+            self._dados.move_to_end(chave)
+            return item[1]
+
+    def obter(self, chave, calcular, *, bypass: bool = False):
+        """Devolve (valor, estado) com estado 'hit', 'stale', 'miss' ou 'bypass'."""
+        if not bypass:
+            with self._lock:
+                item = self._dados.get(chave)
+                if item is not None:
+                    idade = time.time() - item[0]
+                    if idade <= self.ttl:
+                        self._dados.move_to_end(chave)
+                        return item[1], "hit"
+                    if idade <= self.ttl + self.stale:
+                        self._dados.move_to_end(chave)
+                        if chave not in self._atualizando:
+                            self._atualizando.add(chave)
+                            threading.Thread(
+                                target=self._atualizar, args=(chave, calcular), daemon=True
+                            ).start()
+                        return item[1], "stale"
+
+        valor = calcular()
+        # relatório incompleto (prazo ou falhas) não vai para o cache
+        if not relatorio_parcial():
+            self.guardar(chave, valor)
+        return valor, "bypass" if bypass else "miss"
+
+
+relatorios_cache = CacheRelatorios(
+    RELATORIO_CACHE_TTL,
+    RELATORIO_CACHE_STALE,
+    RELATORIO_CACHE_MAX_ITENS,
+    RELATORIO_CACHE_MAX_REGISTROS,
+)
+
+
+@app.cli.command("sincronizar-clientes")
+@click.option("--completa", is_flag=True, help="Percorre todos os clientes do Asaas.")
+def sincronizar_clientes_cmd(completa):
+    """Atualiza o espelho local de clientes do Asaas (a completa é para o cron, uma vez por dia)."""
+    with sem_prazo():
+        n = sincronizar_clientes(completa=completa)
+    click.echo(f"{n} clientes inseridos/alterados.")
+
+
+# ========= LIVRO LOCAL DE PAGAMENTOS =========
+def livro_em_dia() -> bool:
+    """
+    O livro só é mantido pelo webhook: sem ele configurado, ou com a última
+    carga/conciliação mais velha que LIVRO_VALIDADE_HORAS, não dá para confiar.
+    """
+    if not ASAAS_WEBHOOK_TOKEN:
+        return False
+    carga = _get_state("pagamentos_backfill")
+    if not carga:
+        return False
+    return LIVRO_VALIDADE_HORAS <= 0 or time.time() - float(carga) <= LIVRO_VALIDADE_HORAS * 3600
+
+
+def clientes_no_livro(ids: list) -> set:
+    """Dentre ids, os clientes cujas faturas já estão todas no livro local (vazio se o livro não está em dia)."""
+    ids = [i for i in ids if i]
+    if not ids or not livro_em_dia():
+        return set()
+    rows = (
+        db.session.query(AsaasCustomer.id)
+        .filter(AsaasCustomer.id.in_(ids), AsaasCustomer.pagamentos_sync_em.isnot(None))
+        .all()
+    )
+    return {r[0] for r in rows}
+
+
+def faturas_do_livro(ids, filtros: dict) -> dict:
+    """{customer_id: [faturas no formato do Asaas]} com os mesmos filtros de GET /payments."""
+    q = AsaasPayment.query.filter(
+        AsaasPayment.customer_id.in_(list(ids)),
+        AsaasPayment.removido.is_(False),
+    )
+    if filtros.get("status"):
+        q = q.filter(AsaasPayment.status == filtros["status"])
+    if filtros.get("paymentDate[ge]"):
+        q = q.filter(AsaasPayment.data_pagamento >= filtros["paymentDate[ge]"])
+    if filtros.get("paymentDate[le]"):
+        q = q.filter(AsaasPayment.data_pagamento <= filtros["paymentDate[le]"])
+    if filtros.get("dueDate[ge]"):
+        q = q.filter(AsaasPayment.vencimento >= filtros["dueDate[ge]"])
+    if filtros.get("dueDate[le]"):
+        q = q.filter(AsaasPayment.vencimento <= filtros["dueDate[le]"])
+
+    por_cliente = {}
+    for fat in q.order_by(AsaasPayment.vencimento.desc(), AsaasPayment.id):
+        por_cliente.setdefault(fat.customer_id, []).append(fat.to_asaas())
+    return por_cliente
+
+
+def upsert_payment(fat: dict, *, removido: bool = False, agora=None):
+    """Grava uma fatura (formato do Asaas) no livro local. Chamar de novo com o mesmo dado não muda nada."""
+    pid = fat.get("id")
+    if not pid or not fat.get("customer"):
+        return None
+
+    campos = {
+        "customer_id": fat.get("customer"),
+        "status": (fat.get("status") or "").upper(),
+        "valor": fat.get("value"),
+        "valor_liquido": fat.get("netValue"),
+        "vencimento": fat.get("dueDate"),
+        "data_pagamento": fat.get("paymentDate"),
+        "descricao": fat.get("description"),
+        "link_pagamento": fat.get("invoiceUrl"),
+        "removido": removido or bool(fat.get("deleted")),
+        "atualizado_em": agora or time.time(),
+    }
+    # trava a linha (PostgreSQL): dois eventos da mesma fatura não retiram a mesma contribuição antiga
+    atual = db.session.get(AsaasPayment, pid, with_for_update=True)
+    deltas = {}
+    if atual is None:
+        atual = AsaasPayment(id=pid, **campos)
+        db.session.add(atual)
+    else:
+        _acumular_resumo(deltas, _polo_do_cliente(atual.customer_id), atual, -1)
+        for k, v in campos.items():
+            setattr(atual, k, v)
+    _acumular_resumo(deltas, _polo_do_cliente(campos["customer_id"]), atual, +1)
+    _somar_resumos(deltas)
+    return atual
+
+
+# ========= RESUMOS POR POLO =========
+def _valor_liquido(valor, valor_liquido):
+    return valor_liquido if valor_liquido is not None else valor
+
+
+def _acumular_resumo(deltas: dict, polo_norm, pay: AsaasPayment, sinal: int):
+    """Soma (sinal=+1) ou retira (sinal=-1) a contribuição de uma fatura em deltas[(polo, dia)]."""
+    if polo_norm is None or pay.removido or pay.status != "RECEIVED" or not pay.data_pagamento:
+        return
+    d = deltas.setdefault((polo_norm, pay.data_pagamento), [0, 0.0, 0.0])
+    d[0] += sinal
+    d[1] += sinal * (pay.valor or 0.0)
+    d[2] += sinal * (_valor_liquido(pay.valor, pay.valor_liquido) or 0.0)
+
+
+def _somar_resumos(deltas: dict):
+    """
+    Aplica deltas {(polo, dia): [quantidade, valor, valor_liquido]} aos totais
+    diários somando no próprio banco (INSERT ... ON CONFLICT DO UPDATE), sem
+    ler a linha antes: webhooks e cargas simultâneos no mesmo dia não perdem soma.
+    """
+    linhas = [
+        {"polo_norm": polo, "dia": dia, "quantidade": qtd, "valor": valor, "valor_liquido": liquido}
+        for (polo, dia), (qtd, valor, liquido) in sorted(deltas.items())  # mesma ordem de travas
+        if qtd or valor or liquido
+    ]
+    if not linhas:
+        return
+    t = PoloPagamentoDiario.__table__
+    dialeto = db.engine.dialect.name
+    if dialeto in ("postgresql", "sqlite"):
+        insert = (postgresql if dialeto == "postgresql" else sqlite).insert
+        stmt = insert(t)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[t.c.polo_norm, t.c.dia],
+            set_={
+                "quantidade": t.c.quantidade + stmt.excluded.quantidade,
+                "valor": t.c.valor + stmt.excluded.valor,
+                "valor_liquido": t.c.valor_liquido + stmt.excluded.valor_liquido,
+            },
+        )
+        db.session.execute(stmt, linhas)
+        return
+    for linha in linhas:
+        n = db.session.execute(
+            t.update()
+            .where(t.c.polo_norm == linha["polo_norm"], t.c.dia == linha["dia"])
+            .values(
+                quantidade=t.c.quantidade + linha["quantidade"],
+                valor=t.c.valor + linha["valor"],
+                valor_liquido=t.c.valor_liquido + linha["valor_liquido"],
+            )
+        ).rowcount
+        if not n:
+            db.session.execute(t.insert(), linha)
+
+
+def mover_resumos_de_clientes(mudancas: dict):
+    """
+    Clientes que mudaram de polo (ou acabaram de entrar no espelho):
+    mudancas = {customer_id: (polo_antigo, polo_novo)}.
+    """
+    ids = list(mudancas)
+    deltas = {}
+    for i in range(0, len(ids), 500):
+        pagos = AsaasPayment.query.filter(
+            AsaasPayment.customer_id.in_(ids[i:i + 500]),
+            AsaasPayment.status == "RECEIVED",
+            AsaasPayment.removido.is_(False),
+        ).all()
+        for pay in pagos:
+            antigo, novo = mudancas[pay.customer_id]
+            _acumular_resumo(deltas, antigo, pay, -1)
+            _acumular_resumo(deltas, novo, pay, +1)
+    _somar_resumos(deltas)
+
+
+def recalcular_resumos():
+    """Refaz os totais diários a partir do livro (uso manual, se algo sair do lugar)."""
+    PoloPagamentoDiario.query.delete()
+    rows = (
+        db.session.query(
+            AsaasCustomer.complement_norm,
+            AsaasPayment.data_pagamento,
+            func.count(AsaasPayment.id),
+            func.sum(func.coalesce(AsaasPayment.valor, 0.0)),
+            func.sum(func.coalesce(AsaasPayment.valor_liquido, AsaasPayment.valor, 0.0)),
+        )
+        .join(AsaasCustomer, AsaasCustomer.id == AsaasPayment.customer_id)
+        .filter(
+            AsaasPayment.status == "RECEIVED",
+            AsaasPayment.removido.is_(False),
+            AsaasPayment.data_pagamento.isnot(None),
+        )
+        .group_by(AsaasCustomer.complement_norm, AsaasPayment.data_pagamento)
+        .all()
+    )
+    for polo_norm, dia, qtd, valor, liquido in rows:
+        db.session.add(
+            PoloPagamentoDiario(
+                polo_norm=polo_norm, dia=dia, quantidade=qtd, valor=valor or 0.0, valor_liquido=liquido or 0.0
+            )
+        )
+    db.session.commit()
+    return len(rows)
+
+
+@app.cli.command("recalcular-resumos")
+def recalcular_resumos_cmd():
+    """Reconstrói a tabela de totais diários por polo a partir do livro local."""
+    click.echo(f"{recalcular_resumos()} linhas (polo, dia) gravadas.")
+
+
+def _polo_do_cliente(customer_id: str):
+    cli = db.session.get(AsaasCustomer, customer_id)
+    return cli.complement_norm if cli else None
+
+
+def sincronizar_pagamentos(*, max_em_voo: int = ASAAS_MAX_CONCORRENCIA) -> int:
+    """
+    Carga completa do livro: lê todas as faturas da conta e marca os clientes
+    do espelho como sincronizados. Depois disso o webhook mantém o livro em dia.
+
+    Rodando pelo cron (uma vez por dia, dentro de LIVRO_VALIDADE_HORAS) também
+    é a conciliação: corrige eventos que o webhook perdeu e marca como
+    removidas as faturas que não vieram mais na listagem da conta.
+    """
+    inicio = time.time()
+    sincronizar_clientes()
+    ids_clientes = [r[0] for r in db.session.query(AsaasCustomer.id).all()]
+
+    primeira = fetch_payments_pagina({}, 0, ASAAS_MAX_PAGE_SIZE)
+    total = int(primeira.get("totalCount") or 0)
+    offsets = range(ASAAS_MAX_PAGE_SIZE, total, ASAAS_MAX_PAGE_SIZE) if primeira.get("hasMore") else range(0)
+    paginas = buscar_em_paralelo(
+        offsets,
+        lambda off: fetch_payments_pagina({}, off, ASAAS_MAX_PAGE_SIZE),
+        max_em_voo,
+    )
+
+    n = 0
+    for fat in primeira.get("data", []):
+        n += upsert_payment(fat, agora=inicio) is not None
+    db.session.commit()
+    for off, data, erro in paginas:
+        if erro is not None:
+            db.session.commit()
+            raise AsaasError(f"Carga de pagamentos interrompida no offset {off}: {erro}")
+        for fat in data.get("data", []):
+            n += upsert_payment(fat, agora=inicio) is not None
+        db.session.commit()
+
+    # não vieram na listagem e nenhum webhook mexeu nelas durante a carga: sumiram do Asaas
+    deltas = {}
+    for pay in AsaasPayment.query.filter(
+        AsaasPayment.removido.is_(False), AsaasPayment.atualizado_em < inicio
+    ).all():
+        _acumular_resumo(deltas, _polo_do_cliente(pay.customer_id), pay, -1)
+        pay.removido = True
+        pay.atualizado_em = inicio
+    _somar_resumos(deltas)
+
+    for i in range(0, len(ids_clientes), 500):
+        AsaasCustomer.query.filter(AsaasCustomer.id.in_(ids_clientes[i:i + 500])).update(
+            {"pagamentos_sync_em": inicio}, synchronize_session=False
+        )
+    _set_state("pagamentos_backfill", inicio)
+    db.session.commit()
+    relatorios_cache.invalidar()
+    return n
+
+
+@app.cli.command("sincronizar-pagamentos")
+def sincronizar_pagamentos_cmd():
+    """Carrega todas as faturas do Asaas no livro local de pagamentos."""
+    n = sincronizar_pagamentos()
+    click.echo(f"{n} faturas gravadas no livro local.")
+
+
+# ========= MÉTRICAS (ROTAS) =========
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(metricas.texto(), mimetype="text/plain; version=0.0.4")
+
+
+@app.after_request
+def adicionar_server_timing(resp):
+    fases = g.get("fases")
+    if fases:
+        resp.headers["Server-Timing"] = ", ".join(
+            f"{nome};dur={segundos * 1000:.1f}" for nome, segundos in fases.items()
+        )
+    return resp
+
+
+# ========= COMPRESSÃO =========
+COMPRESSAO_TIPOS = ("application/json", "text/html", "text/plain", "text/csv")
+
+
+def _codificacao_aceita():
+    """Melhor Content-Encoding aceito pelo cliente entre br, gzip e deflate (ou None)."""
+    opcoes = (["br"] if brotli is not None else []) + ["gzip", "deflate"]
+    melhor, q_melhor = None, 0
+    for codificacao in opcoes:
+        q = request.accept_encodings[codificacao]
+        if q > q_melhor:
+            melhor, q_melhor = codificacao, q
+    return melhor
+
+
+def _comprimir(dados: bytes, codificacao: str) -> bytes:
+    if codificacao == "br":
+        return brotli.compress(dados, quality=min(RESPOSTA_COMPRESSAO_NIVEL, 11))
+    if codificacao == "gzip":
+        return gzip.compress(dados, compresslevel=RESPOSTA_COMPRESSAO_NIVEL)
+    return zlib.compress(dados, RESPOSTA_COMPRESSAO_NIVEL)
+
+
+@app.after_request
+def comprimir_resposta(resp):
+    """Comprime respostas de texto/JSON já montadas (as em streaming seguem como estão)."""
+    if resp.mimetype not in COMPRESSAO_TIPOS or resp.status_code != 200:
+        return resp
+    if resp.direct_passthrough or resp.is_streamed or "Content-Encoding" in resp.headers:
+        return resp
+
+    resp.vary.add("Accept-Encoding")
+    codificacao = _codificacao_aceita()
+    if codificacao is None or (resp.content_length or 0) < RESPOSTA_COMPRESSAO_MIN:
+        return resp
+
+    resp.set_data(_comprimir(resp.get_data(), codificacao))
+    resp.headers["Content-Encoding"] = codificacao
+    return resp
+
+
+# ========= TESTE =========
+@app.route("/teste", methods=["GET"])
+def teste():
+    return jsonify({"mensagem": "Servidor funcionando com sucesso!"})
+
+
+# ========= ADMIN =========
+ADMIN_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="pt-br">
+<head>
+    <meta charset="utf-8">
+    <title>Painel de Parceiros</title>
+    <style>
+        body {
+            background: #0D47A1;
+            margin: 0;
+            padding: 0;
+            font-family: Arial, sans-serif;
+        }
+        .container {
+            max-width: 1100px;
+            margin: 40px auto;
+            background: white;
+            border-radius: 10px;
+            padding: 20px;
+        }
+        table {
+            width: 100%;
+            border-collapse: collapse;
+        }
+        th, td {
+            border-bottom: 1px solid #ddd;
+            padding: 8px;
+        }
+        th {
+            background: #f2f2f2;
+        }
+        .msg {
+            color: green;
+            margin-top: 10px;
+        }
+        .fixo {
+            color: blue;
+            font-weight: bold;
+        }
+        .paginas {
+            margin-top: 10px;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>Painel de Parceiros</h1>
+        {% if mensagem %}<div class='msg'>{{ mensagem }}</div>{% endif %}
+        <form method="POST">
+            <p><b>Nome:</b> <input name="nome"></p>
+            <p><b>Polo:</b> <input name="polo"></p>
+            <p><b>Expira em:</b> <input name="expira_em" placeholder="2025-12-31"></p>
+            <p><b>Chave manual (opcional):</b> <input name="chave"></p>
+            <button type="submit">Salvar / Gerar Chave</button>
+        </form>
+        <form method="POST" enctype="multipart/form-data">
+            <p><b>Importar CSV</b> (chave,nome,polo,expira_em; chave vazia = gerar):
+            <input type="file" name="arquivo" accept=".csv,text/csv">
+            <button type="submit">Importar</button></p>
+        </form>
+        <p>Exportar: <a href="/admin/parceiros/exportar?formato=csv">CSV</a> |
+            <a href="/admin/parceiros/exportar?formato=json">JSON</a></p>
+
+        <h2>Chaves cadastradas</h2>
+        <form method="GET">
+            <input name="nome" placeholder="Nome" value="{{ filtros.nome }}">
+            <input name="polo" placeholder="Polo" value="{{ filtros.polo }}">
+            <input name="chave" placeholder="Chave" value="{{ filtros.chave }}">
+            <select name="situacao">
+                {% for valor, rotulo in [("", "Todas"), ("ativas", "Ativas"), ("expiradas", "Expiradas")] %}
+                <option value="{{ valor }}"{% if filtros.situacao == valor %} selected{% endif %}>{{ rotulo }}</option>
+                {% endfor %}
+            </select>
+            <button type="submit">Buscar</button>
+        </form>
+        <table>
+            <tr>
+                <th>Chave</th>
+                <th>Nome</th>
+                <th>Polo</th>
+                <th>Expira em</th>
+                <th>Status</th>
+                <th>Ação</th>
+            </tr>
+            {% for p in parceiros %}
+            <tr>
+                <td class='{{ "fixo" if p.fixa else "" }}'>{{ p.chave }}</td>
+                <td>{{ p.nome }}</td>
+                <td>{{ p.polo }}</td>
+                <td>{{ p.expira_em }}</td>
+                <td style="color:{{ 'red' if p.expirada else 'green' }};">{{ "Expirada" if p.expirada else "Ativa" }}</td>
+                {% if p.fixa %}
+                <td>Fixa</td>
+                {% else %}
+                <td>
+                    <form method="POST">
+                        <input type="hidden" name="delete_key" value="{{ p.chave }}">
+                        <button style="color:red;">Remover</button>
+                    </form>
+                </td>
+                {% endif %}
+            </tr>
+            {% endfor %}
+        </table>
+        <div class="paginas">
+            {% if pagina_anterior %}<a href="?{{ pagina_anterior }}">&laquo; Anterior</a>{% endif %}
+            Página {{ filtros.pagina }}
+            {% if proxima_pagina %}<a href="?{{ proxima_pagina }}">Próxima &raquo;</a>{% endif %}
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+_admin_template = None
+
+
+def _template_admin():
+    """Template do painel, compilado uma vez por worker."""
+    global _admin_template
+    if _admin_template is None:
+        _admin_template = app.jinja_env.from_string(ADMIN_TEMPLATE)
+    return _admin_template
+
+
+def _filtros_admin(args) -> dict:
+    try:
+        pagina = max(1, int(args.get("pagina", 1)))
+    except ValueError:
+        pagina = 1
+    try:
+        por_pagina = min(max(1, int(args.get("por_pagina", ADMIN_POR_PAGINA))), 500)
+    except ValueError:
+        por_pagina = ADMIN_POR_PAGINA
+    situacao = (args.get("situacao") or "").strip().lower()
+    return {
+        "nome": (args.get("nome") or "").strip(),
+        "polo": (args.get("polo") or "").strip(),
+        "chave": (args.get("chave") or "").strip().upper(),
+        "situacao": situacao if situacao in ("ativas", "expiradas") else "",
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+    }
+
+
+def parceiro_expirado():
+    """Expressão SQL: chave com expira_em já vencida."""
+    return Partner.expira_em < date.today()
+
+
+def parceiro_ativo():
+    """Expressão SQL: chave sem expiração ou ainda dentro dela."""
+    return Partner.expira_em.is_(None) | (Partner.expira_em >= date.today())
+
+
+def polos_ativos() -> list:
+    """Polos distintos com pelo menos uma chave de parceiro não expirada."""
+    rows = (
+        db.session.query(Partner.polo)
+        .filter(
+            Partner.polo.isnot(None),
+            Partner.polo != "",
+            parceiro_ativo(),
+        )
+        .distinct()
+        .all()
+    )
+    polos = {}
+    for (polo,) in rows:
+        polos.setdefault(_norm(polo), polo.strip())
+    return [polos[n] for n in sorted(polos)]
+
+
+def consulta_parceiros(filtros: dict):
+    """Query de Partner com os filtros do painel (nome, polo, chave, situação)."""
+    q = Partner.query
+    if filtros["nome"]:
+        # busca por trecho do nome: não usa índice (varre a tabela, que é pequena)
+        q = q.filter(Partner.nome.ilike(f"%{filtros['nome']}%"))
+    if filtros["polo"]:
+        q = q.filter(func.lower(Partner.polo) == _norm(filtros["polo"]))
+    if filtros["chave"]:
+        q = q.filter(Partner.chave.like(f"{filtros['chave']}%"))
+
+    if filtros["situacao"] == "expiradas":
+        q = q.filter(parceiro_expirado())
+    elif filtros["situacao"] == "ativas":
+        q = q.filter(parceiro_ativo())
+    return q
+
+
+def buscar_parceiros(filtros: dict):
+    """Uma página de parceiros (ordenada por nome) e se existe página seguinte."""
+    por_pagina = filtros["por_pagina"]
+    rows = (
+        consulta_parceiros(filtros).order_by(Partner.nome.asc(), Partner.chave.asc())
+        .offset((filtros["pagina"] - 1) * por_pagina)
+        .limit(por_pagina + 1)
+        .all()
+    )
+    return rows[:por_pagina], len(rows) > por_pagina
+
+
+@app.route("/admin", methods=["GET", "POST"])
+def admin():
+    mensagem = ""
+
+    if request.method == "POST":
+        delete_key = (request.form.get("delete_key") or "").strip()
+
+        if delete_key:
+            if delete_key in FIXED_KEYS:
+                mensagem = f"A chave {delete_key} é fixa e não pode ser removida."
+            else:
+                parceiro = Partner.query.get(delete_key)
+                if parceiro:
+                    db.session.delete(parceiro)
+                    parceiros_alterados()
+                    db.session.commit()
+                    mensagem = f"Chave {delete_key} removida."
+                else:
+                    mensagem = f"Chave {delete_key} não encontrada."
+        elif request.files.get("arquivo"):
+            try:
+                resultado = importar_parceiros(ler_csv_parceiros(request.files["arquivo"].read()))
+                mensagem = resultado["mensagem"]
+            except ImportacaoInvalida as e:
+                mensagem = f"{e} " + " ".join(e.erros[:10])
+        else:
+            nome = (request.form.get("nome") or "").strip()
+            polo = (request.form.get("polo") or "").strip()
+            chave_manual = (request.form.get("chave") or "").strip().upper()
+            try:
+                expira_em, erro_data = parse_expira_em(request.form.get("expira_em")), None
+            except ValueError as e:
+                expira_em, erro_data = None, str(e)
+
+            if not nome:
+                mensagem = "Preencha pelo menos o nome do parceiro."
+            elif erro_data:
+                mensagem = f"Não salvo: {erro_data}."
+            else:
+                if chave_manual:
+                    if chave_manual in FIXED_KEYS:
+                        mensagem = "Você não pode sobrescrever uma chave fixa."
                     else:
                         parceiro = Partner.query.get(chave_manual)
                         if parceiro:
@@ -216,148 +2353,1130 @@ def admin():
                                     expira_em=expira_em,
                                 )
                             )
+                        parceiros_alterados()
                         db.session.commit()
                         mensagem = f"Chave salva: {chave_manual}"
                 else:
                     chave = generate_access_key()
                     db.session.add(Partner(chave=chave, nome=nome, polo=polo, expira_em=expira_em))
+                    parceiros_alterados()
                     db.session.commit()
                     mensagem = f"Chave gerada para {nome}: {chave}"
 
-    parceiros = Partner.query.order_by(Partner.nome.asc()).all()
-
-    html = f"""
-    <!DOCTYPE html>
-    <html lang="pt-br">
-    <head>
-        <meta charset="utf-8">
-        <title>Painel de Parceiros</title>
-        <style>
-            body {{
-                background: #0D47A1;
-                margin: 0;
-                padding: 0;
-                font-family: Arial, sans-serif;
-            }}
-            .container {{
-                max-width: 1100px;
-                margin: 40px auto;
-                background: white;
-                border-radius: 10px;
-                padding: 20px;
-            }}
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-            }}
-            th, td {{
-                border-bottom: 1px solid #ddd;
-                padding: 8px;
-            }}
-            th {{
-                background: #f2f2f2;
-            }}
-            .msg {{
-                color: green;
-                margin-top: 10px;
-            }}
-            .fixo {{
-                color: blue;
-                font-weight: bold;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Painel de Parceiros</h1>
-            {"<div class='msg'>" + mensagem + "</div>" if mensagem else ""}
-            <form method="POST">
-                <p><b>Nome:</b> <input name="nome"></p>
-                <p><b>Polo:</b> <input name="polo"></p>
-                <p><b>Expira em:</b> <input name="expira_em" placeholder="2025-12-31"></p>
-                <p><b>Chave manual (opcional):</b> <input name="chave"></p>
-                <button type="submit">Salvar / Gerar Chave</button>
-            </form>
-
-            <h2>Chaves cadastradas</h2>
-            <table>
-                <tr>
-                    <th>Chave</th>
-                    <th>Nome</th>
-                    <th>Polo</th>
-                    <th>Expira em</th>
-                    <th>Status</th>
-                    <th>Ação</th>
-                </tr>
+    filtros = _filtros_admin(request.args)
+    parceiros, tem_proxima = buscar_parceiros(filtros)
+
+    linhas = []
+    for p in parceiros:
+        linhas.append(
+            {
+                "chave": p.chave,
+                "nome": p.nome,
+                "polo": p.polo or "",
+                "expira_em": p.expira_em.isoformat() if p.expira_em else "",
+                "expirada": is_expired(p.expira_em),
+                "fixa": p.chave in FIXED_KEYS,
+            }
+        )
+
+    args = {k: v for k, v in filtros.items() if v and k != "pagina"}
+    return _template_admin().render(
+        mensagem=mensagem,
+        filtros=filtros,
+        parceiros=linhas,
+        pagina_anterior=urlencode({**args, "pagina": filtros["pagina"] - 1}) if filtros["pagina"] > 1 else None,
+        proxima_pagina=urlencode({**args, "pagina": filtros["pagina"] + 1}) if tem_proxima else None,
+    )
+
+
+# ========= IMPORTAÇÃO / EXPORTAÇÃO DE PARCEIROS =========
+COLUNAS_PARCEIRO = ("chave", "nome", "polo", "expira_em")
+
+
+class ImportacaoInvalida(ValueError):
+    """Importação recusada inteira; erros traz uma mensagem por linha com problema."""
+
+    def __init__(self, mensagem: str, erros=()):
+        super().__init__(mensagem)
+        self.erros = list(erros)
+
+
+def ler_csv_parceiros(conteudo) -> list:
+    """Linhas do CSV como dicts (cabeçalho chave,nome,polo,expira_em; separador , ou ;)."""
+    try:
+        texto = conteudo.decode("utf-8-sig") if isinstance(conteudo, bytes) else conteudo
+    except UnicodeDecodeError:
+        raise ImportacaoInvalida("O arquivo precisa estar em UTF-8.")
+    try:
+        dialeto = csv.Sniffer().sniff(texto[:4096], delimiters=",;")
+    except csv.Error:
+        dialeto = csv.excel
+    return [
+        {(coluna or "").strip().lower(): valor for coluna, valor in linha.items()}
+        for linha in csv.DictReader(io.StringIO(texto), dialect=dialeto)
+    ]
+
+
+def importar_parceiros(linhas: list) -> dict:
+    """
+    Cria ou atualiza parceiros em lote, numa única transação. Cada linha tem
+    nome (obrigatório), polo, expira_em e chave (vazia = gerar uma nova).
+    Qualquer linha inválida recusa a importação inteira (ImportacaoInvalida).
+    """
+    if len(linhas) > PARCEIROS_IMPORTACAO_MAX:
+        raise ImportacaoInvalida(f"Máximo de {PARCEIROS_IMPORTACAO_MAX} parceiros por importação.")
+
+    erros = []
+    validas = []
+    vistas = set()
+    for n, linha in enumerate(linhas, start=1):
+        if not isinstance(linha, dict):
+            erros.append(f"Linha {n}: formato inválido.")
+            continue
+        chave = str(linha.get("chave") or "").strip().upper()
+        nome = str(linha.get("nome") or "").strip()
+        try:
+            expira_em = parse_expira_em(str(linha.get("expira_em") or ""))
+        except ValueError as e:
+            erros.append(f"Linha {n}: {e}.")
+            continue
+        if not nome:
+            erros.append(f"Linha {n}: nome obrigatório.")
+        elif chave in FIXED_KEYS:
+            erros.append(f"Linha {n}: a chave {chave} é fixa.")
+        elif len(chave) > 32:
+            erros.append(f"Linha {n}: chave com mais de 32 caracteres.")
+        elif chave and chave in vistas:
+            erros.append(f"Linha {n}: chave {chave} repetida no arquivo.")
+        else:
+            vistas.add(chave)
+            validas.append(
+                {"chave": chave, "nome": nome, "polo": str(linha.get("polo") or "").strip(), "expira_em": expira_em}
+            )
+    if erros:
+        raise ImportacaoInvalida(f"Importação recusada: {len(erros)} linhas com problema.", erros)
+
+    informadas = [linha["chave"] for linha in validas if linha["chave"]]
+    existentes = set()
+    for i in range(0, len(informadas), 500):
+        existentes.update(
+            chave for (chave,) in db.session.query(Partner.chave).filter(Partner.chave.in_(informadas[i:i + 500]))
+        )
+    sem_chave = [linha for linha in validas if not linha["chave"]]
+    for linha, chave in zip(sem_chave, gerar_chaves(len(sem_chave), evitar=vistas)):
+        linha["chave"] = chave
+
+    novos = [linha for linha in validas if linha["chave"] not in existentes]
+    alterados = [linha for linha in validas if linha["chave"] in existentes]
+    try:
+        if novos:
+            db.session.execute(db.insert(Partner), novos)
+        if alterados:
+            db.session.execute(db.update(Partner), alterados)
+        parceiros_alterados()
+        db.session.commit()
+    except IntegrityError:
+        # alguém criou uma das chaves entre a conferência e o insert
+        db.session.rollback()
+        raise ImportacaoInvalida("Importação recusada: uma das chaves foi criada ao mesmo tempo por outro usuário. Tente de novo.")
+
+    return {
+        "mensagem": f"{len(novos)} parceiros criados e {len(alterados)} atualizados.",
+        "criados": len(novos),
+        "atualizados": len(alterados),
+        "chaves_geradas": [{"nome": linha["nome"], "chave": linha["chave"]} for linha in sem_chave],
+    }
+
+
+@app.route("/admin/parceiros/importar", methods=["POST"])
+def importar_parceiros_rota():
+    """JSON (lista ou {"parceiros": [...]}) ou CSV (campo de arquivo 'arquivo' ou corpo text/csv)."""
+    try:
+        if request.files.get("arquivo"):
+            linhas = ler_csv_parceiros(request.files["arquivo"].read())
+        elif request.is_json:
+            dados = request.get_json(silent=True)
+            linhas = dados.get("parceiros") if isinstance(dados, dict) else dados
+            if not isinstance(linhas, list):
+                raise ImportacaoInvalida("Envie uma lista de parceiros.")
+        else:
+            linhas = ler_csv_parceiros(request.get_data())
+        resultado = importar_parceiros(linhas)
+    except ImportacaoInvalida as e:
+        return jsonify({"status": "erro", "mensagem": str(e), "erros": e.erros}), 200
+    return jsonify({"status": "ok", **resultado}), 200
+
+
+@app.route("/admin/parceiros/exportar", methods=["GET"])
+def exportar_parceiros():
+    """Parceiros (com os filtros do painel) em CSV (padrão) ou JSON (?formato=json)."""
+    consulta = consulta_parceiros(_filtros_admin(request.args)).order_by(Partner.nome.asc(), Partner.chave.asc())
+
+    if (request.args.get("formato") or "").lower() == "json":
+        return jsonify({"status": "ok", "parceiros": [p.to_dict() for p in consulta]}), 200
+
+    def gerar():
+        buf = io.StringIO()
+        escritor = csv.writer(buf)
+        escritor.writerow(COLUNAS_PARCEIRO)
+        for parceiro in consulta.yield_per(1000):
+            d = parceiro.to_dict()
+            escritor.writerow([d[coluna] or "" for coluna in COLUNAS_PARCEIRO])
+            if buf.tell() > 65536:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=parceiros.csv"},
+    )
+
+
+# ========= LOGIN =========
+@app.route("/login", methods=["POST"])
+def login():
+    dados = request.get_json(silent=True) or {}
+    chave = (dados.get("chave_acesso") or "").strip().upper()
+
+    if not chave:
+        return jsonify({"status": "erro", "mensagem": "Chave vazia"}), 200
+
+    parceiro = parceiros_cache.obter(chave)
+    if not parceiro:
+        return jsonify({"status": "erro", "mensagem": "Chave inválida"}), 200
+
+    if parceiro["expira"] is not None and date.today() > parceiro["expira"]:
+        return jsonify({"status": "erro", "mensagem": "Chave expirada"}), 200
+
+    return jsonify(
+        {
+            "status": "ok",
+            "mensagem": "Acesso autorizado",
+            "polo": parceiro["polo"],
+            "parceiro": parceiro["nome"],
+            "chave": parceiro["chave"],
+        }
+    ), 200
+
+
+# ========= WEBHOOK ASAAS =========
+@app.route("/webhook/asaas", methods=["POST"])
+def webhook_asaas():
+    # sem token configurado qualquer um poderia gravar faturas no livro
+    if not ASAAS_WEBHOOK_TOKEN:
+        return jsonify({"status": "erro", "mensagem": "Webhook desativado: configure ASAAS_WEBHOOK_TOKEN"}), 503
+    if not secrets.compare_digest(request.headers.get("asaas-access-token", "").encode(), ASAAS_WEBHOOK_TOKEN.encode()):
+        return jsonify({"status": "erro", "mensagem": "Token inválido"}), 401
+
+    dados = request.get_json(silent=True) or {}
+    evento_id = dados.get("id")
+    evento = (dados.get("event") or "").upper()
+    fat = dados.get("payment")
+
+    # só eventos de fatura interessam; o resto é aceito e ignorado
+    if not evento.startswith("PAYMENT_") or not isinstance(fat, dict):
+        return jsonify({"status": "ok", "mensagem": "Evento ignorado"}), 200
+
+    if evento_id and db.session.get(WebhookEvento, evento_id):
+        return jsonify({"status": "ok", "mensagem": "Evento já processado"}), 200
+
+    agora = time.time()
+    removido = evento == "PAYMENT_DELETED"
+
+    # partições (polo, mês) onde a fatura estava e onde passa a estar
+    particoes = {(_polo_do_cliente(fat.get("customer")), (fat.get("paymentDate") or "")[:7])}
+    if fat.get("id"):
+        particoes.update(
+            db.session.query(PagamentoParticao.polo_norm, PagamentoParticao.mes)
+            .filter(PagamentoParticao.fatura_id == fat.get("id"))
+            .all()
+        )
+
+    if upsert_payment(fat, removido=removido, agora=agora) is None:
+        return jsonify({"status": "erro", "mensagem": "Fatura sem id/cliente"}), 200
+    for polo_particao, mes in particoes:
+        if polo_particao is not None and mes:
+            invalidar_particoes(polo_particao, [mes])
+    if evento_id:
+        db.session.add(WebhookEvento(id=evento_id, evento=evento, recebido_em=agora))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        # o mesmo evento chegou em paralelo em outro worker
+        if evento_id and db.session.get(WebhookEvento, evento_id):
+            return jsonify({"status": "ok", "mensagem": "Evento já processado"}), 200
+        # conflito com outro evento (mesma fatura ou mesmo dia do resumo): 5xx faz o Asaas reenviar
+        app.logger.warning("Conflito ao gravar evento %s do webhook; pedindo reenvio", evento_id)
+        return jsonify({"status": "erro", "mensagem": "Conflito ao gravar o evento; reenviar"}), 503
+
+    polo_norm = _polo_do_cliente(fat.get("customer"))
+    if polo_norm is not None:
+        relatorios_cache.invalidar(lambda chave: chave[1] == polo_norm)
+
+    return jsonify({"status": "ok", "mensagem": "Evento processado"}), 200
+
+
+# ========= RESUMO POR POLO =========
+@app.route("/api/resumo_polo", methods=["POST"])
+def resumo_polo():
+    dados = request.get_json(silent=True) or {}
+    polo = dados.get("polo")
+    data_inicial = dados.get("data_inicial")
+    data_final = dados.get("data_final")
+    agrupamento = (dados.get("agrupamento") or "dia").strip().lower()  # dia | mes
+
+    base = {"polo": polo, "data_inicial": data_inicial, "data_final": data_final, "agrupamento": agrupamento}
+
+    if not polo or not data_inicial or not data_final:
+        return jsonify({"status": "erro", "mensagem": "Campos obrigatórios: polo, data_inicial, data_final", **base, "periodos": []}), 200
+    if agrupamento not in ("dia", "mes"):
+        return jsonify({"status": "erro", "mensagem": "agrupamento deve ser 'dia' ou 'mes'", **base, "periodos": []}), 200
+    try:
+        datetime.strptime(data_inicial, "%Y-%m-%d")
+        datetime.strptime(data_final, "%Y-%m-%d")
+    except ValueError:
+        return jsonify({"status": "erro", "mensagem": "Datas devem estar no formato YYYY-MM-DD", **base, "periodos": []}), 200
+
+    polo_norm = _norm(polo)
+    periodo = PoloPagamentoDiario.dia if agrupamento == "dia" else func.substr(PoloPagamentoDiario.dia, 1, 7)
+    rows = (
+        db.session.query(
+            periodo,
+            func.sum(PoloPagamentoDiario.quantidade),
+            func.sum(PoloPagamentoDiario.valor),
+            func.sum(PoloPagamentoDiario.valor_liquido),
+        )
+        .filter(
+            PoloPagamentoDiario.polo_norm == polo_norm,
+            PoloPagamentoDiario.dia >= data_inicial,
+            PoloPagamentoDiario.dia <= data_final,
+        )
+        .group_by(periodo)
+        .order_by(periodo)
+        .all()
+    )
+
+    periodos = [
+        {"periodo": per, "quantidade": int(qtd or 0), "valor": round(valor or 0.0, 2), "valor_liquido": round(liquido or 0.0, 2)}
+        for per, qtd, valor, liquido in rows
+        if qtd
+    ]
+    total = {
+        "quantidade": sum(x["quantidade"] for x in periodos),
+        "valor": round(sum(x["valor"] for x in periodos), 2),
+        "valor_liquido": round(sum(x["valor_liquido"] for x in periodos), 2),
+    }
+
+    # os totais só cobrem clientes cujas faturas já estão no livro local
+    faltando = AsaasCustomer.query.filter(
+        AsaasCustomer.complement_norm == polo_norm,
+        AsaasCustomer.removido.is_(False),
+        AsaasCustomer.pagamentos_sync_em.is_(None),
+    ).count()
+    em_dia = livro_em_dia()
+
+    return jsonify(
+        {
+            "status": "ok",
+            "mensagem": f"{total['quantidade']} pagamentos recebidos para o polo {polo}.",
+            **base,
+            "completo": faltando == 0 and em_dia,
+            "livro_em_dia": em_dia,
+            "clientes_sem_sincronizacao": faltando,
+            "total": total,
+            "periodos": periodos,
+        }
+    ), 200
+
+
+# ========= RELATÓRIOS (NÚCLEO) =========
+def _concorrencia_do_pedido(dados: dict) -> int:
+    """Chamadas simultâneas ao Asaas pedidas ("max_concorrencia"), entre 1 e ASAAS_MAX_CONCORRENCIA."""
+    try:
+        pedida = int(dados.get("max_concorrencia", ASAAS_MAX_CONCORRENCIA))
+    except (TypeError, ValueError):
+        pedida = ASAAS_MAX_CONCORRENCIA
+    return max(1, min(pedida, ASAAS_MAX_CONCORRENCIA))
+
+
+def _inteiro_do_pedido(dados: dict, campo: str, padrao: int) -> int:
+    """dados[campo] como inteiro (ausente ou null = padrao); ValueError com o nome do campo."""
+    valor = dados.get(campo)
+    if valor is None:
+        return padrao
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"{campo} deve ser um número inteiro") from None
+
+
+def _data_do_pedido(valor, campo: str) -> str:
+    """Valida e normaliza uma data YYYY-MM-DD (2025-1-5 -> 2025-01-05); ValueError com o nome do campo."""
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d").date().isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f"{campo} deve estar no formato YYYY-MM-DD") from None
+
+
+def _params_historico(dados: dict) -> dict:
+    """Levanta ValueError, com o nome do campo, se um limite ou data vier inválido."""
+    p = {
+        "polo": dados.get("polo"),
+        "max_clientes": _inteiro_do_pedido(dados, "max_clientes", DEFAULT_MAX_CLIENTES),
+        # tamanho da página de /payments; todas as páginas são lidas
+        "max_faturas_cliente": _inteiro_do_pedido(dados, "max_faturas_cliente", DEFAULT_MAX_FATURAS_CLIENTE),
+        "max_registros": _inteiro_do_pedido(dados, "max_registros", DEFAULT_MAX_REGISTROS),
+        "max_concorrencia": _concorrencia_do_pedido(dados),
+        "estrategia": (dados.get("estrategia") or "auto").strip().lower(),  # auto | cliente | conta
+        "status": (dados.get("status") or "").strip().upper(),  # opcional
+        "data_inicial": dados.get("data_inicial"),  # opcional YYYY-MM-DD (paymentDate)
+        "data_final": dados.get("data_final"),      # opcional YYYY-MM-DD (paymentDate)
+    }
+    for campo in ("data_inicial", "data_final"):
+        if p[campo]:
+            p[campo] = _data_do_pedido(p[campo], campo)
+    return p
+
+
+def _params_pagamentos(dados: dict) -> dict:
+    """Levanta ValueError, com o nome do campo, se um limite ou data vier inválido."""
+    p = {
+        "polo": dados.get("polo"),
+        "data_inicial": dados.get("data_inicial"),
+        "data_final": dados.get("data_final"),
+        "max_clientes": _inteiro_do_pedido(dados, "max_clientes", DEFAULT_MAX_CLIENTES),
+        # tamanho da página de /payments; todas as páginas são lidas
+        "max_faturas_cliente": _inteiro_do_pedido(dados, "max_faturas_cliente", DEFAULT_MAX_FATURAS_CLIENTE),
+        "max_pagamentos": _inteiro_do_pedido(dados, "max_pagamentos", DEFAULT_MAX_REGISTROS),
+        "max_concorrencia": _concorrencia_do_pedido(dados),
+        "estrategia": (dados.get("estrategia") or "auto").strip().lower(),  # auto | cliente | conta
+    }
+    for campo in ("data_inicial", "data_final"):
+        p[campo] = _data_do_pedido(p[campo], campo)
+    return p
+
+
+def _faturas_dos_clientes(clientes: list, p: dict, filtros: dict, falhas: list = None):
+    """(cliente, faturas) na ordem de clientes; os que falharam vão para falhas, se dada."""
+    faturas = faturas_por_cliente(
+        clientes,
+        filtros,
+        estrategia=p["estrategia"],
+        page_size=p["max_faturas_cliente"],
+        max_em_voo=p["max_concorrencia"],
+    )
+    pz = prazo_atual()
+    for cli, lista, erro in faturas:
+        if erro is not None:
+            if isinstance(erro, PrazoEsgotado):
+                metricas.inc("relatorio_clientes_pulados_total", relatorio=_relatorio_atual())
+                if pz is not None:
+                    pz.clientes_pulados += 1
+            else:
+                app.logger.warning("Falha ao buscar faturas do cliente %s: %s", cli.get("id"), erro)
+                metricas.inc("relatorio_clientes_com_falha_total", relatorio=_relatorio_atual())
+                if pz is not None:
+                    pz.clientes_com_falha += 1
+            if falhas is not None:
+                falhas.append(cli.get("id"))
+            continue
+        yield cli, lista
+
+
+def filtros_historico(p: dict) -> dict:
+    return payments_params(status=p["status"], pago_de=p["data_inicial"], pago_ate=p["data_final"])
+
+
+def filtros_pagamentos(p: dict) -> dict:
+    return payments_params(status="RECEIVED", pago_de=p["data_inicial"], pago_ate=p["data_final"])
+
+
+def registros_historico_cliente(cli: dict, lista: list, p: dict):
+    """Registros do relatório histórico para as faturas de um cliente."""
+    status_filtro = p["status"]
+    # datas YYYY-MM-DD: a comparação de texto segue a ordem das datas
+    dt_ini = p["data_inicial"]
+    dt_fim = p["data_final"]
+
+    nome = cli.get("name")
+    cpf = cli.get("cpfCnpj")
+    comp = cli.get("complement")
+
+    for fat in lista:
+        st = (fat.get("status") or "").upper()
+        if status_filtro and st != status_filtro:
+            continue
+
+        pay_date = fat.get("paymentDate")
+
+        if dt_ini or dt_fim:
+            if not pay_date:
+                continue
+            if dt_ini and pay_date < dt_ini:
+                continue
+            if dt_fim and pay_date > dt_fim:
+                continue
+
+        yield RegistroHistorico(
+            nome,
+            cpf,
+            comp,
+            fat.get("id"),
+            fat.get("description"),
+            fat.get("value"),
+            fat.get("netValue"),
+            fat.get("dueDate"),
+            st,
+            pay_date,
+            fat.get("invoiceUrl"),
+        )
+
+
+def registros_pagamentos_cliente(cli: dict, lista: list, p: dict):
+    """Pagamentos RECEIVED no período para as faturas de um cliente."""
+    # datas YYYY-MM-DD: a comparação de texto segue a ordem das datas
+    dt_ini = p["data_inicial"]
+    dt_fim = p["data_final"]
+
+    nome = cli.get("name")
+    cpf = cli.get("cpfCnpj")
+    comp = cli.get("complement")
+
+    for fat in lista:
+        status = (fat.get("status") or "").upper()
+        if status != "RECEIVED":
+            continue
+
+        pay_date = fat.get("paymentDate")
+        if not pay_date or not (dt_ini <= pay_date <= dt_fim):
+            continue
+
+        valor_liq = fat.get("netValue")
+        if valor_liq is None:
+            valor_liq = fat.get("value")
+
+        yield RegistroPagamento(
+            nome,
+            cpf,
+            comp,
+            fat.get("id"),
+            fat.get("description"),
+            valor_liq,
+            pay_date,
+            fat.get("dueDate"),
+            status,
+            fat.get("invoiceUrl"),
+        )
+
+
+def _iter_registros(clientes: list, p: dict, filtros: dict, montar, limite: int, progresso):
+    n = 0
+    for i, (cli, lista) in enumerate(cronometrar_faturas(_faturas_dos_clientes(clientes, p, filtros))):
+        if progresso is not None:
+            progresso(i, n)
+        if n >= limite:
+            return
+        for reg in montar(cli, lista, p):
+            if n >= limite:
+                return
+            n += 1
+            yield reg
+
+
+def iter_faturas_historico(clientes: list, p: dict, progresso=None):
+    """
+    Gera os registros do relatório histórico na ordem dos clientes (para em max_registros).
+    progresso(clientes_processados, registros), se dado, é chamado antes de cada cliente.
+    """
+    return _iter_registros(
+        clientes, p, filtros_historico(p), registros_historico_cliente, p["max_registros"], progresso
+    )
+
+
+def iter_pagamentos_polo(clientes: list, p: dict, progresso=None):
+    """Gera os pagamentos RECEIVED no período, na ordem dos clientes (para em max_pagamentos)."""
+    return _iter_registros(
+        clientes, p, filtros_pagamentos(p), registros_pagamentos_cliente, p["max_pagamentos"], progresso
+    )
+
+
+# ========= PARTIÇÕES MENSAIS DE PAGAMENTOS =========
+def _meses(data_inicial: str, data_final: str) -> list:
+    """Meses YYYY-MM que cobrem o período (datas YYYY-MM-DD)."""
+    ano, mes = int(data_inicial[:4]), int(data_inicial[5:7])
+    meses = []
+    while f"{ano:04d}-{mes:02d}" <= data_final[:7]:
+        meses.append(f"{ano:04d}-{mes:02d}")
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return meses
+
+
+def _limites_mes(mes: str):
+    """Primeiro e último dia (YYYY-MM-DD) do mês YYYY-MM."""
+    ano, m = int(mes[:4]), int(mes[5:7])
+    seguinte = date(ano + 1, 1, 1) if m == 12 else date(ano, m + 1, 1)
+    return f"{mes}-01", (seguinte - timedelta(days=1)).isoformat()
+
+
+def _mes_fechado(mes: str, hoje: date) -> bool:
+    return hoje > date.fromisoformat(_limites_mes(mes)[1]) + timedelta(days=PAGAMENTOS_MES_CARENCIA)
+
+
+def particoes_validas(polos_norm: list, meses: list) -> set:
+    """Pares (polo_norm, mês) guardados que ainda valem: fechados ou dentro de PAGAMENTOS_MES_TTL."""
+    agora = time.time()
+    rows = ParticaoPagamentos.query.filter(
+        ParticaoPagamentos.polo_norm.in_(polos_norm),
+        ParticaoPagamentos.mes.in_(meses),
+    ).all()
+    return {
+        (r.polo_norm, r.mes)
+        for r in rows
+        if r.fechada or agora - r.gerada_em <= PAGAMENTOS_MES_TTL
+    }
+
+
+def invalidar_particoes(polo_norm=None, meses=None) -> int:
+    """Apaga partições (todas, de um polo e/ou de alguns meses). Não faz commit."""
+    filtros_p, filtros_l = [], []
+    if polo_norm is not None:
+        filtros_p.append(ParticaoPagamentos.polo_norm == polo_norm)
+        filtros_l.append(PagamentoParticao.polo_norm == polo_norm)
+    if meses is not None:
+        meses = [m for m in meses if m]
+        if not meses:
+            return 0
+        filtros_p.append(ParticaoPagamentos.mes.in_(meses))
+        filtros_l.append(PagamentoParticao.mes.in_(meses))
+    PagamentoParticao.query.filter(*filtros_l).delete(synchronize_session=False)
+    return ParticaoPagamentos.query.filter(*filtros_p).delete(synchronize_session=False)
+
+
+def _buscar_particoes(faltando: set, p: dict) -> dict:
+    """
+    Busca os pagamentos RECEIVED dos pares (polo_norm, mês) em faltando numa só
+    leitura: todos os clientes desses polos (sem max_clientes), no intervalo que
+    vai do primeiro ao último mês. Devolve {par: [linhas]} e grava as partições,
+    a menos que algum cliente tenha falhado (aí elas só servem a este pedido).
+    """
+    polos = sorted({polo for polo, _ in faltando})
+    meses = sorted({mes for _, mes in faltando})
+    pago_de, pago_ate = _limites_mes(meses[0])[0], _limites_mes(meses[-1])[1]
+
+    grupos = clientes_por_polo(polos, max_customers=0)
+    polo_do_cliente = {cli.get("id"): polo for polo in polos for cli in grupos[polo]}
+    clientes = [cli for polo in polos for cli in grupos[polo]]
+    periodo = {"data_inicial": pago_de, "data_final": pago_ate}
+
+    linhas = {par: [] for par in faltando}
+    falhas = []
+    fonte = _faturas_dos_clientes(clientes, p, filtros_pagamentos(periodo), falhas)
+    for cli, lista in cronometrar_faturas(fonte):
+        polo = polo_do_cliente[cli.get("id")]
+        for ordem, reg in enumerate(registros_pagamentos_cliente(cli, lista, periodo)):
+            destino = linhas.get((polo, reg.data_pagamento[:7]))
+            if destino is None:
+                continue  # mês que já estava válido para este polo
+            destino.append(
+                {
+                    "polo_norm": polo,
+                    "mes": reg.data_pagamento[:7],
+                    "fatura_id": reg.fatura_id,
+                    "customer_id": cli.get("id"),
+                    "ordem": ordem,
+                    "descricao": reg.descricao,
+                    "valor_liquido": reg.valor_liquido,
+                    "data_pagamento": reg.data_pagamento,
+                    "vencimento": reg.vencimento,
+                    "link_pagamento": reg.link_pagamento,
+                }
+            )
+
+    if falhas or relatorio_parcial():
+        # cliente que falhou ou página da conta não lida: as partições ficariam incompletas
+        app.logger.warning("Partições de pagamentos não gravadas: %s clientes falharam/pulados", len(falhas))
+        return linhas
+
+    agora = time.time()
+    hoje = date.today()
+    try:
+        for polo in polos:
+            invalidar_particoes(polo, [mes for par_polo, mes in faltando if par_polo == polo])
+        for (polo, mes), lista in linhas.items():
+            if lista:
+                db.session.execute(db.insert(PagamentoParticao), lista)
+            db.session.add(
+                ParticaoPagamentos(
+                    polo_norm=polo,
+                    mes=mes,
+                    gerada_em=agora,
+                    fechada=_mes_fechado(mes, hoje),
+                    registros=len(lista),
+                )
+            )
+        db.session.commit()
+    except IntegrityError:
+        # outro worker gravou as mesmas partições ao mesmo tempo
+        db.session.rollback()
+    return linhas
+
+
+COLUNAS_PARTICAO = (
+    "customer_id", "mes", "ordem", "fatura_id", "descricao",
+    "valor_liquido", "data_pagamento", "vencimento", "link_pagamento",
+)
+
+
+def pagamentos_das_particoes(grupos: dict, p: dict) -> dict:
+    """
+    {polo_norm: [pagamentos]} dos clientes de cada grupo ({polo_norm: [clientes]})
+    no período de p, montado a partir das partições mensais. Só os pares
+    (polo, mês) ausentes ou vencidos vão ao Asaas; os meses fechados são lidos do banco.
+    Mesmos registros da varredura de iter_pagamentos_polo; no corte em max_pagamentos
+    os clientes seguem a mesma ordem e, dentro de cada cliente, as faturas vão por mês.
+    """
+    grupos = {polo: clientes for polo, clientes in grupos.items() if clientes}
+    meses = _meses(p["data_inicial"], p["data_final"])
+    if not grupos or not meses:
+        return {polo: [] for polo in grupos}
+
+    with fase("particoes"):
+        validas = particoes_validas(list(grupos), meses)
+    faltando = {(polo, mes) for polo in grupos for mes in meses} - validas
+    metricas.inc("relatorio_particoes_total", len(validas), estado="banco")
+    metricas.inc("relatorio_particoes_total", len(faltando), estado="asaas")
+
+    # linhas como tuplas na ordem de COLUNAS_PARTICAO
+    linhas = []
+    if faltando:
+        pz = prazo_atual()
+
+        def buscar():
+            # contagem própria: quem pegou carona na mesma busca também sabe se ela ficou incompleta
+            with com_prazo(pz.restante() if pz is not None else None) as sub:
+                return _buscar_particoes(faltando, p), sub.clientes_pulados, sub.clientes_com_falha, sub.paginas_puladas
+
+        buscadas, pulados, com_falha, paginas = voo_unico.executar(("particoes", tuple(sorted(faltando))), buscar)
+        if pz is not None:
+            pz.clientes_pulados += pulados
+            pz.clientes_com_falha += com_falha
+            pz.paginas_puladas += paginas
+        for lista in buscadas.values():
+            linhas.extend(tuple(linha[c] for c in COLUNAS_PARTICAO) for linha in lista)
+
+    with fase("particoes"):
+        if validas:
+            q = db.session.query(
+                PagamentoParticao.polo_norm,
+                *(getattr(PagamentoParticao, c) for c in COLUNAS_PARTICAO),
+            ).filter(
+                PagamentoParticao.polo_norm.in_({polo for polo, _ in validas}),
+                PagamentoParticao.mes.in_({mes for _, mes in validas}),
+                PagamentoParticao.data_pagamento >= p["data_inicial"],
+                PagamentoParticao.data_pagamento <= p["data_final"],
+            )
+            for polo, *linha in q:
+                if (polo, linha[1]) in validas:
+                    linhas.append(linha)
+
+        por_cliente = {}
+        for linha in linhas:
+            if p["data_inicial"] <= linha[6] <= p["data_final"]:
+                por_cliente.setdefault(linha[0], []).append(linha)
+
+        limite = p["max_pagamentos"]
+        resultado = {}
+        for polo, clientes in grupos.items():
+            pagamentos = resultado[polo] = []
+            for cli in clientes:
+                if len(pagamentos) >= limite:
+                    break
+                do_cliente = por_cliente.get(cli.get("id"), [])
+                do_cliente.sort(key=lambda linha: (linha[1], linha[2]))  # mês, ordem
+                nome, cpf, comp = cli.get("name"), cli.get("cpfCnpj"), cli.get("complement")
+                for _, _, _, fatura_id, descricao, valor_liq, pago_em, vencimento, link in do_cliente[: limite - len(pagamentos)]:
+                    pagamentos.append(
+                        RegistroPagamento(
+                            nome, cpf, comp, fatura_id, descricao, valor_liq, pago_em, vencimento, "RECEIVED", link
+                        )
+                    )
+        return resultado
+
+
+@app.cli.command("invalidar-particoes")
+@click.option("--polo", default=None, help="só deste polo")
+@click.option("--mes", "meses", multiple=True, help="só destes meses (YYYY-MM), pode repetir")
+def invalidar_particoes_cmd(polo, meses):
+    """Apaga partições mensais de pagamentos para que sejam buscadas de novo."""
+    n = invalidar_particoes(_norm(polo) if polo else None, list(meses) or None)
+    db.session.commit()
+    relatorios_cache.invalidar(lambda chave: chave[0] == "pagamentos")
+    click.echo(f"{n} partições apagadas.")
+
+
+def ordenar_historico(registros: list) -> list:
+    registros.sort(key=attrgetter("chave"))
+    return registros
+
+
+def ordenar_pagamentos(pagamentos: list) -> list:
+    pagamentos.sort(key=attrgetter("data_pagamento"))
+    return pagamentos
+
+
+def clientes_do_polo(p: dict) -> list:
+    with fase("clientes"):
+        return get_customers_by_polo(p["polo"], max_customers=p["max_clientes"])
+
+
+def gerar_relatorio_historico(p: dict):
+    """Lista ordenada de faturas do polo, ou None se o polo não tem clientes."""
+    clientes = clientes_do_polo(p)
+    if not clientes:
+        return None
+    registros = list(iter_faturas_historico(clientes, p))
+    with fase("ordenacao"):
+        return ordenar_historico(registros)
+
+
+def gerar_relatorio_pagamentos(p: dict):
+    """Lista ordenada de pagamentos do polo no período, ou None se o polo não tem clientes."""
+    clientes = clientes_do_polo(p)
+    if not clientes:
+        return None
+    polo_norm = _norm(p["polo"])
+    pagamentos = pagamentos_das_particoes({polo_norm: clientes}, p)[polo_norm]
+    with fase("ordenacao"):
+        return ordenar_pagamentos(pagamentos)
+
+
+def chave_historico(p: dict) -> tuple:
+    return (
+        "historico",
+        _norm(p["polo"]),
+        p["status"],
+        p["data_inicial"] or "",
+        p["data_final"] or "",
+        p["max_clientes"],
+        p["max_registros"],
+    )
+
+
+def chave_pagamentos(p: dict) -> tuple:
+    return (
+        "pagamentos",
+        _norm(p["polo"]),
+        p["data_inicial"],
+        p["data_final"],
+        p["max_clientes"],
+        p["max_pagamentos"],
+    )
+
+
+def _flag(valor) -> bool:
+    if isinstance(valor, str):
+        return valor.strip().lower() in ("1", "true", "sim", "yes")
+    return bool(valor)
+
+
+def _dados_requisicao() -> dict:
+    """Parâmetros do relatório: corpo JSON (POST) ou query string (GET)."""
+    if request.method == "GET":
+        dados = request.args.to_dict()
+        if "polos" in request.args:
+            dados["polos"] = request.args.getlist("polos")
+        return dados
+    return request.get_json(silent=True) or {}
+
+
+def _prazo_do_pedido(dados: dict):
+    """Prazo (s) do relatório: "prazo" do pedido (até RELATORIO_PRAZO_MAX) ou RELATORIO_PRAZO; None = sem prazo."""
+    try:
+        segundos = float(dados.get("prazo") or RELATORIO_PRAZO)
+    except (TypeError, ValueError):
+        segundos = RELATORIO_PRAZO
+    if segundos <= 0:
+        return None
+    return min(segundos, RELATORIO_PRAZO_MAX) if RELATORIO_PRAZO_MAX > 0 else segundos
+
+
+def nao_modificado(etag: str):
+    """Resposta 304 se o If-None-Match do cliente já tem esta ETag, senão None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    resp = Response(status=304)
+    resp.set_etag(etag, weak=True)
+    return resp
+
+
+def _formato_stream(dados: dict):
+    """None (resposta normal), 'ndjson' ou 'json' (array JSON enviado em partes)."""
+    stream = dados.get("stream")
+    if isinstance(stream, str) and stream.strip().lower() in ("ndjson", "json"):
+        return stream.strip().lower()
+    return "ndjson" if _flag(stream) else None
+
+
+def resposta_stream(registros, formato: str, cabecalho: dict, campo: str, mensagem):
+    """
+    Envia os registros à medida que são produzidos.
+
+    ndjson: uma linha com o cabeçalho, uma linha por registro e uma linha final
+            com status/mensagem/total.
+    json:   o mesmo objeto da resposta normal, com a lista 'campo' escrita em partes.
+    mensagem(total) monta o texto final. Erros no meio do envio viram a última
+    linha (ndjson) ou o campo 'status'/'mensagem' do fechamento (json).
+    """
+    dumps = app.json.dumps
+
+    def gerar():
+        total = 0
+        status, texto = "ok", None
+        if formato == "ndjson":
+            yield dumps(cabecalho) + "\n"
+        else:
+            yield dumps(cabecalho)[:-1] + ("," if cabecalho else "") + f'"{campo}":['
+
+        try:
+            for reg in registros:
+                if formato == "ndjson":
+                    yield reg.json() + "\n"
+                else:
+                    yield ("," if total else "") + reg.json()
+                total += 1
+            texto = mensagem(total)
+        except Exception as e:
+            status, texto = "erro", f"Erro durante o envio do relatório: {e}"
+
+        fim = {"status": status, "mensagem": texto, "total": total}
+        if formato == "ndjson":
+            yield dumps(fim) + "\n"
+        else:
+            yield "]," + dumps(fim)[1:]
+
+    mimetype = "application/x-ndjson" if formato == "ndjson" else "application/json"
+    return Response(stream_with_context(gerar()), mimetype=mimetype)
+
+
+# ========= AQUECIMENTO (CRON) =========
+def aquecer_relatorios(*, meses: int = 1, polos_por_lote: int = 10, concorrencia: int = 2, avisar=None) -> dict:
+    """
+    Deixa prontos no banco os dados que os relatórios dos polos ativos leem:
+    o espelho de clientes (sincronização incremental) e as partições de
+    pagamentos do mês corrente e dos (meses - 1) anteriores. Os polos vão em
+    lotes de polos_por_lote (uma leitura do Asaas por lote), com no máximo
+    concorrencia chamadas simultâneas. Meses abertos são sempre refeitos;
+    fechados, só se ainda não estiverem guardados.
     """
+    avisar = avisar or app.logger.info
+    inicio = time.time()
+    resumo = {"polos": 0, "particoes": 0, "clientes_com_falha": 0}
 
-    for p in parceiros:
-        expira_em = p.expira_em or ""
-        exp = "Expirada" if is_expired(expira_em) else "Ativa"
-        cor = "red" if exp == "Expirada" else "green"
-        fixa = p.chave in FIXED_KEYS
+    _sincronizar_clientes_se_preciso(forcar=True)
 
-        html += f"""
-            <tr>
-                <td class='{"fixo" if fixa else ""}'>{p.chave}</td>
-                <td>{p.nome}</td>
-                <td>{p.polo or ""}</td>
-                <td>{expira_em}</td>
-                <td style="color:{cor};">{exp}</td>
-        """
-
-        if fixa:
-            html += "<td>Fixa</td></tr>"
-        else:
-            html += f"""
-                <td>
-                    <form method="POST">
-                        <input type="hidden" name="delete_key" value="{p.chave}">
-                        <button style="color:red;">Remover</button>
-                    </form>
-                </td>
-            </tr>
-            """
+    hoje = date.today()
+    primeiro = hoje.replace(day=1)
+    for _ in range(max(1, meses) - 1):
+        primeiro = (primeiro - timedelta(days=1)).replace(day=1)
+    lista_meses = _meses(primeiro.isoformat(), hoje.isoformat())
+    p = _params_pagamentos(
+        {"data_inicial": primeiro.isoformat(), "data_final": hoje.isoformat(), "max_concorrencia": concorrencia}
+    )
 
-    html += """
-            </table>
-        </div>
-    </body>
-    </html>
+    polos = [_norm(polo) for polo in polos_ativos()]
+    resumo["polos"] = len(polos)
+    for i in range(0, len(polos), max(1, polos_por_lote)):
+        lote = polos[i:i + max(1, polos_por_lote)]
+        validas = particoes_validas(lote, lista_meses)
+        faltando = {
+            (polo, mes)
+            for polo in lote
+            for mes in lista_meses
+            if not _mes_fechado(mes, hoje) or (polo, mes) not in validas
+        }
+        if not faltando:
+            continue
+        t0 = time.time()
+        with com_prazo(None) as pz:
+            _buscar_particoes(faltando, p)
+        resumo["particoes"] += len(faltando)
+        resumo["clientes_com_falha"] += pz.clientes_com_falha
+        avisar(
+            f"Lote {i // max(1, polos_por_lote) + 1}: {len(lote)} polos, {len(faltando)} partições "
+            f"em {time.time() - t0:.1f}s" + (f" ({pz.clientes_com_falha} clientes com falha)" if pz.parcial else "")
+        )
+
+    resumo["segundos"] = round(time.time() - inicio, 1)
+    return resumo
+
+
+@app.cli.command("aquecer-relatorios")
+@click.option("--meses", default=1, show_default=True, help="mês corrente + quantos anteriores - 1")
+@click.option("--polos-por-lote", default=10, show_default=True)
+@click.option("--concorrencia", default=2, show_default=True, help="chamadas simultâneas ao Asaas")
+@click.option("--rps", type=float, default=None, help="chamadas por segundo ao Asaas (padrão: ASAAS_RPS)")
+def aquecer_relatorios_cmd(meses, polos_por_lote, concorrencia, rps):
+    """
+    Pré-carrega clientes e pagamentos dos polos com parceiro ativo (para o cron,
+    antes do pico da manhã; ex.: */5 6-9 * * *).
     """
-    return html
+    if not adquirir_trava("aquecimento_trava", 3600):
+        click.echo("Outro aquecimento está em andamento.")
+        return
+    try:
+        if rps is not None:
+            get_asaas().limitador = TokenBucket(rps, max(1, int(rps)))
+        resumo = aquecer_relatorios(
+            meses=meses, polos_por_lote=polos_por_lote, concorrencia=concorrencia, avisar=click.echo
+        )
+    finally:
+        liberar_trava("aquecimento_trava")
+    click.echo(
+        f"{resumo['polos']} polos, {resumo['particoes']} partições em {resumo['segundos']}s"
+        + (f"; {resumo['clientes_com_falha']} clientes com falha (partições não gravadas)" if resumo["clientes_com_falha"] else ".")
+    )
 
 
-# ========= LOGIN =========
-@app.route("/login", methods=["POST"])
-def login():
-    dados = request.get_json(silent=True) or {}
-    chave = (dados.get("chave_acesso") or "").strip().upper()
+# ========= PAGINAÇÃO DOS RELATÓRIOS =========
+# registros por linha de relatorios_snapshots_blocos; uma página lê só os blocos que cobre
+SNAPSHOT_BLOCO = 500
 
-    if not chave:
-        return jsonify({"status": "erro", "mensagem": "Chave vazia"}), 200
 
-    parceiro = Partner.query.get(chave)
-    if not parceiro:
-        return jsonify({"status": "erro", "mensagem": "Chave inválida"}), 200
+def _limite_pagina(dados: dict) -> int:
+    """Tamanho de página pedido ("limite_pagina"), até RELATORIO_PAGINA_MAX; 0 = lista inteira."""
+    try:
+        limite = int(dados.get("limite_pagina") or 0)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, min(limite, RELATORIO_PAGINA_MAX))
 
-    if is_expired(parceiro.expira_em or ""):
-        return jsonify({"status": "erro", "mensagem": "Chave expirada"}), 200
 
-    return jsonify(
-        {
-            "status": "ok",
-            "mensagem": "Acesso autorizado",
-            "polo": parceiro.polo,
-            "parceiro": parceiro.nome,
-            "chave": parceiro.chave,
-        }
-    ), 200
+def _cursor(snapshot_id: str, inicio: int, limite: int) -> str:
+    return base64.urlsafe_b64encode(f"{snapshot_id}:{inicio}:{limite}".encode()).decode().rstrip("=")
+
+
+def _ler_cursor(cursor: str) -> tuple:
+    """(snapshot_id, início, limite) do cursor; ValueError se não for um cursor nosso."""
+    texto = base64.urlsafe_b64decode(str(cursor) + "=" * (-len(str(cursor)) % 4)).decode()
+    snapshot_id, inicio, limite = texto.split(":")
+    inicio, limite = int(inicio), int(limite)
+    if inicio < 0 or limite < 1:
+        raise ValueError("cursor inválido")
+    return snapshot_id, inicio, min(limite, RELATORIO_PAGINA_MAX)
+
+
+def _limpar_snapshots(agora: float):
+    expirados = db.select(RelatorioSnapshot.id).where(RelatorioSnapshot.expira_em < agora)
+    RelatorioSnapshotBloco.query.filter(RelatorioSnapshotBloco.snapshot_id.in_(expirados)).delete(
+        synchronize_session=False
+    )
+    RelatorioSnapshot.query.filter(RelatorioSnapshot.expira_em < agora).delete(synchronize_session=False)
+
+
+def criar_snapshot(envelope: dict, campo: str, registros: list, etag: str) -> RelatorioSnapshot:
+    """
+    Guarda a lista (já ordenada) para ser paginada. O mesmo resultado pedido de
+    novo reaproveita o snapshot ainda válido (só renova a validade).
+    """
+    envelope_json = app.json.dumps(envelope)
+    assinatura = etag_de(f"{campo}:{envelope_json}:{etag}")
+    agora = time.time()
+
+    snap = RelatorioSnapshot.query.filter(
+        RelatorioSnapshot.assinatura == assinatura,
+        RelatorioSnapshot.campo == campo,
+        RelatorioSnapshot.expira_em > agora,
+    ).first()
+    if snap is not None:
+        snap.expira_em = agora + RELATORIO_SNAPSHOT_TTL
+        db.session.commit()
+        return snap
+
+    _limpar_snapshots(agora)
+    snap = RelatorioSnapshot(
+        id=secrets.token_hex(16),
+        assinatura=assinatura,
+        campo=campo,
+        envelope=envelope_json,
+        total=len(registros),
+        criado_em=agora,
+        expira_em=agora + RELATORIO_SNAPSHOT_TTL,
+    )
+    db.session.add(snap)
+    # Registro.json() não tem quebra de linha: um registro por linha do bloco
+    linhas = [reg.json() for reg in registros]
+    if linhas:
+        db.session.execute(
+            db.insert(RelatorioSnapshotBloco),
+            [
+                {"snapshot_id": snap.id, "bloco": i // SNAPSHOT_BLOCO, "linhas": "\n".join(linhas[i:i + SNAPSHOT_BLOCO])}
+                for i in range(0, len(linhas), SNAPSHOT_BLOCO)
+            ],
+        )
+    db.session.commit()
+    return snap
+
+
+def resposta_pagina(snap: RelatorioSnapshot, inicio: int, limite: int):
+    """Página [inicio, inicio + limite) do snapshot, com o cursor da próxima (ou 304 pela ETag)."""
+    etag = f"{snap.assinatura}-{inicio}-{limite}"
+    resp = nao_modificado(etag)
+    if resp is not None:
+        return resp
+
+    linhas = []
+    if inicio < snap.total:
+        primeiro = inicio // SNAPSHOT_BLOCO
+        ultimo = (inicio + limite - 1) // SNAPSHOT_BLOCO
+        blocos = (
+            db.session.query(RelatorioSnapshotBloco.linhas)
+            .filter(
+                RelatorioSnapshotBloco.snapshot_id == snap.id,
+                RelatorioSnapshotBloco.bloco.between(primeiro, ultimo),
+            )
+            .order_by(RelatorioSnapshotBloco.bloco)
+        )
+        for (texto,) in blocos:
+            linhas.extend(texto.split("\n"))
+        desloc = inicio - primeiro * SNAPSHOT_BLOCO
+        linhas = linhas[desloc:desloc + limite]
+
+    fim = inicio + len(linhas)
+    envelope = {
+        **app.json.loads(snap.envelope),
+        "total": snap.total,
+        "inicio": inicio,
+        "proximo_cursor": _cursor(snap.id, fim, limite) if fim < snap.total else None,
+    }
+    metricas.inc("relatorio_registros_devolvidos_total", len(linhas), relatorio=_relatorio_atual())
+    resp = resposta_json(envelope, snap.campo, "[" + ",".join(linhas) + "]")
+    resp.set_etag(etag, weak=True)
+    return resp
+
+
+def pagina_do_cursor(cursor: str, campo: str):
+    """(resposta, None) com a página do cursor, ou (None, mensagem de erro)."""
+    try:
+        snapshot_id, inicio, limite = _ler_cursor(cursor)
+    except ValueError:
+        return None, "Cursor inválido."
+    snap = db.session.get(RelatorioSnapshot, snapshot_id)
+    if snap is None or snap.campo != campo or snap.expira_em < time.time():
+        return None, "Cursor expirado: gere o relatório de novo."
+    metricas.inc("relatorio_requisicoes_total", relatorio=_relatorio_atual(), cache="snapshot")
+    resp = resposta_pagina(snap, inicio, limite)
+    resp.headers["X-Cache"] = "snapshot"
+    return resp, None
 
 
 # ========= RELATÓRIO HISTÓRICO =========
-@app.route("/api/relatorio_polo_historico", methods=["POST"])
+@app.route("/api/relatorio_polo_historico", methods=["GET", "POST"])
 def relatorio_polo_historico():
+    g.relatorio = "historico"
     ok, resp_err = ensure_asaas_configured()
     if not ok:
         base = resp_err.get_json() if hasattr(resp_err, "get_json") else {"status": "erro", "mensagem": "Erro de configuração."}
@@ -365,106 +3484,78 @@ def relatorio_polo_historico():
         return jsonify(base), 200
 
     try:
-        dados = request.get_json(silent=True) or {}
+        dados = _dados_requisicao()
         polo = dados.get("polo")
 
+        # página seguinte: sai do snapshot da primeira, sem refazer o relatório
+        if dados.get("cursor"):
+            resp, erro = pagina_do_cursor(dados["cursor"], "faturas")
+            if erro:
+                return jsonify({"status": "erro", "mensagem": erro, "polo": polo, "faturas": []}), 200
+            return resp
+
         if not polo:
             return jsonify({"status": "erro", "mensagem": "Campo obrigatório: polo", "polo": None, "faturas": []}), 200
 
-        max_clientes = int(dados.get("max_clientes", DEFAULT_MAX_CLIENTES))
-        max_faturas_cliente = int(dados.get("max_faturas_cliente", DEFAULT_MAX_FATURAS_CLIENTE))
-        max_registros = int(dados.get("max_registros", DEFAULT_MAX_REGISTROS))
-
-        status_filtro = (dados.get("status") or "").strip().upper()  # opcional
-        data_inicial = dados.get("data_inicial")  # opcional YYYY-MM-DD (paymentDate)
-        data_final = dados.get("data_final")      # opcional YYYY-MM-DD (paymentDate)
+        p = _params_historico(dados)
 
-        dt_ini = None
-        dt_fim = None
-        if data_inicial:
-            dt_ini = datetime.strptime(data_inicial, "%Y-%m-%d").date()
-        if data_final:
-            dt_fim = datetime.strptime(data_final, "%Y-%m-%d").date()
+        # modo streaming: não passa pelo cache e só ordena se pedido ("ordenar": true)
+        formato = _formato_stream(dados)
+        if formato:
+            clientes = clientes_do_polo(p)
+            if not clientes:
+                return jsonify({"status": "erro", "mensagem": f"Nenhum cliente encontrado para o polo {polo}.", "polo": polo, "faturas": []}), 200
+            registros = iter_faturas_historico(clientes, p)
+            if _flag(dados.get("ordenar")):
+                registros = ordenar_historico(list(registros))
+            return resposta_stream(
+                registros,
+                formato,
+                {"polo": polo},
+                "faturas",
+                lambda n: f"{n} faturas encontradas para o polo {polo}.",
+            )
 
-        clientes = get_customers_by_polo(polo, max_customers=max_clientes)
-        if not clientes:
+        chave = chave_historico(p)
+        with com_prazo(_prazo_do_pedido(dados)) as pz:
+            registros, estado_cache = relatorios_cache.obter(
+                chave,
+                lambda: gerar_relatorio_historico(p),
+                bypass=_flag(dados.get("sem_cache")),
+            )
+        if registros is None:
             return jsonify({"status": "erro", "mensagem": f"Nenhum cliente encontrado para o polo {polo}.", "polo": polo, "faturas": []}), 200
 
-        session = requests.Session()
-        registros = []
-
-        for cli in clientes:
-            if len(registros) >= max_registros:
-                break
-
-            aluno_id = cli.get("id")
-            nome = cli.get("name")
-            cpf = cli.get("cpfCnpj")
-            comp = cli.get("complement")
-
-            try:
-                r = session.get(
-                    f"{ASAAS_BASE_URL}/payments",
-                    headers=asaas_headers(),
-                    params={"customer": aluno_id, "limit": max_faturas_cliente},
-                    timeout=DEFAULT_TIMEOUT,
-                )
-                r.raise_for_status()
-                lista = r.json().get("data", [])
-            except Exception:
-                continue
-
-            for fat in lista:
-                if len(registros) >= max_registros:
-                    break
-
-                st = (fat.get("status") or "").upper()
-                if status_filtro and st != status_filtro:
-                    continue
-
-                pay_date_str = fat.get("paymentDate")
-
-                if dt_ini or dt_fim:
-                    if not pay_date_str:
-                        continue
-                    try:
-                        pay_date = datetime.strptime(pay_date_str, "%Y-%m-%d").date()
-                    except ValueError:
-                        continue
-                    if dt_ini and pay_date < dt_ini:
-                        continue
-                    if dt_fim and pay_date > dt_fim:
-                        continue
+        metricas.inc("relatorio_requisicoes_total", relatorio="historico", cache=estado_cache)
+        corpo, etag = relatorios_cache.serializado(chave, registros)
+        envelope = {
+            "status": "ok",
+            "mensagem": f"{len(registros)} faturas encontradas para o polo {polo}.",
+            "polo": polo,
+            **pz.to_dict(),
+        }
 
-                registros.append(
-                    {
-                        "nome": nome,
-                        "cpf": cpf,
-                        "polo": comp,
-                        "fatura_id": fat.get("id"),
-                        "descricao": fat.get("description"),
-                        "valor": fat.get("value"),
-                        "valor_liquido": fat.get("netValue"),
-                        "vencimento": fat.get("dueDate"),
-                        "status": st,
-                        "data_pagamento": pay_date_str,
-                        "link_pagamento": fat.get("invoiceUrl"),
-                    }
-                )
+        limite_pagina = _limite_pagina(dados)
+        if limite_pagina:
+            resp = resposta_pagina(criar_snapshot(envelope, "faturas", registros, etag), 0, limite_pagina)
+            resp.headers["X-Cache"] = estado_cache
+            return resp
 
-        registros.sort(key=lambda x: (x.get("nome") or "", x.get("vencimento") or ""))
+        # resposta parcial não ganha ETag: a próxima pode vir completa
+        resp = None if pz.parcial else nao_modificado(etag)
+        if resp is not None:
+            resp.headers["X-Cache"] = estado_cache
+            return resp
 
-        return jsonify(
-            {
-                "status": "ok",
-                "mensagem": f"{len(registros)} faturas encontradas para o polo {polo}.",
-                "polo": polo,
-                "faturas": registros,
-            }
-        ), 200
+        metricas.inc("relatorio_registros_devolvidos_total", len(registros), relatorio="historico")
+        resp = resposta_json(envelope, "faturas", corpo)
+        if not pz.parcial:
+            resp.set_etag(etag, weak=True)
+        resp.headers["X-Cache"] = estado_cache
+        return resp, 200
 
     except Exception as e:
-        d = request.get_json(silent=True) or {}
+        d = _dados_requisicao()
         return jsonify(
             {
                 "status": "erro",
@@ -476,8 +3567,9 @@ def relatorio_polo_historico():
 
 
 # ========= RELATÓRIO PAGAMENTOS =========
-@app.route("/api/relatorio_polo_pagamentos", methods=["POST"])
+@app.route("/api/relatorio_polo_pagamentos", methods=["GET", "POST"])
 def relatorio_polo_pagamentos():
+    g.relatorio = "pagamentos"
     ok, resp_err = ensure_asaas_configured()
     if not ok:
         base = resp_err.get_json() if hasattr(resp_err, "get_json") else {"status": "erro", "mensagem": "Erro de configuração."}
@@ -485,11 +3577,27 @@ def relatorio_polo_pagamentos():
         return jsonify(base), 200
 
     try:
-        dados = request.get_json(silent=True) or {}
+        dados = _dados_requisicao()
         polo = dados.get("polo")
         data_inicial = dados.get("data_inicial")
         data_final = dados.get("data_final")
 
+        # página seguinte: sai do snapshot da primeira, sem refazer o relatório
+        if dados.get("cursor"):
+            resp, erro = pagina_do_cursor(dados["cursor"], "pagamentos")
+            if erro:
+                return jsonify(
+                    {
+                        "status": "erro",
+                        "mensagem": erro,
+                        "polo": polo,
+                        "data_inicial": data_inicial,
+                        "data_final": data_final,
+                        "pagamentos": [],
+                    }
+                ), 200
+            return resp
+
         if not polo or not data_inicial or not data_final:
             return jsonify(
                 {
@@ -502,18 +3610,13 @@ def relatorio_polo_pagamentos():
                 }
             ), 200
 
-        max_clientes = int(dados.get("max_clientes", DEFAULT_MAX_CLIENTES))
-        max_faturas_cliente = int(dados.get("max_faturas_cliente", DEFAULT_MAX_FATURAS_CLIENTE))
-        max_pagamentos = int(dados.get("max_pagamentos", DEFAULT_MAX_REGISTROS))
-
         try:
-            dt_ini = datetime.strptime(data_inicial, "%Y-%m-%d").date()
-            dt_fim = datetime.strptime(data_final, "%Y-%m-%d").date()
-        except ValueError:
+            p = _params_pagamentos(dados)
+        except (TypeError, ValueError) as e:
             return jsonify(
                 {
                     "status": "erro",
-                    "mensagem": "Datas devem estar no formato YYYY-MM-DD",
+                    "mensagem": str(e),
                     "polo": polo,
                     "data_inicial": data_inicial,
                     "data_final": data_final,
@@ -521,8 +3624,40 @@ def relatorio_polo_pagamentos():
                 }
             ), 200
 
-        clientes = get_customers_by_polo(polo, max_customers=max_clientes)
-        if not clientes:
+        # modo streaming: não passa pelo cache e só ordena se pedido ("ordenar": true)
+        formato = _formato_stream(dados)
+        if formato:
+            clientes = clientes_do_polo(p)
+            if not clientes:
+                return jsonify(
+                    {
+                        "status": "erro",
+                        "mensagem": f"Nenhum cliente encontrado para o polo {polo}.",
+                        "polo": polo,
+                        "data_inicial": data_inicial,
+                        "data_final": data_final,
+                        "pagamentos": [],
+                    }
+                ), 200
+            pagamentos = iter_pagamentos_polo(clientes, p)
+            if _flag(dados.get("ordenar")):
+                pagamentos = ordenar_pagamentos(list(pagamentos))
+            return resposta_stream(
+                pagamentos,
+                formato,
+                {"polo": polo, "data_inicial": data_inicial, "data_final": data_final},
+                "pagamentos",
+                lambda n: f"{n} pagamentos encontrados para o polo {polo}.",
+            )
+
+        chave = chave_pagamentos(p)
+        with com_prazo(_prazo_do_pedido(dados)) as pz:
+            pagamentos, estado_cache = relatorios_cache.obter(
+                chave,
+                lambda: gerar_relatorio_pagamentos(p),
+                bypass=_flag(dados.get("sem_cache")),
+            )
+        if pagamentos is None:
             return jsonify(
                 {
                     "status": "erro",
@@ -534,101 +3669,610 @@ def relatorio_polo_pagamentos():
                 }
             ), 200
 
-        session = requests.Session()
-        pagamentos = []
+        metricas.inc("relatorio_requisicoes_total", relatorio="pagamentos", cache=estado_cache)
+        corpo, etag = relatorios_cache.serializado(chave, pagamentos)
+        envelope = {
+            "status": "ok",
+            "mensagem": f"{len(pagamentos)} pagamentos encontrados para o polo {polo}.",
+            "polo": polo,
+            "data_inicial": data_inicial,
+            "data_final": data_final,
+            **pz.to_dict(),
+        }
+
+        limite_pagina = _limite_pagina(dados)
+        if limite_pagina:
+            resp = resposta_pagina(criar_snapshot(envelope, "pagamentos", pagamentos, etag), 0, limite_pagina)
+            resp.headers["X-Cache"] = estado_cache
+            return resp
+
+        # resposta parcial não ganha ETag: a próxima pode vir completa
+        resp = None if pz.parcial else nao_modificado(etag)
+        if resp is not None:
+            resp.headers["X-Cache"] = estado_cache
+            return resp
+
+        metricas.inc("relatorio_registros_devolvidos_total", len(pagamentos), relatorio="pagamentos")
+        resp = resposta_json(envelope, "pagamentos", corpo)
+        if not pz.parcial:
+            resp.set_etag(etag, weak=True)
+        resp.headers["X-Cache"] = estado_cache
+        return resp, 200
+
+    except Exception as e:
+        d = _dados_requisicao()
+        return jsonify(
+            {
+                "status": "erro",
+                "mensagem": f"Erro ao gerar relatório por polo (pagamentos): {str(e)}",
+                "polo": d.get("polo"),
+                "data_inicial": d.get("data_inicial"),
+                "data_final": d.get("data_final"),
+                "pagamentos": [],
+            }
+        ), 200
+
 
+# ========= RELATÓRIOS EM LOTE (VÁRIOS POLOS) =========
+def varrer_lote(grupos: dict, p: dict, filtros: dict, montar, limite: int) -> dict:
+    """
+    {polo_norm: [registros]} lendo as faturas de todos os clientes de grupos numa
+    só passada. Diferente da rota de um polo, atingir o limite de um polo não
+    interrompe a leitura dos clientes dele enquanto outros polos ainda estão abertos.
+    """
+    polo_do_cliente = {}
+    todos = []
+    for polo, clientes in grupos.items():
         for cli in clientes:
-            if len(pagamentos) >= max_pagamentos:
+            polo_do_cliente[cli.get("id")] = polo
+            todos.append(cli)
+
+    registros = {polo: [] for polo, clientes in grupos.items() if clientes}
+    abertos = len(registros)
+    for cli, lista in cronometrar_faturas(_faturas_dos_clientes(todos, p, filtros)):
+        if not abertos:
+            break
+        destino = registros[polo_do_cliente[cli.get("id")]]
+        if len(destino) >= limite:
+            continue
+        for reg in montar(cli, lista, p):
+            destino.append(reg)
+            if len(destino) >= limite:
+                abertos -= 1
                 break
+    return registros
 
-            aluno_id = cli.get("id")
-            nome = cli.get("name")
-            cpf = cli.get("cpfCnpj")
-            comp = cli.get("complement")
 
-            try:
-                r = session.get(
-                    f"{ASAAS_BASE_URL}/payments",
-                    headers=asaas_headers(),
-                    params={"customer": aluno_id, "limit": max_faturas_cliente},
-                    timeout=DEFAULT_TIMEOUT,
-                )
-                r.raise_for_status()
-                lista = r.json().get("data", [])
-            except Exception:
-                continue
+# tipo -> (registros por polo a partir de {polo_norm: clientes}, ordenação, chave do cache)
+RELATORIOS_LOTE = {
+    "historico": (
+        lambda grupos, p: varrer_lote(grupos, p, filtros_historico(p), registros_historico_cliente, p["max_registros"]),
+        ordenar_historico,
+        chave_historico,
+    ),
+    "pagamentos": (pagamentos_das_particoes, ordenar_pagamentos, chave_pagamentos),
+}
 
-            for fat in lista:
-                if len(pagamentos) >= max_pagamentos:
-                    break
 
-                status = (fat.get("status") or "").upper()
-                if status != "RECEIVED":
-                    continue
+def gerar_relatorios_lote(tipo: str, polos: list, p: dict, *, bypass: bool = False) -> dict:
+    """
+    Relatório de vários polos com uma consulta ao espelho e uma leitura de
+    faturas por cliente (ou uma consulta da conta, na estratégia auto).
 
-                pay_date_str = fat.get("paymentDate")
-                if not pay_date_str:
-                    continue
+    Devolve {polo: (lista ordenada ou None, estado do cache, JSON da lista, ETag)}. Cada polo
+    respeita o próprio max_clientes / limite de registros, igual à rota de um
+    polo, e o resultado calculado fica no cache com a mesma chave dela.
+    """
+    gerar, ordenar, chave_fn = RELATORIOS_LOTE[tipo]
 
-                try:
-                    pay_date = datetime.strptime(pay_date_str, "%Y-%m-%d").date()
-                except ValueError:
-                    continue
+    por_norm = {}
+    for polo in polos:
+        por_norm.setdefault(_norm(polo), polo)
+
+    resultado = {}
+    pendentes = []
+    for norm, polo in por_norm.items():
+        chave = chave_fn({**p, "polo": polo})
+        valor = None if bypass else relatorios_cache.consultar(chave)
+        if valor is not None:
+            resultado[polo] = (valor, "hit", *relatorios_cache.serializado(chave, valor))
+        else:
+            pendentes.append(norm)
+
+    if pendentes:
+        with fase("clientes"):
+            grupos = clientes_por_polo(pendentes, max_customers=p["max_clientes"])
+        registros = gerar(grupos, p)
 
-                if not (dt_ini <= pay_date <= dt_fim):
+        estado = "bypass" if bypass else "miss"
+        with fase("ordenacao"):
+            for norm in pendentes:
+                polo = por_norm[norm]
+                if norm not in registros:
+                    resultado[polo] = (None, estado, None, None)
                     continue
+                chave = chave_fn({**p, "polo": polo})
+                valor = ordenar(registros[norm])
+                if not relatorio_parcial():
+                    relatorios_cache.guardar(chave, valor)
+                resultado[polo] = (valor, estado, *relatorios_cache.serializado(chave, valor))
 
-                valor_liq = fat.get("netValue") if fat.get("netValue") is not None else fat.get("value")
+    return {polo: resultado[polo] for polo in por_norm.values()}
 
-                pagamentos.append(
-                    {
-                        "nome": nome,
-                        "cpf": cpf,
-                        "polo": comp,
-                        "fatura_id": fat.get("id"),
-                        "descricao": fat.get("description"),
-                        "valor_liquido": valor_liq,
-                        "data_pagamento": pay_date_str,
-                        "vencimento": fat.get("dueDate"),
-                        "status": status,
-                        "link_pagamento": fat.get("invoiceUrl"),
-                    }
-                )
 
-        pagamentos.sort(key=lambda x: x.get("data_pagamento") or "")
+def _polos_do_lote(dados: dict):
+    """Lista de polos pedida ('polos' ou 'todos_ativos'), ou None se nenhuma foi informada."""
+    if _flag(dados.get("todos_ativos")):
+        return polos_ativos()
+    polos = dados.get("polos")
+    if isinstance(polos, str):
+        polos = [polos]
+    if not isinstance(polos, list):
+        return None
+    polos = [str(x).strip() for x in polos if x and str(x).strip()]
+    return polos or None
+
+
+def resposta_lote(tipo: str, campo: str, resultados: dict, texto, extras: dict):
+    """Monta o JSON do lote: um bloco status/mensagem/lista por polo (ou 304 pela ETag)."""
+    for lista, estado_cache, _, _ in resultados.values():
+        if lista is not None:
+            metricas.inc("relatorio_requisicoes_total", relatorio=f"{tipo}_lote", cache=estado_cache)
+
+    etag = etag_de(app.json.dumps([{polo: r[3] for polo, r in resultados.items()}, extras]))
+    resp = nao_modificado(etag)
+    if resp is not None:
+        return resp
 
+    # cada polo vira um objeto com a lista já serializada (do cache) emendada
+    blocos = []
+    total = 0
+    for polo, (lista, estado_cache, corpo, _) in resultados.items():
+        if lista is None:
+            bloco = app.json.dumps({"status": "erro", "mensagem": f"Nenhum cliente encontrado para o polo {polo}.", campo: []})
+        else:
+            total += len(lista)
+            bloco = emendar_json(
+                {"status": "ok", "mensagem": f"{texto(len(lista))} para o polo {polo}.", "cache": estado_cache},
+                campo,
+                corpo,
+            )
+        blocos.append(f"{_json(polo)}:{bloco}")
+
+    metricas.inc("relatorio_registros_devolvidos_total", total, relatorio=f"{tipo}_lote")
+    resp = resposta_json(
+        {"status": "ok", "mensagem": f"{texto(total)} em {len(blocos)} polos.", **extras},
+        "polos",
+        "{" + ",".join(blocos) + "}",
+    )
+    resp.set_etag(etag, weak=True)
+    return resp, 200
+
+
+@app.route("/api/relatorio_polos_historico", methods=["GET", "POST"])
+def relatorio_polos_historico():
+    """Histórico de vários polos: {"polos": [...]} ou {"todos_ativos": true} + filtros do histórico."""
+    g.relatorio = "historico_lote"
+    ok, resp_err = ensure_asaas_configured()
+    if not ok:
+        base = resp_err.get_json() if hasattr(resp_err, "get_json") else {"status": "erro", "mensagem": "Erro de configuração."}
+        base.update({"polos": {}})
+        return jsonify(base), 200
+
+    try:
+        dados = _dados_requisicao()
+        polos = _polos_do_lote(dados)
+        if not polos:
+            return jsonify({"status": "erro", "mensagem": "Informe polos (lista) ou todos_ativos: true", "polos": {}}), 200
+
+        p = _params_historico(dados)
+        with com_prazo(_prazo_do_pedido(dados)) as pz:
+            resultados = gerar_relatorios_lote("historico", polos, p, bypass=_flag(dados.get("sem_cache")))
+        return resposta_lote(
+            "historico",
+            "faturas",
+            resultados,
+            lambda n: f"{n} faturas encontradas",
+            pz.to_dict(),
+        )
+
+    except Exception as e:
         return jsonify(
             {
-                "status": "ok",
-                "mensagem": f"{len(pagamentos)} pagamentos encontrados para o polo {polo}.",
-                "polo": polo,
-                "data_inicial": data_inicial,
-                "data_final": data_final,
-                "pagamentos": pagamentos,
+                "status": "erro",
+                "mensagem": f"Erro ao gerar relatório de vários polos (histórico): {str(e)}",
+                "polos": {},
             }
         ), 200
 
+
+@app.route("/api/relatorio_polos_pagamentos", methods=["GET", "POST"])
+def relatorio_polos_pagamentos():
+    """Pagamentos de vários polos: {"polos": [...]} ou {"todos_ativos": true} + data_inicial/data_final."""
+    g.relatorio = "pagamentos_lote"
+    ok, resp_err = ensure_asaas_configured()
+    if not ok:
+        base = resp_err.get_json() if hasattr(resp_err, "get_json") else {"status": "erro", "mensagem": "Erro de configuração."}
+        base.update({"data_inicial": None, "data_final": None, "polos": {}})
+        return jsonify(base), 200
+
+    try:
+        dados = _dados_requisicao()
+        data_inicial = dados.get("data_inicial")
+        data_final = dados.get("data_final")
+        periodo = {"data_inicial": data_inicial, "data_final": data_final}
+
+        if not data_inicial or not data_final:
+            return jsonify({"status": "erro", "mensagem": "Campos obrigatórios: data_inicial, data_final", **periodo, "polos": {}}), 200
+
+        try:
+            p = _params_pagamentos(dados)
+        except (TypeError, ValueError) as e:
+            return jsonify({"status": "erro", "mensagem": str(e), **periodo, "polos": {}}), 200
+
+        polos = _polos_do_lote(dados)
+        if not polos:
+            return jsonify({"status": "erro", "mensagem": "Informe polos (lista) ou todos_ativos: true", **periodo, "polos": {}}), 200
+
+        with com_prazo(_prazo_do_pedido(dados)) as pz:
+            resultados = gerar_relatorios_lote("pagamentos", polos, p, bypass=_flag(dados.get("sem_cache")))
+        return resposta_lote(
+            "pagamentos",
+            "pagamentos",
+            resultados,
+            lambda n: f"{n} pagamentos encontrados",
+            {**periodo, **pz.to_dict()},
+        )
+
     except Exception as e:
-        d = request.get_json(silent=True) or {}
+        d = _dados_requisicao()
         return jsonify(
             {
                 "status": "erro",
-                "mensagem": f"Erro ao gerar relatório por polo (pagamentos): {str(e)}",
-                "polo": d.get("polo"),
+                "mensagem": f"Erro ao gerar relatório de vários polos (pagamentos): {str(e)}",
                 "data_inicial": d.get("data_inicial"),
                 "data_final": d.get("data_final"),
-                "pagamentos": [],
+                "polos": {},
             }
         ), 200
 
 
+# ========= VISÃO GERAL (TODOS OS POLOS) =========
+visao_geral_cache = CacheRelatorios(VISAO_GERAL_CACHE_TTL, VISAO_GERAL_CACHE_STALE, 50, 100000)
+
+
+def _faturas_de_todos(filtros: dict, ids_livro: set, ids_remotos: set, max_em_voo: int):
+    """
+    Faturas com os filtros: do livro local para ids_livro, de uma consulta da
+    conta para ids_remotos. Se o prazo acaba no meio da consulta, as páginas
+    não lidas vão para paginas_puladas do prazo.
+    """
+    if ids_livro:
+        for lista in faturas_do_livro(ids_livro, filtros).values():
+            yield from lista
+    if ids_remotos:
+        try:
+            primeira = fetch_payments_pagina(filtros, 0, ASAAS_MAX_PAGE_SIZE)
+            por_cliente, faltaram = _faturas_da_conta(primeira, filtros, ids_remotos, ASAAS_MAX_PAGE_SIZE, max_em_voo)
+        except PrazoEsgotado:
+            por_cliente, faltaram = {}, 1
+        pz = prazo_atual()
+        if faltaram and pz is not None:
+            pz.paginas_puladas += faltaram
+        for lista in por_cliente.values():
+            yield from lista
+
+
+def gerar_visao_geral(p: dict) -> list:
+    """
+    Uma linha por polo (complement normalizado) com o número de clientes, as
+    faturas por status (vencimento no período) e o valor líquido recebido
+    (pagamento no período). Lê o espelho de clientes uma vez e as faturas da
+    conta em duas consultas (por vencimento e por pagamento), sem ir polo a polo.
+    """
+    garantir_clientes_sincronizados()
+    with fase("clientes"):
+        clientes = (
+            db.session.query(AsaasCustomer.id, AsaasCustomer.complement, AsaasCustomer.complement_norm)
+            .filter(AsaasCustomer.removido.is_(False))
+            .all()
+        )
+
+    polos = {}
+    polo_do_cliente = {}
+    for cid, complement, norm in clientes:
+        norm = norm or ""
+        polo_do_cliente[cid] = norm
+        linha = polos.get(norm)
+        if linha is None:
+            linha = polos[norm] = {
+                "polo": (complement or "").strip(),
+                "polo_norm": norm,
+                "clientes": 0,
+                "faturas": {},
+                "valor_liquido_recebido": 0.0,
+            }
+        linha["clientes"] += 1
+
+    ids_livro = clientes_no_livro(list(polo_do_cliente))
+    ids_remotos = set(polo_do_cliente) - ids_livro
+    por_vencimento = payments_params(vencimento_de=p["data_inicial"], vencimento_ate=p["data_final"])
+    recebidas = payments_params(status="RECEIVED", pago_de=p["data_inicial"], pago_ate=p["data_final"])
+
+    with fase("faturas"):
+        for fat in _faturas_de_todos(por_vencimento, ids_livro, ids_remotos, p["max_concorrencia"]):
+            faturas = polos[polo_do_cliente[fat.get("customer")]]["faturas"]
+            status = (fat.get("status") or "").upper()
+            faturas[status] = faturas.get(status, 0) + 1
+        for fat in _faturas_de_todos(recebidas, ids_livro, ids_remotos, p["max_concorrencia"]):
+            linha = polos[polo_do_cliente[fat.get("customer")]]
+            linha["valor_liquido_recebido"] += _valor_liquido(fat.get("value"), fat.get("netValue")) or 0.0
+
+    resultado = sorted(polos.values(), key=itemgetter("polo_norm"))
+    for linha in resultado:
+        linha["valor_liquido_recebido"] = round(linha["valor_liquido_recebido"], 2)
+    return resultado
+
+
+@app.route("/api/visao_geral", methods=["GET", "POST"])
+def visao_geral():
+    """Todos os polos numa tabela: clientes, faturas por status e líquido recebido no período."""
+    g.relatorio = "visao_geral"
+    ok, resp_err = ensure_asaas_configured()
+    if not ok:
+        base = resp_err.get_json() if hasattr(resp_err, "get_json") else {"status": "erro", "mensagem": "Erro de configuração."}
+        base.update({"data_inicial": None, "data_final": None, "polos": []})
+        return jsonify(base), 200
+
+    dados = _dados_requisicao()
+    periodo = {"data_inicial": dados.get("data_inicial"), "data_final": dados.get("data_final")}
+    if not periodo["data_inicial"] or not periodo["data_final"]:
+        return jsonify({"status": "erro", "mensagem": "Campos obrigatórios: data_inicial, data_final", **periodo, "polos": []}), 200
+
+    try:
+        p = {
+            **{campo: _data_do_pedido(valor, campo) for campo, valor in periodo.items()},
+            "max_concorrencia": _concorrencia_do_pedido(dados),
+        }
+    except ValueError as e:
+        return jsonify({"status": "erro", "mensagem": str(e), **periodo, "polos": []}), 200
+
+    try:
+        chave = ("visao_geral", p["data_inicial"], p["data_final"])
+        # no miss a consulta da conta corre dentro do prazo; incompleta, não vai para o cache
+        with com_prazo(_prazo_do_pedido(dados)) as pz:
+            polos, estado_cache = visao_geral_cache.obter(
+                chave, lambda: gerar_visao_geral(p), bypass=_flag(dados.get("sem_cache"))
+            )
+    except Exception as e:
+        return jsonify({"status": "erro", "mensagem": f"Erro ao gerar a visão geral: {str(e)}", **periodo, "polos": []}), 200
+
+    metricas.inc("relatorio_requisicoes_total", relatorio="visao_geral", cache=estado_cache)
+    corpo, etag = visao_geral_cache.serializado(chave, polos)
+    # resposta parcial não ganha ETag: a próxima pode vir completa
+    resp = None if pz.parcial else nao_modificado(etag)
+    if resp is not None:
+        resp.headers["X-Cache"] = estado_cache
+        return resp
+
+    faturas = {}
+    for linha in polos:
+        for status, n in linha["faturas"].items():
+            faturas[status] = faturas.get(status, 0) + n
+    total = {
+        "clientes": sum(linha["clientes"] for linha in polos),
+        "faturas": faturas,
+        "valor_liquido_recebido": round(sum(linha["valor_liquido_recebido"] for linha in polos), 2),
+    }
+    resp = resposta_json(
+        {"status": "ok", "mensagem": f"{len(polos)} polos.", **periodo, **pz.to_dict(), "total": total},
+        "polos",
+        corpo,
+    )
+    if not pz.parcial:
+        resp.set_etag(etag, weak=True)
+    resp.headers["X-Cache"] = estado_cache
+    return resp, 200
+
+
+# ========= RELATÓRIOS EM SEGUNDO PLANO =========
+RELATORIOS_JOB = {
+    # tipo: (parâmetros, gerador, ordenação, chave do cache, campo da lista, texto)
+    "historico": (_params_historico, iter_faturas_historico, ordenar_historico, chave_historico, "faturas", "faturas encontradas"),
+    "pagamentos": (_params_pagamentos, iter_pagamentos_polo, ordenar_pagamentos, chave_pagamentos, "pagamentos", "pagamentos encontrados"),
+}
+
+_job_executor = None
+_job_executor_pid = None
+
+
+def _executor_jobs() -> ThreadPoolExecutor:
+    global _job_executor, _job_executor_pid
+    if _job_executor is None or _job_executor_pid != os.getpid():
+        _job_executor = ThreadPoolExecutor(max_workers=max(1, JOB_MAX_WORKERS), thread_name_prefix="relatorio-job")
+        _job_executor_pid = os.getpid()
+    return _job_executor
+
+
+def _executar_job(job_id: str):
+    with app.app_context():
+        job = db.session.get(RelatorioJob, job_id)
+        if job is None:
+            return
+        _, gerador, ordenar, chave, _, texto = RELATORIOS_JOB[job.tipo]
+        p = app.json.loads(job.parametros)
+
+        job.status = "executando"
+        job.atualizado_em = time.time()
+        db.session.commit()
+
+        try:
+            clientes = get_customers_by_polo(p["polo"], max_customers=p["max_clientes"])
+            job.clientes_total = len(clientes)
+            db.session.commit()
+            if not clientes:
+                raise ValueError(f"Nenhum cliente encontrado para o polo {p['polo']}.")
+
+            ultimo = [0.0]
+
+            def progresso(processados, registros):
+                agora = time.time()
+                if agora - ultimo[0] < 1:
+                    return
+                ultimo[0] = agora
+                job.clientes_processados = processados
+                job.registros = registros
+                job.atualizado_em = agora
+                db.session.commit()
+
+            # job não tem prazo, mas conta os clientes que falharam
+            with com_prazo(None) as pz:
+                registros = ordenar(list(gerador(clientes, p, progresso)))
+            if not pz.parcial:
+                relatorios_cache.guardar(chave(p), registros)
+
+            job.resultado = relatorios_cache.serializado(chave(p), registros)[0]
+            job.clientes_processados = len(clientes)
+            job.registros = len(registros)
+            job.status = "concluido"
+            job.mensagem = f"{len(registros)} {texto} para o polo {p['polo']}."
+            if pz.parcial:
+                job.mensagem += f" Parcial: {pz.clientes_com_falha} clientes com falha."
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(RelatorioJob, job_id)
+            job.status = "erro"
+            job.mensagem = str(e)
+        job.atualizado_em = job.finalizado_em = time.time()
+        db.session.commit()
+
+
+def _limpar_jobs_antigos():
+    limite = time.time() - JOB_RETENCAO_HORAS * 3600
+    RelatorioJob.query.filter(RelatorioJob.finalizado_em < limite).delete(synchronize_session=False)
+
+
+def _job_ou_erro(job_id: str):
+    job = db.session.get(RelatorioJob, job_id)
+    if job is None:
+        return None, (jsonify({"status": "erro", "mensagem": "Job não encontrado (ou já expirado)."}), 200)
+    if job.status in ("pendente", "executando") and time.time() - job.atualizado_em > JOB_SEM_PROGRESSO:
+        job.status = "erro"
+        job.mensagem = "Job interrompido (worker reiniciado?). Envie de novo."
+        job.finalizado_em = time.time()
+        db.session.commit()
+    return job, None
+
+
+@app.route("/api/relatorios/jobs", methods=["POST"])
+def criar_job_relatorio():
+    ok, resp_err = ensure_asaas_configured()
+    if not ok:
+        return resp_err, 200
+
+    dados = request.get_json(silent=True) or {}
+    tipo = (dados.get("tipo") or "").strip().lower()
+    if tipo not in RELATORIOS_JOB:
+        return jsonify({"status": "erro", "mensagem": "tipo deve ser 'historico' ou 'pagamentos'"}), 200
+    if not dados.get("polo") or (tipo == "pagamentos" and not (dados.get("data_inicial") and dados.get("data_final"))):
+        obrigatorios = "polo" if tipo == "historico" else "polo, data_inicial, data_final"
+        return jsonify({"status": "erro", "mensagem": f"Campos obrigatórios: {obrigatorios}"}), 200
+
+    try:
+        p = RELATORIOS_JOB[tipo][0](dados)
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 200
+
+    _limpar_jobs_antigos()
+    agora = time.time()
+    job = RelatorioJob(
+        id=secrets.token_hex(16),
+        tipo=tipo,
+        parametros=app.json.dumps(p),
+        status="pendente",
+        criado_em=agora,
+        atualizado_em=agora,
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    _executor_jobs().submit(_executar_job, job.id)
+    return jsonify({"status": "ok", "mensagem": "Relatório enviado para processamento.", **job.to_dict()}), 200
+
+
+@app.route("/api/relatorios/jobs/<job_id>", methods=["GET"])
+def status_job_relatorio(job_id):
+    job, erro = _job_ou_erro(job_id)
+    if erro:
+        return erro
+    return jsonify({"status": "ok", **job.to_dict()}), 200
+
+
+@app.route("/api/relatorios/jobs/<job_id>/resultado", methods=["GET"])
+def resultado_job_relatorio(job_id):
+    job, erro = _job_ou_erro(job_id)
+    if erro:
+        return erro
+    if job.status != "concluido":
+        return jsonify({"status": "erro", **job.to_dict()}), 200
+
+    campo = RELATORIOS_JOB[job.tipo][4]
+    p = app.json.loads(job.parametros)
+    base = {"status": "ok", "mensagem": job.mensagem, "polo": p["polo"]}
+    if job.tipo == "pagamentos":
+        base.update({"data_inicial": p["data_inicial"], "data_final": p["data_final"]})
+    return resposta_json(base, campo, job.resultado), 200
+
+
 # ========= INIT DB =========
-with app.app_context():
+# O import não toca no banco: as tabelas e as chaves fixas são preparadas uma vez
+# por deploy, com `flask --app server init-db` ou pelo on_starting do gunicorn.conf.py.
+def _migrar_partners():
+    """
+    partners.expira_em era VARCHAR(10) com o texto do formulário. Os valores viram
+    AAAA-MM-DD (vazio ou inválido = NULL, que já era tratado como "não expira") e,
+    no PostgreSQL, a coluna passa a DATE. No SQLite o tipo declarado não importa:
+    basta o texto normalizado. Também cria em tabelas antigas os índices do modelo.
+    """
+    colunas = {c["name"]: c["type"] for c in sa_inspect(db.engine).get_columns("partners")}
+    with db.engine.begin() as conn:
+        if not isinstance(colunas.get("expira_em"), db.Date):
+            trocas = []
+            for (valor,) in conn.execute(db.text("SELECT DISTINCT expira_em FROM partners WHERE expira_em IS NOT NULL")):
+                try:
+                    data = parse_expira_em(valor)
+                except ValueError:
+                    data = None
+                novo = data.isoformat() if data else None
+                if novo != valor:
+                    trocas.append({"novo": novo, "antigo": valor})
+            if trocas:
+                conn.execute(db.text("UPDATE partners SET expira_em = :novo WHERE expira_em = :antigo"), trocas)
+            if conn.dialect.name == "postgresql":
+                conn.execute(db.text("ALTER TABLE partners ALTER COLUMN expira_em TYPE DATE USING expira_em::date"))
+        # create_all não cria índice novo em tabela que já existe
+        for indice in Partner.__table__.indexes:
+            conn.execute(CreateIndex(indice, if_not_exists=True))
+
+
+def bootstrap_db():
+    """Cria as tabelas que faltam, migra as antigas e grava as chaves fixas. Pode rodar de novo sem efeito."""
     db.create_all()
+    _migrar_partners()
     ensure_fixed_keys()
 
 
+@app.cli.command("init-db")
+def init_db_cmd():
+    """Prepara o banco (tabelas + chaves fixas)."""
+    inicio = time.perf_counter()
+    bootstrap_db()
+    click.echo(f"Banco pronto em {time.perf_counter() - inicio:.2f}s.")
+
+
 # ========= RUN LOCAL =========
 if __name__ == "__main__":
+    with app.app_context():
+        bootstrap_db()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=True)
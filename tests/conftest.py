@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# o server.py lê a configuração no import: banco SQLite temporário só dos testes
+_TMP = tempfile.mkdtemp(prefix="controle_polos_testes_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'testes.db')}"
+os.environ.setdefault("ASAAS_API_KEY", "teste")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def banco():
+    """Banco vazio e preparado como no deploy (bootstrap_db), dentro de um app context."""
+    with server.app.app_context():
+        server.db.drop_all()
+        server.bootstrap_db()
+        yield server.db
+        server.db.session.remove()
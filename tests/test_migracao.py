@@ -0,0 +1,65 @@
+from datetime import date
+
+import pytest
+
+import server
+from server import Partner, db
+
+# tabela partners como o código original criava (expira_em em texto, sem índices)
+PARTNERS_ANTIGA = """
+CREATE TABLE partners (
+    chave VARCHAR(32) NOT NULL PRIMARY KEY,
+    nome VARCHAR(200) NOT NULL,
+    polo VARCHAR(200),
+    expira_em VARCHAR(10)
+)
+"""
+
+
+@pytest.fixture
+def banco_antigo():
+    with server.app.app_context():
+        db.drop_all()
+        with db.engine.begin() as conn:
+            conn.execute(db.text(PARTNERS_ANTIGA))
+            conn.execute(
+                db.text("INSERT INTO partners VALUES (:chave, :nome, :polo, :expira_em)"),
+                [
+                    {"chave": "ATIVA", "nome": "Ana", "polo": "Polo A", "expira_em": "2099-01-31"},
+                    {"chave": "BR", "nome": "Bia", "polo": "Polo B", "expira_em": "31/12/2020"},
+                    {"chave": "VAZIA", "nome": "Caio", "polo": "Polo C", "expira_em": ""},
+                    {"chave": "LIXO", "nome": "Davi", "polo": None, "expira_em": "amanhã"},
+                ],
+            )
+        yield db
+        db.session.remove()
+
+
+def _indices_partners():
+    return {
+        nome
+        for (nome,) in db.session.execute(
+            db.text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'partners'")
+        )
+    }
+
+
+def test_bootstrap_migra_partners_antiga(banco_antigo):
+    server.bootstrap_db()
+    server.bootstrap_db()  # de novo: sem efeito
+
+    assert {p.chave: p.expira_em for p in Partner.query.filter(~Partner.chave.in_(server.FIXED_KEYS))} == {
+        "ATIVA": date(2099, 1, 31),
+        "BR": date(2020, 12, 31),
+        "VAZIA": None,
+        "LIXO": None,
+    }
+    assert set(server.FIXED_KEYS) <= {p.chave for p in Partner.query}
+    assert {p.chave for p in Partner.query.filter(server.parceiro_expirado())} == {"BR"}
+
+    assert {
+        "ix_partners_nome",
+        "ix_partners_polo",
+        "ix_partners_polo_lower",
+        "ix_partners_expira_em",
+    } <= _indices_partners()
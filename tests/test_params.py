@@ -0,0 +1,27 @@
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize(
+    "corpo, mensagem",
+    [
+        ({"tipo": "historico", "polo": "x", "max_clientes": "abc"}, "max_clientes deve ser um número inteiro"),
+        ({"tipo": "historico", "polo": "x", "max_registros": [1]}, "max_registros deve ser um número inteiro"),
+        ({"tipo": "historico", "polo": "x", "data_final": 20250101}, "data_final deve estar no formato YYYY-MM-DD"),
+        (
+            {"tipo": "pagamentos", "polo": "x", "data_inicial": "2025-01-01", "data_final": "01/02/2025"},
+            "data_final deve estar no formato YYYY-MM-DD",
+        ),
+    ],
+)
+def test_job_com_parametro_invalido_diz_qual_campo(banco, corpo, mensagem):
+    resp = server.app.test_client().post("/api/relatorios/jobs", json=corpo)
+    assert resp.status_code == 200
+    assert resp.get_json() == {"status": "erro", "mensagem": mensagem}
+
+
+def test_limite_nulo_usa_o_padrao():
+    p = server._params_historico({"polo": "x", "max_clientes": None, "data_inicial": "2025-1-5"})
+    assert p["max_clientes"] == server.DEFAULT_MAX_CLIENTES
+    assert p["data_inicial"] == "2025-01-05"
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+import server
+from server import Circuito, CircuitoAberto, Prazo, PrazoEsgotado, VooUnico
+
+
+def test_prazo_timeout():
+    assert Prazo(None).timeout(30) == 30
+    assert Prazo(10).timeout(2) == 2
+    assert 9 < Prazo(10).timeout(30) <= 10
+    with pytest.raises(PrazoEsgotado):
+        Prazo(0).timeout(30)
+
+    pz = Prazo(10)
+    assert not pz.parcial
+    pz.paginas_puladas += 1
+    assert pz.parcial and pz.to_dict()["paginas_puladas"] == 1
+
+
+def test_circuito_abre_e_deixa_um_teste_por_vez():
+    c = Circuito(2, 0.05)
+    c.registrar(False)
+    c.registrar(None)  # 429 / timeout encurtado: não conta
+    c.permitir()
+    c.registrar(False)
+    with pytest.raises(CircuitoAberto):
+        c.permitir()
+
+    time.sleep(0.06)
+    c.permitir()  # chamada de teste
+    with pytest.raises(CircuitoAberto):
+        c.permitir()  # só uma por vez
+    c.registrar(True)
+    c.permitir()
+    c.permitir()
+
+
+def test_circuito_teste_sem_resposta_vence():
+    c = Circuito(1, 0.05)
+    c.registrar(False)
+    time.sleep(0.06)
+    c.permitir(timeout=0.05)  # teste que nunca chama registrar()
+    with pytest.raises(CircuitoAberto):
+        c.permitir()
+    time.sleep(1.1)  # timeout do teste + 1 s
+    c.permitir()
+
+
+def test_voo_unico_seguidor_refaz_quando_o_prazo_do_lider_acaba():
+    voo = VooUnico()
+    chamadas = []
+    comecou = threading.Event()
+
+    def buscar():
+        chamadas.append(1)
+        comecou.set()
+        pz = server.prazo_atual()
+        for _ in range(4):
+            time.sleep(0.05)
+            if pz is not None:
+                pz.timeout(1)
+        return "dados"
+
+    resultados = {}
+
+    def lider():
+        with server.com_prazo(0.1):
+            try:
+                resultados["lider"] = voo.executar("k", buscar)
+            except PrazoEsgotado:
+                resultados["lider"] = "prazo"
+
+    def seguidor():
+        comecou.wait()
+        with server.com_prazo(None):
+            resultados["seguidor"] = voo.executar("k", buscar)
+
+    threads = [threading.Thread(target=lider), threading.Thread(target=seguidor)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert resultados == {"lider": "prazo", "seguidor": "dados"}
+    assert len(chamadas) == 2
+
+
+def test_consulta_da_conta_devolve_o_que_leu_quando_o_prazo_acaba(banco, monkeypatch):
+    clientes = [{"id": cid, "name": cid} for cid in ("cus_1", "cus_2", "cus_3")]
+    paginas = {
+        0: [{"id": "pay_a", "customer": "cus_1"}, {"id": "pay_x", "customer": "cus_9"}],
+        100: [{"id": "pay_b", "customer": "cus_2"}],
+    }
+
+    def pagina(params, offset, limit=100):
+        if offset not in paginas:
+            raise PrazoEsgotado("prazo do relatório esgotado")
+        return {"data": paginas[offset], "hasMore": True, "totalCount": 300}
+
+    def por_cliente(*args, **kwargs):
+        raise AssertionError("não deve cair na busca por cliente")
+
+    monkeypatch.setattr(server, "fetch_payments_pagina", pagina)
+    monkeypatch.setattr(server, "fetch_payments_todas", por_cliente)
+
+    p = {"estrategia": "conta", "max_faturas_cliente": 100, "max_concorrencia": 1}
+    with server.com_prazo(None) as pz:
+        lidos = list(server._faturas_dos_clientes(clientes, p, {"status": "RECEIVED"}))
+
+    assert [(cli["id"], [f["id"] for f in lista]) for cli, lista in lidos] == [
+        ("cus_1", ["pay_a"]),
+        ("cus_2", ["pay_b"]),
+    ]
+    assert (pz.clientes_pulados, pz.clientes_com_falha, pz.paginas_puladas) == (1, 0, 1)
+    assert pz.parcial
+
+
+def test_visao_geral_sem_tempo_para_a_conta_toda_sai_parcial_e_fora_do_cache(banco, monkeypatch):
+    server._upsert_customers(
+        [{"id": "cus_1", "complement": "Polo A"}, {"id": "cus_2", "complement": "Polo B"}], time.time()
+    )
+    server.db.session.commit()
+
+    def pagina(params, offset, limit=100):
+        if offset:
+            raise PrazoEsgotado("prazo do relatório esgotado")
+        fat = {"id": "pay_a", "customer": "cus_1", "status": "RECEIVED", "value": 10.0, "netValue": 9.0}
+        return {"data": [fat], "hasMore": True, "totalCount": 300}
+
+    monkeypatch.setattr(server, "garantir_clientes_sincronizados", lambda: None)
+    monkeypatch.setattr(server, "fetch_payments_pagina", pagina)
+    server.visao_geral_cache.invalidar()
+
+    cliente = server.app.test_client()
+    corpo = {"data_inicial": "2025-01-01", "data_final": "2025-01-31"}
+    for _ in range(2):
+        resp = cliente.post("/api/visao_geral", json=corpo)
+        j = resp.get_json()
+        assert (j["status"], j["parcial"], j["paginas_puladas"]) == ("ok", True, 4)
+        assert j["total"]["valor_liquido_recebido"] == 9.0
+        assert "ETag" not in resp.headers
+        assert resp.headers["X-Cache"] == "miss"
@@ -0,0 +1,146 @@
+import time
+
+import server
+from server import PoloPagamentoDiario, db
+
+
+def _cliente(cid, polo):
+    server._upsert_customers([{"id": cid, "name": cid, "complement": polo}], time.time())
+    db.session.commit()
+
+
+def _evento(cid, status="RECEIVED", dia="2025-01-02", removido=False, pid="pay_1"):
+    fat = {
+        "id": pid,
+        "customer": cid,
+        "status": status,
+        "value": 100.0,
+        "netValue": 97.5,
+        "dueDate": dia,
+        "paymentDate": dia if status == "RECEIVED" else None,
+    }
+    server.upsert_payment(fat, removido=removido)
+    db.session.commit()
+
+
+def _totais():
+    return {
+        (r.polo_norm, r.dia): (r.quantidade, r.valor, r.valor_liquido)
+        for r in PoloPagamentoDiario.query.all()
+        if r.quantidade or r.valor or r.valor_liquido
+    }
+
+
+def test_totais_acompanham_status_data_e_remocao(banco):
+    _cliente("cus_1", "Polo A")
+
+    _evento("cus_1", status="PENDING")
+    assert _totais() == {}
+
+    _evento("cus_1")
+    assert _totais() == {("polo a", "2025-01-02"): (1, 100.0, 97.5)}
+
+    # o Asaas reenvia o mesmo estado: nada muda
+    _evento("cus_1")
+    assert _totais() == {("polo a", "2025-01-02"): (1, 100.0, 97.5)}
+
+    _evento("cus_1", dia="2025-01-05")
+    assert _totais() == {("polo a", "2025-01-05"): (1, 100.0, 97.5)}
+
+    _evento("cus_1", status="REFUNDED", dia="2025-01-05")
+    assert _totais() == {}
+
+    _evento("cus_1", dia="2025-01-05")
+    _evento("cus_1", pid="pay_2")
+    assert _totais() == {
+        ("polo a", "2025-01-02"): (1, 100.0, 97.5),
+        ("polo a", "2025-01-05"): (1, 100.0, 97.5),
+    }
+
+    _evento("cus_1", dia="2025-01-05", removido=True)
+    assert _totais() == {("polo a", "2025-01-02"): (1, 100.0, 97.5)}
+
+
+def test_cliente_que_muda_de_polo_leva_os_totais(banco):
+    _cliente("cus_1", "Polo A")
+    _cliente("cus_2", "Polo A")
+    _evento("cus_1", pid="pay_1")
+    _evento("cus_2", pid="pay_2")
+    assert _totais() == {("polo a", "2025-01-02"): (2, 200.0, 195.0)}
+
+    _cliente("cus_2", " Polo B ")
+    assert _totais() == {
+        ("polo a", "2025-01-02"): (1, 100.0, 97.5),
+        ("polo b", "2025-01-02"): (1, 100.0, 97.5),
+    }
+
+    # mesmo resultado que reconstruir tudo a partir do livro
+    antes = _totais()
+    server.recalcular_resumos()
+    assert _totais() == antes
+
+
+def test_soma_no_banco_sem_perder_linha_gravada_por_outro_worker(banco):
+    _cliente("cus_1", "Polo A")
+    # outro worker já criou a linha do dia depois que esta sessão começou
+    db.session.execute(
+        PoloPagamentoDiario.__table__.insert(),
+        {"polo_norm": "polo a", "dia": "2025-01-02", "quantidade": 3, "valor": 300.0, "valor_liquido": 292.5},
+    )
+    _evento("cus_1")
+    assert _totais() == {("polo a", "2025-01-02"): (4, 400.0, 390.0)}
+
+
+def test_livro_so_responde_com_webhook_e_carga_recente(banco, monkeypatch):
+    _cliente("cus_1", "Polo A")
+    server.AsaasCustomer.query.update({"pagamentos_sync_em": time.time()})
+    server._set_state("pagamentos_backfill", time.time())
+    db.session.commit()
+
+    monkeypatch.setattr(server, "ASAAS_WEBHOOK_TOKEN", "")
+    assert server.clientes_no_livro(["cus_1"]) == set()
+
+    monkeypatch.setattr(server, "ASAAS_WEBHOOK_TOKEN", "segredo")
+    assert server.clientes_no_livro(["cus_1"]) == {"cus_1"}
+
+    # última conciliação velha demais: volta a consulta ao vivo
+    server._set_state("pagamentos_backfill", time.time() - (server.LIVRO_VALIDADE_HORAS + 1) * 3600)
+    db.session.commit()
+    assert server.clientes_no_livro(["cus_1"]) == set()
+
+
+def test_cliente_novo_so_entra_no_livro_com_webhook(banco, monkeypatch):
+    server._set_state("pagamentos_backfill", time.time() - 86400 * 2)
+    db.session.commit()
+
+    monkeypatch.setattr(server, "ASAAS_WEBHOOK_TOKEN", "")
+    server._upsert_customers([{"id": "cus_1", "dateCreated": "2099-01-01"}], time.time())
+    monkeypatch.setattr(server, "ASAAS_WEBHOOK_TOKEN", "segredo")
+    server._upsert_customers([{"id": "cus_2", "dateCreated": "2099-01-01"}], time.time())
+    db.session.commit()
+
+    assert db.session.get(server.AsaasCustomer, "cus_1").pagamentos_sync_em is None
+    assert db.session.get(server.AsaasCustomer, "cus_2").pagamentos_sync_em is not None
+
+
+def test_conciliacao_remove_faturas_que_sumiram_do_asaas(banco, monkeypatch):
+    _cliente("cus_1", "Polo A")
+    _evento("cus_1", pid="pay_1")
+    _evento("cus_1", pid="pay_2")
+    assert _totais() == {("polo a", "2025-01-02"): (2, 200.0, 195.0)}
+
+    # o Asaas só devolve pay_1: o evento de remoção de pay_2 se perdeu
+    restante = {
+        "id": "pay_1", "customer": "cus_1", "status": "RECEIVED", "value": 100.0,
+        "netValue": 97.5, "dueDate": "2025-01-02", "paymentDate": "2025-01-02",
+    }
+    monkeypatch.setattr(server, "sincronizar_clientes", lambda **kw: 0)
+    monkeypatch.setattr(
+        server, "fetch_payments_pagina",
+        lambda params, offset, limit=100: {"data": [restante], "totalCount": 1, "hasMore": False},
+    )
+    server.sincronizar_pagamentos()
+
+    assert db.session.get(server.AsaasPayment, "pay_2").removido
+    assert not db.session.get(server.AsaasPayment, "pay_1").removido
+    assert _totais() == {("polo a", "2025-01-02"): (1, 100.0, 97.5)}